@@ -0,0 +1,244 @@
+# 客户端内存基准：把合成的 READY、GUILD_CREATE 和 MESSAGE_CREATE 网关事件直接交给
+# src.main 中客户端的解析函数，比较默认模式和精简模式（LEAN_RUNTIME）下的常驻内存
+# 每种模式和服务器数在单独的子进程中运行，互不影响
+# 用法: python -m benchmarks.client_memory --guilds 1000,10000,50000
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.common import setup_env
+
+ALLOWED_GUILDS = 5  # 允许列表中的服务器数，其余服务器的事件在精简模式下被丢弃
+CHANNELS_PER_GUILD = 8
+ROLES_PER_GUILD = 10
+EMOJIS_PER_GUILD = 5
+THREADS_PER_GUILD = 2
+MESSAGES_PER_GUILD = 2
+BOT_USER_ID = 1 << 40
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", default="1000,10000,50000", help="逗号分隔的服务器数")
+    parser.add_argument("--worker", nargs=2, metavar=("PROFILE", "GUILDS"), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# 当前进程的常驻内存（MB）
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / 2**20
+
+
+def guild_id(i: int) -> int:
+    return (i + 1) << 22
+
+
+def user_payload(user_id: int, bot: bool = False) -> dict:
+    return {
+        "id": str(user_id),
+        "username": f"user{user_id}",
+        "discriminator": "0001",
+        "avatar": None,
+        "bot": bot,
+    }
+
+
+# 没有成员特权意图时 Discord 发送的服务器数据：频道、角色、表情、活跃线程，成员只有机器人自己
+def guild_payload(i: int) -> dict:
+    gid = guild_id(i)
+    channels = [
+        {
+            "id": str(gid + 1 + c),
+            "type": 0,
+            "name": f"channel-{c}",
+            "position": c,
+            "permission_overwrites": [],
+            "topic": "general discussion",
+            "nsfw": False,
+            "parent_id": None,
+            "rate_limit_per_user": 0,
+            "guild_id": str(gid),
+        }
+        for c in range(CHANNELS_PER_GUILD)
+    ]
+    threads = [
+        {
+            "id": str(gid + 1000 + t),
+            "type": 11,
+            "name": f"thread-{t}",
+            "parent_id": str(gid + 1),
+            "owner_id": str(BOT_USER_ID),
+            "guild_id": str(gid),
+            "message_count": 3,
+            "member_count": 2,
+            "rate_limit_per_user": 0,
+            "thread_metadata": {
+                "archived": False,
+                "auto_archive_duration": 60,
+                "archive_timestamp": "2023-01-01T00:00:00+00:00",
+                "locked": False,
+            },
+        }
+        for t in range(THREADS_PER_GUILD)
+    ]
+    roles = [
+        {
+            "id": str(gid if r == 0 else gid + 2000 + r),
+            "name": "@everyone" if r == 0 else f"role-{r}",
+            "color": 0,
+            "hoist": False,
+            "position": r,
+            "permissions": "1071698660929",
+            "managed": False,
+            "mentionable": False,
+        }
+        for r in range(ROLES_PER_GUILD)
+    ]
+    emojis = [
+        {"id": str(gid + 3000 + e), "name": f"emoji{e}", "roles": [], "require_colons": True, "managed": False, "animated": False, "available": True}
+        for e in range(EMOJIS_PER_GUILD)
+    ]
+    return {
+        "id": str(gid),
+        "name": f"guild-{i}",
+        "icon": None,
+        "owner_id": str(gid + 5000),
+        "afk_timeout": 300,
+        "verification_level": 1,
+        "default_message_notifications": 1,
+        "explicit_content_filter": 0,
+        "features": [],
+        "mfa_level": 0,
+        "system_channel_flags": 0,
+        "premium_tier": 0,
+        "preferred_locale": "en-US",
+        "nsfw_level": 0,
+        "large": False,
+        "unavailable": False,
+        "member_count": 120,
+        "joined_at": "2023-01-01T00:00:00+00:00",
+        "roles": roles,
+        "emojis": emojis,
+        "stickers": [],
+        "channels": channels,
+        "threads": threads,
+        "members": [{"user": user_payload(BOT_USER_ID, bot=True), "roles": [], "joined_at": "2023-01-01T00:00:00+00:00", "deaf": False, "mute": False}],
+        "voice_states": [],
+        "presences": [],
+        "stage_instances": [],
+        "guild_scheduled_events": [],
+    }
+
+
+def message_payload(i: int, m: int) -> dict:
+    gid = guild_id(i)
+    return {
+        "id": str(gid + 4000 + m),
+        "channel_id": str(gid + 1000 + m % THREADS_PER_GUILD),
+        "guild_id": str(gid),
+        "author": user_payload(gid + 6000 + m),
+        "content": "hello there, can you help me with something? " * 4,
+        "timestamp": "2023-01-01T00:00:00+00:00",
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+
+
+# 子进程：导入机器人客户端，依次交给解析函数 READY、每个服务器的 GUILD_CREATE 和若干条消息，
+# 耗时包括生成事件数据的时间
+def worker(profile: str, guilds: int):
+    setup_env(
+        LEAN_RUNTIME="1" if profile == "lean" else "0",
+        ALLOWED_SERVER_IDS=",".join(str(guild_id(i)) for i in range(ALLOWED_GUILDS)),
+    )
+    from src import main as bot
+
+    logging.getLogger().setLevel(logging.WARNING)
+    client = bot.client
+    state = client._connection
+
+    async def feed() -> float:
+        # 代替登录：绑定事件循环
+        await client._async_setup_hook()
+        parsers = state.parsers
+        started = time.perf_counter()
+        parsers["READY"](
+            {
+                "v": 10,
+                "user": user_payload(BOT_USER_ID, bot=True),
+                "guilds": [{"id": str(guild_id(i)), "unavailable": True} for i in range(guilds)],
+                "session_id": "bench",
+                "resume_gateway_url": "wss://gateway.invalid",
+                "application": {"id": "1", "flags": 0},
+            }
+        )
+        for i in range(guilds):
+            parsers["GUILD_CREATE"](guild_payload(i))
+        for i in range(guilds):
+            for m in range(MESSAGES_PER_GUILD):
+                parsers["MESSAGE_CREATE"](message_payload(i, m))
+        elapsed = time.perf_counter() - started
+        # 不触发 on_ready（它会同步命令）
+        state._ready_task.cancel()
+        await asyncio.sleep(0.1)
+        return elapsed
+
+    baseline = rss_mb()
+    elapsed = asyncio.run(feed())
+    gc.collect()
+    print(
+        json.dumps(
+            {
+                "profile": profile,
+                "guilds": guilds,
+                "cached_guilds": len(client.guilds),
+                "cached_messages": len(client.cached_messages),
+                "rss_mb": rss_mb(),
+                "growth_mb": rss_mb() - baseline,
+                "feed_seconds": elapsed,
+            }
+        )
+    )
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        worker(args.worker[0], int(args.worker[1]))
+        return
+    print(f"{'profile':>8} {'guilds':>7} {'cached':>7} {'messages':>9} {'rss(MB)':>8} {'growth(MB)':>11} {'feed(s)':>9}")
+    for guilds in (int(g) for g in args.guilds.split(",")):
+        for profile in ("default", "lean"):
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.client_memory", "--worker", profile, str(guilds)],
+                capture_output=True,
+                text=True,
+                check=True,
+                env=dict(os.environ),
+            ).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            print(
+                f"{result['profile']:>8} {result['guilds']:>7} {result['cached_guilds']:>7} "
+                f"{result['cached_messages']:>9} {result['rss_mb']:>8.1f} {result['growth_mb']:>11.1f} "
+                f"{result['feed_seconds']:>9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
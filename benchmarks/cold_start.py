@@ -0,0 +1,108 @@
+# 冷启动基准：从启动进程到处理完第一个事件（/chat 命令发出第一条回复）的时间。
+# 每次在新的子进程中运行，网关连接用固定延迟模拟，OpenAI 使用本地桩服务
+#   eager: 没有配置快照，并在启动时导入 openai（与之前的启动流程相同）
+#   cold:  没有配置快照，openai 在连接网关时于后台导入
+#   warm:  使用上次启动保存的配置快照
+# 用法: python -m benchmarks.cold_start --runs 5 --gateway-latency 0.5
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import setup_env
+from benchmarks.stub_server import StubOpenAIServer
+
+MODES = ("eager", "cold", "warm")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5, help="每种模式的运行次数")
+    parser.add_argument("--gateway-latency", type=float, default=0.5, help="登录并收到 READY 的模拟耗时（秒）")
+    parser.add_argument("--latency", type=float, default=0.05, help="OpenAI 桩服务的延迟（秒）")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# 子进程：导入机器人，执行 setup_hook，等待模拟的网关连接，然后处理一次 /chat
+def worker(mode: str, gateway_latency: float):
+    launched = float(os.environ["COLD_START_LAUNCHED_AT"])
+    setup_env()
+    if mode == "eager":
+        import openai  # noqa: F401
+
+    from benchmarks.fake_discord import FakeDiscord, FakeGuild, FakeInteraction, FakeTextChannel, FakeUser
+    from src import completion, main as bot
+    from src.constants import DEFAULT_MODEL, EXAMPLE_CONVOS
+
+    imported = time.time() - launched
+
+    async def run() -> dict:
+        await bot.client._async_setup_hook()
+        await bot.client.setup_hook()
+        await asyncio.sleep(gateway_latency)
+        fake = FakeDiscord()
+        bot_user = FakeUser("GPTBot", bot=True)
+        bot.client._connection.user = bot_user
+        completion.set_bot_identity(name=bot_user.name, example_convos=EXAMPLE_CONVOS)
+        ready = time.time() - launched
+
+        channel = FakeTextChannel(FakeGuild(fake, 1), bot_user)
+        replied = asyncio.get_running_loop().create_future()
+        fake.on_send = lambda message: message.content and not replied.done() and replied.set_result(None)
+        await bot.chat_command.callback(
+            FakeInteraction(channel, FakeUser("user")),
+            message="hello, what can you do?",
+            model=DEFAULT_MODEL,
+            temperature=1.0,
+            max_tokens=64,
+        )
+        await asyncio.wait_for(replied, 30)
+        first_event = time.time() - launched
+        await bot.client.close()
+        return {"import": imported, "ready": ready, "first_event": first_event}
+
+    logging.getLogger().setLevel(logging.WARNING)
+    print(json.dumps(asyncio.run(run())))
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        worker(args.worker, args.gateway_latency)
+        return
+    cache_dir = tempfile.mkdtemp(prefix="startup-cache-")
+    results = {mode: [] for mode in MODES}
+    try:
+        with StubOpenAIServer(latency=args.latency) as stub:
+            env = dict(os.environ, OPENAI_BASE_URL=stub.base_url, STARTUP_CACHE_DIR=cache_dir)
+            for _ in range(args.runs):
+                for mode in MODES:
+                    if mode != "warm":
+                        shutil.rmtree(cache_dir, ignore_errors=True)
+                    env["COLD_START_LAUNCHED_AT"] = repr(time.time())
+                    out = subprocess.run(
+                        [sys.executable, "-m", "benchmarks.cold_start", "--worker", mode,
+                         "--gateway-latency", str(args.gateway_latency)],
+                        capture_output=True, text=True, check=True, env=env,
+                    ).stdout
+                    results[mode].append(json.loads(out.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(f"median of {args.runs} runs, gateway connect simulated as {args.gateway_latency}s")
+    print(f"{'mode':>6} {'import(s)':>10} {'ready(s)':>9} {'first event(s)':>15}")
+    for mode in MODES:
+        row = [statistics.median(r[key] for r in results[mode]) for key in ("import", "ready", "first_event")]
+        print(f"{mode:>6} {row[0]:>10.3f} {row[1]:>9.3f} {row[2]:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# 基准测试的公共工具
+import asyncio
+import os
+import statistics
+import time
+from typing import List
+
+
+# 在导入 src 之前设置必要的环境变量
+def setup_env(**overrides):
+    defaults = {
+        "DISCORD_BOT_TOKEN": "bench",
+        "DISCORD_CLIENT_ID": "0",
+        "OPENAI_API_KEY": "sk-bench",
+        "DEFAULT_MODEL": "gpt-3.5-turbo",
+        "ALLOWED_SERVER_IDS": "1",
+        "SERVER_TO_MODERATION_CHANNEL": "1:2",
+    }
+    defaults.update(overrides)
+    for key, value in defaults.items():
+        os.environ.setdefault(key, str(value))
+
+
+# 百分位数
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name: str, samples: List[float], unit: str = "ms", scale: float = 1000):
+    if not samples:
+        print(f"{name}: no samples")
+        return
+    print(
+        f"{name}: n={len(samples)} "
+        f"mean={statistics.mean(samples) * scale:.2f}{unit} "
+        f"p50={percentile(samples, 50) * scale:.2f}{unit} "
+        f"p99={percentile(samples, 99) * scale:.2f}{unit} "
+        f"max={max(samples) * scale:.2f}{unit}"
+    )
+
+
+# 通过周期性的定时任务测量事件循环的卡顿时间
+class LoopLagProbe:
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,46 @@
+# 上下文装箱耗时基准测试：200 条消息的线程，首轮（冷缓存）与后续轮次（只新增一条消息）
+# 用法: python -m benchmarks.context_packing [消息数] [轮数]
+import random
+import sys
+import time
+
+from benchmarks.common import setup_env, summarize
+
+setup_env()
+
+from src.base import Message  # noqa: E402
+from src import tokens  # noqa: E402
+from src.tokens import pack_messages, preload_encodings  # noqa: E402
+
+WORDS = "the quick brown fox jumps over lazy dog lol idk np hbu pokemon zoo rain".split()
+
+
+def random_message(i: int) -> Message:
+    text = " ".join(random.choice(WORDS) for _ in range(random.randint(5, 120)))
+    return Message(user=f"user{i % 5}", text=f"{i} {text}")
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    messages = [random_message(i) for i in range(size)]
+    preload_encodings(["gpt-3.5-turbo", "gpt-4", "gpt-4-32k"])
+    for model in ("gpt-3.5-turbo", "gpt-4", "gpt-4-32k"):
+        tokens._exact_tokens.cache_clear()
+        tokens._message_tokens.cache_clear()
+        start = time.perf_counter()
+        packed = pack_messages(model, messages, system_tokens=300, max_tokens=512)
+        cold = time.perf_counter() - start
+        samples = []
+        convo = list(messages)
+        for turn in range(turns):
+            convo = convo[1:] + [random_message(size + turn)]
+            start = time.perf_counter()
+            pack_messages(model, convo, system_tokens=300, max_tokens=512)
+            samples.append(time.perf_counter() - start)
+        print(f"[{model}] cold pack of {size} messages: {cold * 1000:.2f}ms, kept {len(packed)}")
+        summarize(f"[{model}] warm pack per turn", samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# 对话缓存的内存和分配基准：比较之前的表示（带 __dict__ 的消息、每条消息独立的用户名字符串、
+# 按 ID 索引的 OrderedDict）和现在的表示（__slots__ 消息、驻留的用户名、环形缓冲区）
+# 用法: python -m benchmarks.conversation_memory --threads 2000
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import List, Optional
+
+from benchmarks.common import setup_env
+
+setup_env()
+
+from src.base import Conversation, Message, Prompt, ThreadSummary  # noqa: E402
+from src.constants import MAX_THREAD_MESSAGES  # noqa: E402
+from src.summary import ThreadSummarizer  # noqa: E402
+
+USERS_PER_THREAD = 3
+BOT_NAME = "GPTBot"
+
+
+# 之前的消息类
+@dataclass(frozen=True)
+class LegacyMessage:
+    user: str
+    text: Optional[str] = None
+
+    def render(self):
+        result = self.user + ":"
+        if self.text is not None:
+            result += " " + self.text
+        return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=2000, help="缓存的线程数")
+    parser.add_argument("--messages", type=int, default=MAX_THREAD_MESSAGES, help="每个线程的消息数")
+    parser.add_argument("--turns", type=int, default=2000, help="测量分配时渲染的轮数")
+    return parser.parse_args()
+
+
+# 网关每条消息都会解析出新的用户名字符串；一半是机器人的回复
+def author_name(thread: int, i: int) -> str:
+    if i % 2:
+        return f"{BOT_NAME[:3]}{BOT_NAME[3:]}"
+    return f"user{thread % 500}-{i % USERS_PER_THREAD}"
+
+
+def text(i: int) -> str:
+    return f"message {i}: could you explain how this part works in a bit more detail?"
+
+
+def build_legacy(threads: int, messages: int):
+    cache = {}
+    for t in range(threads):
+        entry = OrderedDict()
+        for i in range(messages):
+            entry[10**17 + t * 10**6 + i] = LegacyMessage(user=author_name(t, i), text=text(i))
+        cache[t] = entry
+    return cache
+
+
+def build_compact(threads: int, messages: int):
+    cache = {}
+    for t in range(threads):
+        entry = deque(maxlen=MAX_THREAD_MESSAGES)
+        for i in range(messages):
+            entry.append((10**17 + t * 10**6 + i, Message(user=sys.intern(author_name(t, i)), text=text(i))))
+        cache[t] = entry
+    return cache
+
+
+# 构建缓存后 tracemalloc 统计的堆内存（MB）和用时
+def measure_heap(build, threads: int, messages: int):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    cache = build(threads, messages)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del cache
+    return current / 2**20, elapsed
+
+
+# 之前每轮的路径：复制 (ID, 消息) 列表，逐条过滤出摘要之后的消息，逐条追加渲染结果
+def legacy_turn(entry: "OrderedDict[int, LegacyMessage]", through_id: int) -> List[dict]:
+    history = list(entry.items())
+    recent = [message for message_id, message in history if message_id > through_id]
+    rendered = [{"role": "system", "content": "instructions"}]
+    for message in recent:
+        if BOT_NAME not in message.user:
+            rendered.append({"role": "user", "name": message.user, "content": message.text})
+        else:
+            rendered.append({"role": "assistant", "name": BOT_NAME, "content": message.text})
+    return rendered
+
+
+# 现在每轮的路径：与 src.history、src.summary 和 src.base 相同
+def compact_turn(entry: "deque", through_id: int, summarizer: ThreadSummarizer) -> List[dict]:
+    history = list(entry)
+    recent = summarizer.recent(history, ThreadSummary("", through_id))
+    prompt = Prompt(
+        header=Message("system", "instructions"),
+        examples=[],
+        convo=Conversation(recent),
+        system_prompt="instructions",
+    )
+    return prompt.full_render(BOT_NAME)
+
+
+# 每轮的临时分配峰值（KB）和用时（微秒）
+def measure_turn(turn, turns: int):
+    turn()
+    gc.collect()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    turn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for _ in range(turns):
+        turn()
+    elapsed = time.perf_counter() - started
+    return (peak - base) / 1024, elapsed / turns * 1e6
+
+
+def main():
+    args = parse_args()
+    print(f"{args.threads} threads x {args.messages} messages")
+    legacy_mb, legacy_s = measure_heap(build_legacy, args.threads, args.messages)
+    compact_mb, compact_s = measure_heap(build_compact, args.threads, args.messages)
+    print(f"{'':>8} {'heap(MB)':>9} {'bytes/msg':>10} {'build(s)':>9}")
+    total = args.threads * args.messages
+    for name, mb, seconds in (("legacy", legacy_mb, legacy_s), ("compact", compact_mb, compact_s)):
+        print(f"{name:>8} {mb:>9.1f} {mb * 2**20 / total:>10.0f} {seconds:>9.2f}")
+    print(f"heap saved: {1 - compact_mb / legacy_mb:.0%}")
+
+    # 一半的消息已折叠进摘要时，每轮取出并渲染剩余的消息
+    legacy = build_legacy(1, args.messages)[0]
+    compact = build_compact(1, args.messages)[0]
+    through_id = 10**17 + args.messages // 2
+    summarizer = ThreadSummarizer(None, True, 0, 0, 0)
+    legacy_kb, legacy_us = measure_turn(lambda: legacy_turn(legacy, through_id), args.turns)
+    compact_kb, compact_us = measure_turn(
+        lambda: compact_turn(compact, through_id, summarizer), args.turns
+    )
+    print(f"{'':>8} {'turn peak(KB)':>14} {'turn(us)':>9}")
+    print(f"{'legacy':>8} {legacy_kb:>14.1f} {legacy_us:>9.1f}")
+    print(f"{'compact':>8} {compact_kb:>14.1f} {compact_us:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
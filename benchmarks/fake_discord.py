@@ -0,0 +1,260 @@
+# 假的 Discord 对象模型（服务器、频道、线程、消息、交互），
+# 用于在无网络环境下驱动 src.main 的事件处理
+import asyncio
+import itertools
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import discord
+
+# 递增的消息和频道 ID，与真实的雪花 ID 一样按时间排序
+_snowflakes = itertools.count(10**17)
+
+
+def next_snowflake() -> int:
+    return next(_snowflakes)
+
+
+# 模拟 Discord REST 接口：统一的延迟和调用计数，以及网关事件回传
+class FakeDiscord:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency  # 每次 REST 调用的模拟延迟（秒）
+        self.rest_calls = 0
+        self.on_message: Optional[Callable[["FakeMessage"], Awaitable[None]]] = None
+        self.on_send: Optional[Callable[["FakeMessage"], None]] = None
+        self._tasks = set()
+
+    async def rest(self):
+        self.rest_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    # 像网关一样把新消息回传给机器人
+    def dispatch(self, message: "FakeMessage"):
+        if self.on_send is not None:
+            self.on_send(message)
+        if self.on_message is not None:
+            task = asyncio.get_running_loop().create_task(self.on_message(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+
+class FakeUser:
+    def __init__(self, name: str, bot: bool = False):
+        self.id = next_snowflake()
+        self.name = name
+        self.bot = bot
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, discord_: FakeDiscord, guild_id: int, shard_id: int = 0):
+        self.discord = discord_
+        self.id = guild_id
+        self.shard_id = shard_id
+        self.name = f"guild-{guild_id}"
+        self.channels: Dict[int, discord.abc.GuildChannel] = {}
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    async def fetch_channel(self, channel_id: int):
+        await self.discord.rest()
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Channel")
+        return channel
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        channel,
+        author: FakeUser,
+        content: str = "",
+        embed: Optional[discord.Embed] = None,
+        type: discord.MessageType = discord.MessageType.default,
+        reference=None,
+        embeds: Optional[List[discord.Embed]] = None,
+        file: Optional[discord.File] = None,
+    ):
+        self.id = next_snowflake()
+        self.channel = channel
+        self.author = author
+        self.content = content or ""
+        self.embeds: List[discord.Embed] = [embed] if embed else list(embeds or [])
+        self.attachments: List[discord.File] = [file] if file else []
+        self.type = type
+        self.reference = reference
+        self.thread: Optional["FakeThread"] = None  # 从该消息创建的线程
+        self.deleted = False
+
+    @property
+    def guild(self) -> FakeGuild:
+        return self.channel.guild
+
+    @property
+    def jump_url(self) -> str:
+        return f"https://discord.com/channels/{self.guild.id}/{self.channel.id}/{self.id}"
+
+    async def edit(self, content: Optional[str] = None, embeds: Optional[List[discord.Embed]] = None, **kwargs):
+        await self.channel.discord.rest()
+        if content is not None:
+            self.content = content
+        if embeds is not None:
+            self.embeds = list(embeds)
+
+    async def delete(self):
+        await self.channel.discord.rest()
+        self.deleted = True
+
+    # 从消息创建线程，线程的第一条消息引用原消息
+    async def create_thread(self, name: str, **kwargs) -> "FakeThread":
+        await self.channel.discord.rest()
+        thread = FakeThread(self.channel, name=name, owner_id=self.author.id)
+        thread.add(
+            FakeMessage(
+                thread,
+                self.author,
+                type=discord.MessageType.thread_starter_message,
+                reference=SimpleNamespace(cached_message=self),
+            )
+        )
+        self.thread = thread
+        return thread
+
+
+# 发送消息的公共实现
+class _FakeMessageable:
+    async def send(
+        self,
+        content: Optional[str] = None,
+        embed: Optional[discord.Embed] = None,
+        embeds: Optional[List[discord.Embed]] = None,
+        file: Optional[discord.File] = None,
+        **kwargs,
+    ):
+        await self.discord.rest()
+        message = FakeMessage(self, self.bot_user, content or "", embed, embeds=embeds, file=file)
+        self.add(message)
+        self.discord.dispatch(message)
+        return message
+
+    def add(self, message: FakeMessage):
+        self.messages.append(message)
+
+
+class FakeTextChannel(_FakeMessageable, discord.TextChannel):
+    def __init__(
+        self,
+        guild: FakeGuild,
+        bot_user: FakeUser,
+        name: str = "general",
+        channel_id: Optional[int] = None,
+    ):
+        self.discord = guild.discord
+        self.guild = guild
+        self.bot_user = bot_user
+        self.id = channel_id or next_snowflake()
+        self.name = name
+        self.messages: List[FakeMessage] = []
+        guild.channels[self.id] = self
+
+
+class _FakeTyping:
+    def __init__(self, discord_: FakeDiscord):
+        self.discord = discord_
+
+    async def __aenter__(self):
+        await self.discord.rest()
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakeThread(_FakeMessageable, discord.Thread):
+    def __init__(self, parent: FakeTextChannel, name: str, owner_id: int):
+        self.discord = parent.discord
+        self.guild = parent.guild
+        self.bot_user = parent.bot_user
+        self.id = next_snowflake()
+        self.parent_id = parent.id
+        self.name = name
+        self.owner_id = owner_id
+        self.archived = False
+        self.locked = False
+        self.message_count = 0
+        self.last_message_id = None
+        self.messages: List[FakeMessage] = []
+        self.guild.channels[self.id] = self
+
+    @property
+    def last_message(self) -> Optional[FakeMessage]:
+        return self.messages[-1] if self.messages else None
+
+    def add(self, message: FakeMessage):
+        self.messages.append(message)
+        self.message_count += 1
+        self.last_message_id = message.id
+
+    # 用户在线程中发送消息，返回网关事件中的消息
+    def receive(self, author: FakeUser, content: str) -> FakeMessage:
+        message = FakeMessage(self, author, content)
+        self.add(message)
+        return message
+
+    async def history(self, limit: Optional[int] = 100, **kwargs):
+        await self.discord.rest()
+        count = 0
+        for message in reversed(self.messages):
+            if message.deleted:
+                continue
+            if limit is not None and count >= limit:
+                break
+            count += 1
+            yield message
+
+    def typing(self) -> _FakeTyping:
+        return _FakeTyping(self.discord)
+
+    async def edit(self, **kwargs):
+        await self.discord.rest()
+        for key in ("name", "archived", "locked"):
+            if key in kwargs:
+                setattr(self, key, kwargs[key])
+        return self
+
+
+class _FakeInteractionResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self.message: Optional[FakeMessage] = None
+
+    async def send_message(self, content: Optional[str] = None, embed: Optional[discord.Embed] = None, ephemeral: bool = False, **kwargs):
+        channel = self.interaction.channel
+        await channel.discord.rest()
+        self.message = FakeMessage(channel, channel.bot_user, content or "", embed)
+        if not ephemeral:
+            channel.add(self.message)
+
+
+# /chat 命令的交互
+class FakeInteraction:
+    def __init__(self, channel: FakeTextChannel, user: FakeUser):
+        self.channel = channel
+        self.guild = channel.guild
+        self.user = user
+        self.response = _FakeInteractionResponse(self)
+
+    async def original_response(self) -> FakeMessage:
+        await self.channel.discord.rest()
+        return self.response.message
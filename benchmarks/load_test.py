@@ -0,0 +1,239 @@
+# 离线压测：用假的 Discord 对象模型和本地 OpenAI 桩服务驱动 src.main 的
+# /chat 命令和 on_message，报告吞吐量、回复延迟、事件循环卡顿和内存随时间的变化
+# 用法: python -m benchmarks.load_test --duration 30 --rate 20 --threads 50
+# 设置 SHARD_COUNT/SHARD_IDS 时只模拟本进程负责的分片上的服务器，按比例分担线程和消息
+import argparse
+import asyncio
+import json
+import logging
+import random
+import resource
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.common import LoopLagProbe, percentile, setup_env, summarize
+from benchmarks.stub_server import StubOpenAIServer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=30, help="发送消息的时长（秒）")
+    parser.add_argument("--rate", type=float, default=20, help="每秒发送的线程消息数")
+    parser.add_argument("--threads", type=int, default=50, help="通过 /chat 创建的线程数")
+    parser.add_argument("--guilds", type=int, default=5, help="服务器数")
+    parser.add_argument("--latency", type=float, default=0.2, help="OpenAI 桩服务的延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="OpenAI 桩服务的错误率")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="Discord REST 调用的延迟（秒）")
+    parser.add_argument("--debounce", type=float, default=None, help="覆盖线程去抖的等待时间（秒）")
+    parser.add_argument("--drain", type=float, default=10, help="停止发送后等待回复的时间（秒）")
+    parser.add_argument("--verbose", action="store_true", help="输出机器人的日志")
+    parser.add_argument("--stub-url", default=None, help="使用已启动的桩服务，而不是在本进程中启动")
+    parser.add_argument("--json", action="store_true", help="最后一行输出 JSON 格式的结果")
+    return parser.parse_args()
+
+
+args = parse_args()
+# 服务器 ID 按雪花格式生成，使其均匀分布到各个分片
+guild_ids = [(i + 1) << 22 for i in range(args.guilds)]
+setup_env(
+    ALLOWED_SERVER_IDS=",".join(str(g) for g in guild_ids),
+    SERVER_TO_MODERATION_CHANNEL=",".join(f"{g}:{g + 1}" for g in guild_ids),
+)
+
+from benchmarks.fake_discord import (  # noqa: E402
+    FakeDiscord,
+    FakeGuild,
+    FakeInteraction,
+    FakeTextChannel,
+    FakeThread,
+    FakeUser,
+)
+from src import completion, main as bot  # noqa: E402
+from src.constants import DEFAULT_MODEL, EXAMPLE_CONVOS  # noqa: E402
+from src.sharding import owns_guild, shard_for_guild  # noqa: E402
+from src.transport import shared_transport  # noqa: E402
+
+
+# 当前进程的常驻内存（MB）
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / 2**20
+
+
+# 记录每个线程最近一条用户消息的时间，机器人回复时计算延迟
+class ReplyTracker:
+    def __init__(self, bot_user: FakeUser):
+        self.bot_user = bot_user
+        self.sent = 0  # 用户发送的消息数
+        self.replies = 0  # 机器人发送的回复消息数
+        self.latencies: List[float] = []
+        self._pending: Dict[int, float] = {}
+
+    def user_message(self, thread: FakeThread):
+        self.sent += 1
+        self._pending[thread.id] = time.perf_counter()
+
+    def on_send(self, message):
+        if message.author is not self.bot_user or not message.content:
+            return
+        self.replies += 1
+        started = self._pending.pop(message.channel.id, None)
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+
+
+async def run(base_url: str) -> dict:
+    shared_transport.base_url = base_url
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    if args.debounce is not None:
+        bot.thread_debouncer.min_delay = args.debounce
+        bot.thread_debouncer.max_delay = max(args.debounce, bot.thread_debouncer.max_delay)
+
+    # 代替登录和 on_ready：设置机器人用户和身份
+    fake = FakeDiscord(latency=args.discord_latency)
+    bot_user = FakeUser("GPTBot", bot=True)
+    bot.client._connection.user = bot_user
+    completion.set_bot_identity(name=bot_user.name, example_convos=EXAMPLE_CONVOS)
+    await bot.thread_store.start()
+
+    tracker = ReplyTracker(bot_user)
+    fake.on_send = tracker.on_send
+    fake.on_message = bot.on_message
+
+    channels = {}
+    for guild_id in guild_ids:
+        if not owns_guild(guild_id):
+            continue
+        guild = FakeGuild(fake, guild_id, shard_for_guild(guild_id))
+        channels[guild_id] = FakeTextChannel(guild, bot_user)
+        FakeTextChannel(guild, bot_user, name="moderation", channel_id=guild_id + 1)
+    share = len(channels) / len(guild_ids)
+    probe = LoopLagProbe()
+    probe.start()
+    started = time.perf_counter()
+    timeline = []
+
+    # 每秒记录一次进度和内存
+    async def sample():
+        last_lags = 0
+        while True:
+            await asyncio.sleep(1)
+            lags = probe.lags[last_lags:]
+            last_lags = len(probe.lags)
+            timeline.append(
+                (
+                    time.perf_counter() - started,
+                    tracker.sent,
+                    tracker.replies,
+                    percentile(lags, 99) * 1000,
+                    rss_mb(),
+                )
+            )
+
+    sampler = asyncio.get_running_loop().create_task(sample())
+
+    # 通过 /chat 创建线程
+    users = [FakeUser(f"user{i}") for i in range(max(args.threads, 1))]
+    threads: List[FakeThread] = []
+    owners: Dict[int, FakeUser] = {}
+    chat_started = time.perf_counter()
+
+    async def open_thread(i: int):
+        channel = channels.get(guild_ids[i % len(guild_ids)])
+        if channel is None:
+            return
+        interaction = FakeInteraction(channel, users[i])
+        await bot.chat_command.callback(
+            interaction,
+            message=f"hello from {users[i].name}, what can you do?",
+            model=DEFAULT_MODEL,
+            temperature=1.0,
+            max_tokens=128,
+        )
+        message = interaction.response.message
+        if message is not None and message.thread is not None:
+            threads.append(message.thread)
+            owners[message.thread.id] = users[i]
+
+    await asyncio.gather(*(open_thread(i) for i in range(args.threads)))
+    chat_seconds = time.perf_counter() - chat_started
+    chat_replies = tracker.replies
+
+    # 按固定速率在随机线程中发送消息
+    rate = args.rate * share
+    interval = 1 / rate if rate > 0 else float("inf")
+    deadline = time.perf_counter() + args.duration
+    next_at = time.perf_counter()
+    send_started = time.perf_counter()
+    replies_before = tracker.replies
+    while threads and time.perf_counter() < deadline:
+        thread = random.choice(threads)
+        user = owners[thread.id]
+        message = thread.receive(user, f"message {tracker.sent} from {user.name}: tell me more")
+        tracker.user_message(thread)
+        fake.dispatch(message)
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+    send_seconds = time.perf_counter() - send_started
+    await asyncio.sleep(args.drain)
+
+    sampler.cancel()
+    await probe.stop()
+    await bot.thread_store.close()
+    await shared_transport.close()
+
+    replies = tracker.replies - replies_before
+    return {
+        "threads": len(threads),
+        "chat_seconds": chat_seconds,
+        "chat_replies": chat_replies,
+        "sent": tracker.sent,
+        "send_seconds": send_seconds,
+        "replies": replies,
+        "replies_per_second": replies / max(send_seconds + args.drain, 1e-9),
+        "discord_rest_calls": fake.rest_calls,
+        "latencies": tracker.latencies,
+        "lags": probe.lags,
+        "timeline": timeline,
+    }
+
+
+def report(result: dict, stub: Optional[StubOpenAIServer]):
+    print(
+        f"/chat: {result['threads']} threads in {result['chat_seconds']:.2f}s, "
+        f"{result['chat_replies']} replies"
+    )
+    print(
+        f"messages: sent={result['sent']} in {result['send_seconds']:.1f}s "
+        f"({result['sent'] / max(result['send_seconds'], 1e-9):.1f}/s), "
+        f"replies={result['replies']} ({result['replies_per_second']:.1f}/s)"
+    )
+    if stub is not None:
+        print(
+            f"openai: requests={stub.requests} moderation_inputs={stub.moderation_inputs} "
+            f"models={stub.models}"
+        )
+    print(f"discord rest calls={result['discord_rest_calls']}")
+    summarize("reply latency (from last user message)", result["latencies"])
+    summarize("event loop lag", result["lags"])
+    print("   t(s)    sent  replies  lag_p99(ms)  rss(MB)")
+    for t, sent, replies, lag, rss in result["timeline"]:
+        print(f"{t:7.1f} {sent:7d} {replies:8d} {lag:12.2f} {rss:8.1f}")
+
+
+def main():
+    if args.stub_url:
+        stub = None
+        result = asyncio.run(run(args.stub_url))
+    else:
+        with StubOpenAIServer(latency=args.latency, error_rate=args.error_rate) as stub:
+            result = asyncio.run(run(stub.base_url))
+    report(result, stub)
+    if args.json:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
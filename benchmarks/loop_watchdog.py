@@ -0,0 +1,62 @@
+# 事件循环看门狗：测量开销，验证阻塞调用能被发现并指出 src/ 中的函数，
+# 以及运行时开启和关闭采样分析
+# 用法: python -m benchmarks.loop_watchdog
+import asyncio
+import glob
+import os
+import tempfile
+import time
+
+from benchmarks.common import setup_env
+
+setup_env()
+
+from src.base import Conversation, Message  # noqa: E402
+from src.watchdog import LoopWatchdog  # noqa: E402
+
+
+# 大量短任务的吞吐量，用于比较看门狗的开销
+async def workload(seconds: float) -> int:
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        await asyncio.gather(*(asyncio.sleep(0) for _ in range(100)))
+        done += 100
+    return done
+
+
+async def run():
+    baseline = await workload(2)
+    profile_dir = tempfile.mkdtemp()
+    watchdog = LoopWatchdog(
+        threshold=0.1, interval=0.05, profile_interval=0.005, profile_dir=profile_dir
+    )
+    watchdog.start()
+    watched = await workload(2)
+    print(
+        f"throughput: without watchdog {baseline / 2:.0f}/s, "
+        f"with watchdog {watched / 2:.0f}/s ({watched / baseline - 1:+.1%})"
+    )
+
+    # 在事件循环中渲染一段很长的对话，阻塞超过阈值
+    convo = Conversation([Message(f"user{i}", "x" * 200) for i in range(20000)])
+    started = time.perf_counter()
+    for _ in range(20):
+        convo.render()
+    print(f"blocking render took {time.perf_counter() - started:.2f}s")
+    await asyncio.sleep(0.2)
+    print(f"stalls detected: {watchdog.stalls}, max lag {watchdog.max_lag * 1000:.0f}ms")
+
+    watchdog.toggle_profiling()
+    await workload(1)
+    for _ in range(10):
+        convo.render()
+    watchdog.toggle_profiling()
+    await watchdog.stop()
+    for path in glob.glob(os.path.join(profile_dir, "*.txt")):
+        with open(path) as f:
+            print(f"profile {os.path.basename(path)}: {len(f.readlines())} distinct stacks")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
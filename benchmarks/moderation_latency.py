@@ -0,0 +1,64 @@
+# 比较同步与异步审查调用造成的事件循环卡顿
+# 用法: python -m benchmarks.moderation_latency [并发数] [轮数]
+import asyncio
+import sys
+import time
+
+from benchmarks.common import LoopLagProbe, setup_env, summarize
+from benchmarks.stub_server import StubOpenAIServer
+
+setup_env()
+
+from openai import OpenAI  # noqa: E402
+from src import moderation  # noqa: E402
+from src.transport import shared_transport  # noqa: E402
+
+
+async def run_sync(base_url: str, concurrency: int, rounds: int):
+    sync_client = OpenAI(base_url=base_url)
+
+    # 旧实现：在协程中直接调用同步客户端
+    async def moderate(i: int):
+        sync_client.moderations.create(input=f"hello {i}", model="text-moderation-latest")
+
+    probe = LoopLagProbe()
+    probe.start()
+    start = time.perf_counter()
+    for r in range(rounds):
+        await asyncio.gather(*[moderate(r * concurrency + i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    await probe.stop()
+    return elapsed, probe.lags
+
+
+async def run_async(base_url: str, concurrency: int, rounds: int):
+    shared_transport.base_url = base_url
+    probe = LoopLagProbe()
+    probe.start()
+    start = time.perf_counter()
+    for r in range(rounds):
+        # 每条消息内容不同，避免命中审查缓存
+        await asyncio.gather(
+            *[
+                moderation.moderate_message(message=f"hello {r * concurrency + i}", user="bench")
+                for i in range(concurrency)
+            ]
+        )
+    elapsed = time.perf_counter() - start
+    await probe.stop()
+    await shared_transport.close()
+    return elapsed, probe.lags
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with StubOpenAIServer(latency=0.05) as stub:
+        for name, runner in (("sync", run_sync), ("async", run_async)):
+            elapsed, lags = asyncio.run(runner(stub.base_url, concurrency, rounds))
+            print(f"[{name}] total={elapsed:.2f}s for {concurrency * rounds} calls")
+            summarize(f"[{name}] event-loop stall", lags)
+
+
+if __name__ == "__main__":
+    main()
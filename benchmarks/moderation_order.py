@@ -0,0 +1,88 @@
+# 审查乱序完成时的回复检查：前一条消息走较慢的审查接口，后一条消息由本地预审查立即放行
+# 或拦截，线程安静下来后仍应回复且只回复一次；任一场景不符合预期时以非零状态退出
+# 用法: python -m benchmarks.moderation_order --latency 1.0
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+
+from benchmarks.common import setup_env
+
+BLOCKED_WORD = "forbiddenword"
+_blocklist = tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False)
+_blocklist.write(BLOCKED_WORD + "\n")
+_blocklist.close()
+setup_env(MODERATION_BLOCKLIST_PATH=_blocklist.name)
+
+from benchmarks.fake_discord import FakeDiscord, FakeGuild, FakeTextChannel, FakeThread, FakeUser  # noqa: E402
+from benchmarks.stub_server import StubOpenAIServer  # noqa: E402
+from src import completion, main as bot  # noqa: E402
+from src.constants import EXAMPLE_CONVOS  # noqa: E402
+from src.transport import shared_transport  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=1.0, help="OpenAI 桩服务的延迟（秒），即较慢审查的耗时")
+    parser.add_argument("--debounce", type=float, default=0.2, help="线程去抖的等待时间（秒）")
+    return parser.parse_args()
+
+
+# 场景：（名称，线程中依次发送的消息）；第一条消息需要调用审查接口
+SCENARIOS = [
+    ("slow then pre-approved", ["please explain python decorators", "thanks"]),
+    ("slow then blocked", ["please explain python decorators", f"you {BLOCKED_WORD}"]),
+]
+
+
+async def run_scenario(fake, channel, bot_user, messages, latency):
+    thread = FakeThread(channel, name=f"{bot.ACTIVATE_THREAD_PREFX} order", owner_id=bot_user.id)
+    user = FakeUser("alice")
+    for content in messages:
+        fake.dispatch(thread.receive(user, content))
+        await asyncio.sleep(0.05)
+    # 等待较慢的审查、去抖和生成完成
+    await asyncio.sleep(3 * latency + bot.thread_debouncer.min_delay + 1)
+    replies = [m for m in thread.messages if m.author is bot_user and m.content and not m.deleted]
+    blocked = sum(1 for m in thread.messages if m.author is user and m.deleted)
+    return len(replies), blocked
+
+
+async def check(args) -> bool:
+    logging.getLogger().setLevel(logging.WARNING)
+    bot.thread_debouncer.min_delay = args.debounce
+    fake = FakeDiscord()
+    bot_user = FakeUser("GPTBot", bot=True)
+    bot.client._connection.user = bot_user
+    completion.set_bot_identity(name=bot_user.name, example_convos=EXAMPLE_CONVOS)
+    fake.on_message = bot.on_message
+    guild = FakeGuild(fake, 1)
+    channel = FakeTextChannel(guild, bot_user)
+    FakeTextChannel(guild, bot_user, name="moderation", channel_id=2)
+
+    ok = True
+    print(f"{'scenario':>24} {'replies':>8} {'blocked':>8} {'result':>7}")
+    for name, messages in SCENARIOS:
+        replies, blocked = await run_scenario(fake, channel, bot_user, messages, args.latency)
+        passed = replies == 1
+        ok = ok and passed
+        print(f"{name:>24} {replies:>8} {blocked:>8} {'ok' if passed else 'FAIL':>7}")
+    await shared_transport.close()
+    return ok
+
+
+def main():
+    args = parse_args()
+    try:
+        with StubOpenAIServer(latency=args.latency) as stub:
+            shared_transport.base_url = stub.base_url
+            ok = asyncio.run(check(args))
+    finally:
+        os.unlink(_blocklist.name)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
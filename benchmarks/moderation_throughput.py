@@ -0,0 +1,52 @@
+# 审查批处理的吞吐量基准测试：比较逐条请求与合并请求
+# 用法: python -m benchmarks.moderation_throughput [并发数] [每个调用者的请求数]
+import asyncio
+import sys
+import time
+
+from benchmarks.common import setup_env
+from benchmarks.stub_server import StubOpenAIServer
+
+setup_env()
+
+from src import moderation  # noqa: E402
+from src.moderation import ModerationBatcher, ModerationCache  # noqa: E402
+from src.transport import shared_transport  # noqa: E402
+
+
+async def run(base_url: str, window: float, max_batch_size: int, callers: int, per_caller: int):
+    shared_transport.base_url = base_url
+    moderation.moderation_batcher = ModerationBatcher(
+        window=window, max_batch_size=max_batch_size
+    )
+    # 每轮使用空缓存，只比较批处理的效果
+    moderation.moderation_cache = ModerationCache(maxsize=10000, ttl=3600)
+
+    async def caller(i: int):
+        for j in range(per_caller):
+            await moderation.moderate_message(message=f"message {i} {j}", user="bench")
+
+    start = time.perf_counter()
+    await asyncio.gather(*[caller(i) for i in range(callers)])
+    elapsed = time.perf_counter() - start
+    await shared_transport.close()
+    return elapsed, moderation.moderation_batcher
+
+
+def main():
+    callers = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    per_caller = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    total = callers * per_caller
+    # max_batch_size=1 等价于旧的逐条请求
+    for name, window, size in (("unbatched", 0.0, 1), ("batched", 0.01, 32)):
+        with StubOpenAIServer(latency=0.05) as stub:
+            elapsed, batcher = asyncio.run(run(stub.base_url, window, size, callers, per_caller))
+            print(
+                f"[{name}] {total} moderations in {elapsed:.2f}s "
+                f"({total / elapsed:.0f}/s), api_calls={batcher.api_calls}, "
+                f"server_requests={stub.requests}"
+            )
+
+
+if __name__ == "__main__":
+    main()
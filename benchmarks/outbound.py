@@ -0,0 +1,121 @@
+# 发送回复所需的 Discord REST 调用数：逐段发送（按 1500 字符定长切分，通知单独发送）
+# 与发送队列（按 Markdown 边界装满 2000 字符、通知附在消息上、长回复用附件、同频道合并）的比较
+# 用法: python -m benchmarks.outbound --latency 0.05
+import argparse
+import asyncio
+import random
+
+from benchmarks.common import setup_env
+
+setup_env()
+
+import discord  # noqa: E402
+
+from benchmarks.fake_discord import FakeDiscord, FakeGuild, FakeTextChannel, FakeThread, FakeUser  # noqa: E402
+from src.outbound import outbound  # noqa: E402
+
+LEGACY_CHARS_PER_MESSAGE = 1500
+WORDS = "the a model reply thread because which returns value error python function discord".split()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05, help="每次 REST 调用的模拟延迟（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def prose(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choices(WORDS, k=words)) + "."
+
+
+def code_block(rng: random.Random, lines: int) -> str:
+    body = "\n".join(f"    result_{i} = compute({i}, {rng.randint(0, 999)})" for i in range(lines))
+    return f"```python\ndef handler():\n{body}\n```"
+
+
+def flagged_notice() -> discord.Embed:
+    return discord.Embed(
+        description="⚠️ **This conversation has been flagged by moderation.**",
+        color=discord.Color.yellow(),
+    )
+
+
+def error_notice(i: int) -> discord.Embed:
+    return discord.Embed(description=f"**Busy** - request {i}", color=discord.Color.yellow())
+
+
+# 场景：（名称，回复文本列表，是否被标记）；多条回复表示同时发往同一线程
+def scenarios(rng: random.Random):
+    long_reply = "\n\n".join(prose(rng, rng.randint(30, 90)) for _ in range(14))
+    code_reply = "\n\n".join(
+        prose(rng, 40) if i % 2 == 0 else code_block(rng, rng.randint(20, 60)) for i in range(6)
+    )
+    return [
+        ("short", [prose(rng, 40)], False),
+        ("short flagged", [prose(rng, 40)], True),
+        ("long", [long_reply], False),
+        ("long flagged", [long_reply], True),
+        ("code", [code_reply], False),
+        ("very long", ["\n\n".join(prose(rng, 80) for _ in range(60))], False),
+        ("8 notices", [None] * 8, False),
+    ]
+
+
+# 原来的发送方式：每段单独发送，被标记时再发送一条通知
+async def legacy_send(thread, replies, flagged):
+    async def send_one(i, text):
+        if text is None:
+            await thread.send(embed=error_notice(i))
+            return
+        for start in range(0, len(text), LEGACY_CHARS_PER_MESSAGE):
+            await thread.send(text[start : start + LEGACY_CHARS_PER_MESSAGE])
+        if flagged:
+            await thread.send(embed=flagged_notice())
+
+    await asyncio.gather(*(send_one(i, text) for i, text in enumerate(replies)))
+
+
+async def queued_send(thread, replies, flagged):
+    async def send_one(i, text):
+        if text is None:
+            await outbound.send(thread, embeds=[error_notice(i)])
+            return
+        await outbound.send_reply(thread, text, embeds=[flagged_notice()] if flagged else [])
+
+    await asyncio.gather(*(send_one(i, text) for i, text in enumerate(replies)))
+
+
+# 消息中未闭合的代码块（被切断的代码块会让之后的内容都显示为代码）
+def broken_fences(messages) -> int:
+    return sum(1 for m in messages if m.content.count("```") % 2 == 1)
+
+
+async def run(send, replies, flagged, latency: float):
+    fake = FakeDiscord(latency=latency)
+    bot_user = FakeUser("GPTBot", bot=True)
+    channel = FakeTextChannel(FakeGuild(fake, 1), bot_user)
+    thread = FakeThread(channel, name="bench", owner_id=bot_user.id)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await send(thread, replies, flagged)
+    elapsed = loop.time() - started
+    return fake.rest_calls, elapsed, broken_fences(thread.messages), sum(len(m.attachments) for m in thread.messages)
+
+
+async def bench(args):
+    rng = random.Random(args.seed)
+    print(f"{'scenario':>14} {'chars':>6} {'method':>7} {'REST calls':>11} {'time(s)':>8} {'broken fences':>14} {'files':>6}")
+    for name, replies, flagged in scenarios(rng):
+        chars = sum(len(text) for text in replies if text)
+        for method, send in (("legacy", legacy_send), ("queued", queued_send)):
+            calls, elapsed, broken, files = await run(send, replies, flagged, args.latency)
+            print(f"{name:>14} {chars:>6} {method:>7} {calls:>11} {elapsed:>8.2f} {broken:>14} {files:>6}")
+
+
+def main():
+    asyncio.run(bench(parse_args()))
+
+
+if __name__ == "__main__":
+    main()
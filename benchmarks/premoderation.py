@@ -0,0 +1,115 @@
+# 本地预审查的匹配吞吐量：Aho-Corasick 匹配器与正则表达式分支、逐个子串查找的比较，
+# 屏蔽列表规模分别为 1k、10k、100k 个模式
+# 用法: python -m benchmarks.premoderation --patterns 1000,10000,100000
+import argparse
+import random
+import re
+import string
+import time
+import tracemalloc
+
+from benchmarks.common import setup_env
+
+setup_env()
+
+from src.premoderation import PatternMatcher, normalize  # noqa: E402
+
+WORDS = [
+    "the", "a", "you", "can", "what", "how", "please", "explain", "code", "python",
+    "discord", "thread", "message", "reply", "today", "thanks", "error", "function",
+    "why", "does", "this", "work", "when", "i", "run", "it", "again", "with", "more",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patterns", default="1000,10000,100000", help="逗号分隔的屏蔽列表规模")
+    parser.add_argument("--messages", type=int, default=2000, help="匹配的消息数")
+    parser.add_argument("--seconds", type=float, default=2.0, help="每种匹配方式最多运行的时间")
+    return parser.parse_args()
+
+
+# 随机的屏蔽词，约四分之一是两个词的短语
+def make_patterns(count: int, rng: random.Random):
+    patterns = set()
+    while len(patterns) < count:
+        word = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 10)))
+        if rng.random() < 0.25:
+            word += " " + "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 8)))
+        patterns.add(word)
+    return sorted(patterns)
+
+
+# 聊天消息，其中 1% 含有屏蔽词
+def make_messages(count: int, patterns, rng: random.Random):
+    messages = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(8, 60))
+        if rng.random() < 0.01:
+            words.insert(rng.randrange(len(words)), rng.choice(patterns))
+        messages.append(normalize(" ".join(words)))
+    return messages
+
+
+# 在时间限制内重复匹配，返回每秒消息数、每秒字节数和命中数
+def throughput(search, messages, seconds: float):
+    matched = 0
+    done = 0
+    size = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for text in messages:
+            if search(text) is not None:
+                matched += 1
+            done += 1
+            size += len(text)
+            if done % 200 == 0 and time.perf_counter() - started >= seconds:
+                break
+    elapsed = time.perf_counter() - started
+    return done / elapsed, size / elapsed / 2**20, matched / done
+
+
+# 构建用时（秒）和构建后占用的内存（MB）
+def build(factory):
+    tracemalloc.start()
+    started = time.perf_counter()
+    matcher = factory()
+    elapsed = time.perf_counter() - started
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return matcher, elapsed, memory / 2**20
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(0)
+    print(f"{'patterns':>9} {'method':>12} {'build(s)':>9} {'mem(MB)':>8} {'msgs/s':>10} {'MB/s':>7} {'hit rate':>9}")
+    for count in (int(c) for c in args.patterns.split(",")):
+        patterns = make_patterns(count, rng)
+        messages = make_messages(args.messages, patterns, rng)
+        matcher, ac_build, ac_mem = build(lambda: PatternMatcher(patterns))
+        regex, re_build, re_mem = build(
+            lambda: re.compile(r"\b(?:" + "|".join(map(re.escape, patterns)) + r")\b")
+        )
+
+        def regex_search(text):
+            match = regex.search(text)
+            return match.group(0) if match else None
+
+        def substring_search(text):
+            return next((p for p in patterns if p in text), None)
+
+        for name, search, build_s, mem in (
+            ("aho-corasick", matcher.search, ac_build, ac_mem),
+            ("regex", regex_search, re_build, re_mem),
+            ("substring", substring_search, 0.0, 0.0),
+        ):
+            per_second, mb_per_second, hit_rate = throughput(search, messages, args.seconds)
+            print(
+                f"{count:>9} {name:>12} {build_s:>9.2f} {mem:>8.1f} "
+                f"{per_second:>10.0f} {mb_per_second:>7.2f} {hit_rate:>9.2%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# Prompt.full_render 微基准测试：每轮重新渲染系统提示与使用预编译的系统提示
+# 用法: python -m benchmarks.prompt_render [每种长度的迭代次数]
+import sys
+import timeit
+
+from benchmarks.common import setup_env
+
+setup_env()
+
+from src import completion  # noqa: E402
+from src.base import Conversation, Message, Prompt  # noqa: E402
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    header = Message("system", "Instructions for Lenard: be nice")
+    system_prompt = completion.compile_system_prompt("Lenard", completion.CONFIG_VERSION)
+    for length in (1, 10, 50, 200):
+        convo = Conversation(
+            [Message(user=f"user{i % 3}", text=f"message number {i}") for i in range(length)]
+        )
+        per_turn = Prompt(header=header, examples=completion.MY_BOT_EXAMPLE_CONVOS, convo=convo)
+        compiled = Prompt(
+            header=header,
+            examples=completion.MY_BOT_EXAMPLE_CONVOS,
+            convo=convo,
+            system_prompt=system_prompt,
+        )
+        before = timeit.timeit(lambda: per_turn.full_render("Lenard"), number=number)
+        after = timeit.timeit(lambda: compiled.full_render("Lenard"), number=number)
+        print(
+            f"{length:>4} messages: per-turn render {before / number * 1e6:.1f}us, "
+            f"precompiled {after / number * 1e6:.1f}us "
+            f"(saved {(before - after) / number * 1e6:.1f}us/turn)"
+        )
+
+
+if __name__ == "__main__":
+    main()
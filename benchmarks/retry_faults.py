@@ -0,0 +1,58 @@
+# 使用注入故障的本地桩服务验证重试、熔断和备用模型
+# 用法: python -m benchmarks.retry_faults [请求数]
+import asyncio
+import sys
+from collections import Counter
+
+from benchmarks.common import setup_env
+from benchmarks.stub_server import StubOpenAIServer
+
+setup_env()
+
+from src import completion  # noqa: E402
+from src.base import Message, ThreadConfig  # noqa: E402
+from src.retry import RetryPolicy  # noqa: E402
+from src.transport import shared_transport  # noqa: E402
+
+
+async def run(stub: StubOpenAIServer, requests: int, fallback: bool, model: str):
+    shared_transport.base_url = stub.base_url
+    completion.retry_policy = RetryPolicy(
+        deadline_seconds=5,
+        max_attempts=5,
+        base_delay=0.05,
+        max_delay=0.5,
+        failure_threshold=5,
+        reset_seconds=1,
+        fallback_models={"gpt-4": "gpt-3.5-turbo"} if fallback else {},
+    )
+    config = ThreadConfig(model=model, max_tokens=64, temperature=1.0)
+    results = Counter()
+    for i in range(requests):
+        data = await completion.generate_completion_response(
+            messages=[Message(user="bench", text=f"hi {i}")], user="bench", thread_config=config
+        )
+        results[data.status.name] += 1
+    await shared_transport.close()
+    return results, completion.retry_policy
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    scenarios = (
+        ("30% 429 with retry-after", dict(error_rate=0.3, error_status=429, retry_after=0.02, failing_models={"gpt-4"}), False),
+        ("30% 503 without headers", dict(error_rate=0.3, error_status=503, failing_models={"gpt-4"}), False),
+        ("gpt-4 down, no fallback", dict(error_rate=1.0, error_status=503, failing_models={"gpt-4"}), False),
+        ("gpt-4 down, with fallback", dict(error_rate=1.0, error_status=503, failing_models={"gpt-4"}), True),
+    )
+    for name, options, fallback in scenarios:
+        with StubOpenAIServer(latency=0.005, **options) as stub:
+            results, policy = asyncio.run(run(stub, requests, fallback, "gpt-4"))
+            print(
+                f"[{name}] results={dict(results)} retries={policy.retries} "
+                f"fallbacks={policy.fallbacks} requests_by_model={stub.models}"
+            )
+
+
+if __name__ == "__main__":
+    main()
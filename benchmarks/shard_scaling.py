@@ -0,0 +1,90 @@
+# 多进程分片扩展测试：总负载不变，分别用 1、2、4 个分片进程运行离线压测，
+# 每个进程只处理自己分片上的服务器，并使用独立的桩服务进程
+# 用法: python -m benchmarks.shard_scaling [--rate 200 --threads 400 --duration 20]
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.common import percentile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", default="1,2,4", help="依次测试的分片进程数")
+    parser.add_argument("--rate", type=float, default=200, help="所有进程合计每秒发送的消息数")
+    parser.add_argument("--threads", type=int, default=400)
+    parser.add_argument("--guilds", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--debounce", type=float, default=0.2)
+    parser.add_argument("--drain", type=float, default=5)
+    return parser.parse_args()
+
+
+def start_stub(latency: float):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_server", "--latency", str(latency)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    return process, process.stdout.readline().strip()
+
+
+def run(shards: int, args) -> dict:
+    stubs, workers = [], []
+    try:
+        for shard_id in range(shards):
+            stub, base_url = start_stub(args.latency)
+            stubs.append(stub)
+            env = dict(os.environ, SHARD_COUNT=str(shards), SHARD_IDS=str(shard_id))
+            workers.append(
+                subprocess.Popen(
+                    [
+                        sys.executable, "-m", "benchmarks.load_test", "--json",
+                        "--stub-url", base_url,
+                        "--rate", str(args.rate),
+                        "--threads", str(args.threads),
+                        "--guilds", str(args.guilds),
+                        "--duration", str(args.duration),
+                        "--debounce", str(args.debounce),
+                        "--drain", str(args.drain),
+                    ],
+                    env=env,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    text=True,
+                )
+            )
+        results = [json.loads(w.communicate()[0].strip().splitlines()[-1]) for w in workers]
+    finally:
+        for stub in stubs:
+            stub.terminate()
+            stub.wait()
+    latencies = [x for r in results for x in r["latencies"]]
+    return {
+        "sent": sum(r["sent"] for r in results),
+        "replies": sum(r["replies"] for r in results),
+        "replies_per_second": sum(r["replies_per_second"] for r in results),
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "lag_p99": max(percentile(r["lags"], 99) for r in results),
+        "rss": sum(r["timeline"][-1][4] for r in results if r["timeline"]),
+    }
+
+
+def main():
+    args = parse_args()
+    print(f"cpus={os.cpu_count()} rate={args.rate}/s threads={args.threads} guilds={args.guilds}")
+    print("shards    sent  replies  replies/s  p50(ms)  p99(ms)  lag_p99(ms)  rss(MB)")
+    for shards in (int(s) for s in args.shards.split(",")):
+        r = run(shards, args)
+        print(
+            f"{shards:6d} {r['sent']:7d} {r['replies']:8d} {r['replies_per_second']:10.1f} "
+            f"{r['p50'] * 1000:8.1f} {r['p99'] * 1000:8.1f} {r['lag_p99'] * 1000:12.2f} {r['rss']:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# 本地 OpenAI 接口桩服务，用于在无网络环境下进行基准测试
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Set
+
+MODERATION_CATEGORIES = [
+    "harassment",
+    "harassment/threatening",
+    "hate",
+    "hate/threatening",
+    "self-harm",
+    "self-harm/instructions",
+    "self-harm/intent",
+    "sexual",
+    "sexual/minors",
+    "violence",
+    "violence/graphic",
+]
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    # 客户端取消请求（例如被新消息取代的生成）时连接会被提前关闭，不打印错误
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubOpenAIServer:
+    def __init__(
+        self,
+        latency: float = 0.05,
+        error_rate: float = 0.0,
+        error_status: int = 429,
+        retry_after: Optional[float] = None,
+        reply_text: str = "hello there, this is a stubbed reply",
+        port: int = 0,
+        failing_models: Optional[Set[str]] = None,
+    ):
+        self.latency = latency  # 每个请求的模拟延迟（秒）
+        self.error_rate = error_rate  # 注入错误的概率
+        self.error_status = error_status  # 注入错误时返回的状态码
+        self.retry_after = retry_after  # 注入错误时返回的 retry-after 头
+        self.reply_text = reply_text
+        self.failing_models = failing_models  # 只对这些模型注入错误，为空时对所有请求注入
+        self.models: Dict[str, int] = {}  # 每个模型收到的完成请求数
+        self.requests = 0  # 收到的请求数
+        self.moderation_inputs = 0  # 收到的审查输入数
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", port), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubOpenAIServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with stub._lock:
+                    stub.requests += 1
+                time.sleep(stub.latency)
+                model = body.get("model", "")
+                if self.path.endswith("/chat/completions"):
+                    with stub._lock:
+                        stub.models[model] = stub.models.get(model, 0) + 1
+                if (
+                    stub.failing_models is None or model in stub.failing_models
+                ) and random.random() < stub.error_rate:
+                    return self._send_error()
+                if self.path.endswith("/moderations"):
+                    return self._moderations(body)
+                if self.path.endswith("/chat/completions"):
+                    return self._chat_completions(body)
+                self._send_json(404, {"error": {"message": "not found"}})
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_error(self):
+                headers = {}
+                if stub.retry_after is not None:
+                    headers["retry-after-ms"] = str(int(stub.retry_after * 1000))
+                self._send_json(
+                    stub.error_status,
+                    {"error": {"message": "injected fault", "type": "stub"}},
+                    headers,
+                )
+
+            def _moderations(self, body):
+                inputs = body.get("input", "")
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                with stub._lock:
+                    stub.moderation_inputs += len(inputs)
+                results = []
+                for text in inputs:
+                    # "bad" 触发高分，用于测试拦截逻辑
+                    score = 0.99 if "bad" in text else 0.001
+                    results.append(
+                        {
+                            "flagged": score > 0.5,
+                            "categories": {c: score > 0.5 for c in MODERATION_CATEGORIES},
+                            "category_scores": {c: score for c in MODERATION_CATEGORIES},
+                        }
+                    )
+                self._send_json(
+                    200,
+                    {"id": "modr-stub", "model": body.get("model", ""), "results": results},
+                )
+
+            def _chat_completions(self, body):
+                usage = {
+                    "prompt_tokens": 100,
+                    "completion_tokens": 10,
+                    "total_tokens": 110,
+                }
+                if not body.get("stream"):
+                    return self._send_json(
+                        200,
+                        {
+                            "id": "chatcmpl-stub",
+                            "object": "chat.completion",
+                            "created": int(time.time()),
+                            "model": body.get("model", ""),
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "finish_reason": "stop",
+                                    "message": {
+                                        "role": "assistant",
+                                        "content": stub.reply_text,
+                                    },
+                                }
+                            ],
+                            "usage": usage,
+                        },
+                    )
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("connection", "close")
+                self.end_headers()
+                for word in stub.reply_text.split(" "):
+                    chunk = {
+                        "id": "chatcmpl-stub",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", ""),
+                        "choices": [
+                            {"index": 0, "finish_reason": None, "delta": {"content": word + " "}}
+                        ],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(stub.latency / 10)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+# 独立运行桩服务，供多进程基准测试共用，启动后在标准输出打印 base_url
+# 用法: python -m benchmarks.stub_server --port 8900 --latency 0.2
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    options = parser.parse_args()
+    server = StubOpenAIServer(
+        latency=options.latency, error_rate=options.error_rate, port=options.port
+    ).start()
+    print(server.base_url, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,51 @@
+# 线程配置存储基准测试：不同存储规模下的启动时间与单次查询延迟
+# 用法: python -m benchmarks.thread_store
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import setup_env, summarize
+
+setup_env()
+
+from src.base import ThreadConfig  # noqa: E402
+from src.thread_store import SQLiteThreadStore  # noqa: E402
+
+
+async def run(path: str, size: int):
+    store = SQLiteThreadStore(path, flush_interval=1.0, cache_size=50000, archived_ttl=3600)
+    await store.start()
+    config = ThreadConfig(model="gpt-4", max_tokens=512, temperature=0.5)
+    for thread_id in range(size):
+        store.set(thread_id, config)
+    await store.flush()
+    await store.close()
+
+    start = time.perf_counter()
+    store = SQLiteThreadStore(path, flush_interval=1.0, cache_size=50000, archived_ttl=3600)
+    await store.start()
+    startup = time.perf_counter() - start
+    cold, warm = [], []
+    for thread_id in random.sample(range(size), 500):
+        start = time.perf_counter()
+        assert await store.get(thread_id) == config
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        await store.get(thread_id)
+        warm.append(time.perf_counter() - start)
+    await store.close()
+    print(f"[{size} threads] startup {startup * 1000:.2f}ms")
+    summarize(f"[{size} threads] first lookup", cold)
+    summarize(f"[{size} threads] cached lookup", warm)
+
+
+def main():
+    for size in (1000, 10000, 50000):
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(run(os.path.join(tmp, "threads.db"), size))
+
+
+if __name__ == "__main__":
+    main()
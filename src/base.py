@@ -4,8 +4,8 @@ from typing import Optional, List
 # 分隔符标记
 SEPARATOR_TOKEN = ""
 
-# 消息类，用于表示对话中的消息
-@dataclass(frozen=True)
+# 消息类，用于表示对话中的消息；使用 __slots__，大量缓存时没有每个实例的 __dict__
+@dataclass(frozen=True, slots=True)
 class Message:
     user: str  # 用户名
     text: Optional[str] = None  # 文本内容，默认为空
@@ -18,7 +18,7 @@ class Message:
         return result
 
 # 对话类，包含一系列消息
-@dataclass
+@dataclass(slots=True)
 class Conversation:
     messages: List[Message]  # 消息列表
 
@@ -47,23 +47,38 @@ class ThreadConfig:
     max_tokens: int  # 最大标记数
     temperature: float  # 温度
 
+# 线程摘要类，保存已折叠的早期对话
+@dataclass(frozen=True, slots=True)
+class ThreadSummary:
+    text: str  # 摘要内容
+    through_id: int  # 已折叠进摘要的最后一条消息 ID
+
+    # 转换为放在最近消息之前的摘要消息
+    def to_message(self) -> Message:
+        return Message("System", f"Summary of the earlier conversation: {self.text}")
+
 # 提示类，用于呈现对话系统提示
 @dataclass(frozen=True)
 class Prompt:
     header: Message  # 头部消息
     examples: List[Conversation]  # 示例对话列表
     convo: Conversation  # 当前对话
+    system_prompt: Optional[str] = None  # 预编译的系统提示，为空时现场渲染
+    summary: Optional[Message] = None  # 早期对话的摘要，放在当前对话之前
 
     # 渲染完整提示信息
     def full_render(self, bot_name):
         messages = [
             {
                 "role": "system",
-                "content": self.render_system_prompt(),
+                "content": self.system_prompt
+                if self.system_prompt is not None
+                else self.render_system_prompt(),
             }
         ]
-        for message in self.render_messages(bot_name):
-            messages.append(message)
+        if self.summary is not None:
+            messages.append({"role": "system", "content": self.summary.render()})
+        messages.extend(self.render_messages(bot_name))
         return messages
 
     # 渲染系统提示信息
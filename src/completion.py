@@ -1,18 +1,60 @@
+import asyncio
+import hashlib
+import heapq
+import json
+from contextlib import asynccontextmanager
 from enum import Enum
-from dataclasses import dataclass
-import openai
-from openai import AsyncOpenAI
+from dataclasses import dataclass, replace
+from functools import lru_cache
+import time
 
 from src.moderation import moderate_message
-from typing import Optional, List
+from typing import AsyncIterator, Dict, Optional, List, Tuple
 from src.constants import (
     BOT_INSTRUCTIONS,
     BOT_NAME,
     EXAMPLE_CONVOS,
+    STREAM_EDIT_INTERVAL_SECONDS,
+    MAX_CONCURRENT_COMPLETIONS,
+    MODEL_TOKENS_PER_MINUTE,
+    MAX_COMPLETION_QUEUE_SECONDS,
+    GUILD_COMPLETION_WEIGHTS,
+    COMPLETION_RETRY_DEADLINE_SECONDS,
+    COMPLETION_MAX_ATTEMPTS,
+    COMPLETION_RETRY_BASE_SECONDS,
+    COMPLETION_RETRY_MAX_SECONDS,
+    CIRCUIT_BREAKER_FAILURES,
+    CIRCUIT_BREAKER_RESET_SECONDS,
+    FALLBACK_MODELS,
+    ENABLE_MODEL_FALLBACK,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_TEMPERATURE,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
 )
 import discord
 from src.base import Message, Prompt, Conversation, ThreadConfig
-from src.utils import split_into_shorter_messages, close_thread, logger
+from src.utils import close_thread, logger
+from src.cache import TTLCache
+from src.history import conversation_cache
+from src.tokens import (
+    pack_messages,
+    system_prompt_tokens,
+    message_tokens,
+    count_tokens,
+)
+from src.inflight import current_inflight
+from src.outbound import outbound, split_message
+from src.retry import CircuitOpenError, RetryPolicy
+from src.transport import shared_transport
+from src.metrics import (
+    COMPLETION_QUEUE_SECONDS,
+    COMPLETION_SECONDS,
+    COMPLETION_TOKENS,
+    DISCORD_SEND_SECONDS,
+    TIME_TO_FIRST_TOKEN_SECONDS,
+    registry,
+)
 from src.moderation import (
     send_moderation_flagged_message,
     send_moderation_blocked_message,
@@ -20,6 +62,23 @@ from src.moderation import (
 
 MY_BOT_NAME = BOT_NAME
 MY_BOT_EXAMPLE_CONVOS = EXAMPLE_CONVOS
+CONFIG_VERSION = 0  # 机器人名称或示例对话变化时递增，使预编译的系统提示失效
+
+# 设置机器人名称和示例对话
+def set_bot_identity(name: str, example_convos: List[Conversation]):
+    global MY_BOT_NAME, MY_BOT_EXAMPLE_CONVOS, CONFIG_VERSION
+    MY_BOT_NAME = name
+    MY_BOT_EXAMPLE_CONVOS = example_convos
+    CONFIG_VERSION += 1
+
+# 系统提示（说明、示例对话和分隔符）按（机器人名称，配置版本）编译一次后复用
+@lru_cache(maxsize=8)
+def compile_system_prompt(bot_name: str, config_version: int) -> str:
+    return Prompt(
+        header=Message("system", f"Instructions for {bot_name}: {BOT_INSTRUCTIONS}"),
+        examples=MY_BOT_EXAMPLE_CONVOS,
+        convo=Conversation([]),
+    ).render_system_prompt()
 
 # 枚举类型定义了不同的完成状态
 class CompletionResult(Enum):
@@ -29,6 +88,54 @@ class CompletionResult(Enum):
     OTHER_ERROR = 3
     MODERATION_FLAGGED = 4
     MODERATION_BLOCKED = 5
+    OVER_BUDGET = 6
+
+# 流式回复：收到第一个 token 后立即发送消息，之后按固定节奏编辑，
+# 超过单条消息长度时续写到新消息
+class StreamingReply:
+    def __init__(self, thread: discord.Thread):
+        self.thread = thread
+        self.messages: List[discord.Message] = []  # 已发送的消息
+        self.started_at = time.monotonic()
+        self.time_to_first_token: Optional[float] = None
+        self._contents: List[str] = []  # 每条消息当前显示的内容
+        self._last_update = 0.0
+
+    # 是否到了下一次编辑的时间
+    def due(self) -> bool:
+        return (
+            not self.messages
+            or time.monotonic() - self._last_update >= STREAM_EDIT_INTERVAL_SECONDS
+        )
+
+    # 将当前生成的文本同步到 Discord 消息
+    async def update(self, text: str):
+        for i, chunk in enumerate(split_message(text)):
+            if i < len(self.messages):
+                if self._contents[i] != chunk:
+                    await self.messages[i].edit(content=chunk)
+                    self._contents[i] = chunk
+            else:
+                # 流式消息之后会被编辑或撤回，不与其他消息合并
+                self.messages.append(
+                    await outbound.send(self.thread, chunk, exclusive=True)
+                )
+                self._contents.append(chunk)
+        if self.time_to_first_token is None and self.messages:
+            self.time_to_first_token = time.monotonic() - self.started_at
+            TIME_TO_FIRST_TOKEN_SECONDS.observe(self.time_to_first_token)
+            logger.info(f"Time to first token {self.time_to_first_token:.2f}s")
+        self._last_update = time.monotonic()
+
+    # 撤回已发送的消息
+    async def retract(self):
+        for sent_message in self.messages:
+            try:
+                await sent_message.delete()
+            except discord.HTTPException as e:
+                logger.exception(e)
+        self.messages.clear()
+        self._contents.clear()
 
 # 数据类用于封装完成的数据
 @dataclass
@@ -36,96 +143,557 @@ class CompletionData:
     status: CompletionResult
     reply_text: Optional[str]
     status_text: Optional[str]
+    stream: Optional[StreamingReply] = None  # 流式模式下已发送的回复
 
-# 创建异步 OpenAI 客户端
-client = AsyncOpenAI()
+# 回复缓存，保存已经审查过的完成结果
+response_cache: TTLCache[CompletionData] = TTLCache(
+    maxsize=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL_SECONDS
+)
 
-# 生成完成响应的异步函数
-async def generate_completion_response(
-    messages: List[Message], user: str, thread_config: ThreadConfig
-) -> CompletionData:
-    try:
-        # 构建提示对象
-        prompt = Prompt(
-            header=Message(
-                "system", f"Instructions for {MY_BOT_NAME}: {BOT_INSTRUCTIONS}"
-            ),
-            examples=MY_BOT_EXAMPLE_CONVOS,
-            convo=Conversation(messages),
-        )
-        rendered = prompt.full_render(MY_BOT_NAME)
-        # 使用 OpenAI 客户端生成完成
-        response = await client.chat.completions.create(
-            model=thread_config.model,
+# 计算回复缓存的键（渲染后的提示、模型、温度和最大 token 数），不适用缓存时返回空
+def response_cache_key(
+    model: str, rendered: List[dict], thread_config: ThreadConfig
+) -> Optional[str]:
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if thread_config.temperature > RESPONSE_CACHE_MAX_TEMPERATURE:
+        return None
+    payload = json.dumps(
+        [model, thread_config.temperature, thread_config.max_tokens, rendered],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+retry_policy = RetryPolicy(
+    deadline_seconds=COMPLETION_RETRY_DEADLINE_SECONDS,
+    max_attempts=COMPLETION_MAX_ATTEMPTS,
+    base_delay=COMPLETION_RETRY_BASE_SECONDS,
+    max_delay=COMPLETION_RETRY_MAX_SECONDS,
+    failure_threshold=CIRCUIT_BREAKER_FAILURES,
+    reset_seconds=CIRCUIT_BREAKER_RESET_SECONDS,
+    fallback_models=FALLBACK_MODELS if ENABLE_MODEL_FALLBACK else {},
+)
+
+# 请求会超出模型的每分钟 token 预算时抛出，请求不会被发送
+class CompletionBudgetExceeded(Exception):
+    pass
+
+# 每分钟 token 预算的令牌桶，允许预支，预支部分需要等待补充
+class TokenBucket:
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0  # 每秒补充的 token 数
+        self.tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # 消耗 cost 个 token 前需要等待的时间
+    def wait_time(self, cost: int) -> float:
+        self._refill()
+        return max(0.0, cost - self.tokens) / self.rate
+
+    # 预留 token，返回需要等待的时间
+    def reserve(self, cost: int) -> float:
+        wait = self.wait_time(cost)
+        self.tokens -= cost
+        return wait
+
+    # 归还多预留的 token（负数表示补扣）
+    def refund(self, amount: int):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+# 完成请求调度器：限制全局并发数，按模型限制每分钟 token 数，
+# 并在服务器和用户之间进行加权公平排队
+class CompletionScheduler:
+    def __init__(
+        self,
+        max_concurrent: int,
+        tokens_per_minute: Dict[str, int],
+        max_queue_seconds: float,
+        guild_weights: Dict[int, float],
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue_seconds = max_queue_seconds  # 超过这个等待时间的请求直接拒绝
+        self.guild_weights = guild_weights
+        self.active = 0  # 正在进行的请求数
+        self.rejected = 0  # 因超出预算被拒绝的请求数
+        self._buckets = {
+            model: TokenBucket(tpm) for model, tpm in tokens_per_minute.items()
+        }
+        self._queue: List[Tuple[float, int, asyncio.Future]] = []
+        self._finish_tags: Dict[Optional[int], Dict[str, float]] = {}  # 每个服务器中各用户的完成标签
+        self._virtual_time = 0.0
+        self._sequence = 0
+
+    # 排队中的请求数
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._queue if not future.done())
+
+    # 获取一个请求槽位，离开上下文时释放
+    @asynccontextmanager
+    async def slot(
+        self, guild_id: Optional[int], user: str, model: str, estimated_tokens: int
+    ) -> AsyncIterator[None]:
+        started = time.monotonic()
+        bucket = self._buckets.get(model)
+        if bucket is not None:
+            wait = bucket.wait_time(estimated_tokens)
+            if estimated_tokens > bucket.capacity or wait > self.max_queue_seconds:
+                self.rejected += 1
+                raise CompletionBudgetExceeded(
+                    f"{model} is over its token budget, try again in {wait:.0f}s"
+                )
+            wait = bucket.reserve(estimated_tokens)
+        try:
+            if bucket is not None:
+                await asyncio.sleep(wait)
+            await self._acquire(self._tag(guild_id, user, estimated_tokens))
+        except BaseException:
+            self._refund(bucket, estimated_tokens)
+            raise
+        waited = time.monotonic() - started
+        COMPLETION_QUEUE_SECONDS.observe(waited, model=model)
+        if waited > 1:
+            logger.info(f"Completion queued {waited:.2f}s, queue depth {self.queue_depth}")
+        try:
+            yield
+        except BaseException:
+            # 请求失败或被取消时归还预留的 token；成功时由 record_usage 按实际用量调整
+            self._refund(bucket, estimated_tokens)
+            raise
+        finally:
+            self._release()
+
+    def _refund(self, bucket: Optional[TokenBucket], tokens: int):
+        if bucket is not None:
+            bucket.refund(tokens)
+
+    # 根据实际用量调整令牌桶
+    def record_usage(self, model: str, estimated_tokens: int, actual_tokens: int):
+        bucket = self._buckets.get(model)
+        if bucket is not None:
+            bucket.refund(estimated_tokens - actual_tokens)
+
+    # 计算加权公平排队的完成标签：服务器按权重分享容量，服务器内有积压的用户平分该服务器的份额。
+    # 同一用户的请求依次排在后面，每个用户的间隔按积压用户数放大，
+    # 服务器整体的速率与只有一个用户时相同，其他用户的请求不必等该用户的请求全部完成
+    def _tag(self, guild_id: Optional[int], user: str, cost: int) -> float:
+        weight = self.guild_weights.get(guild_id, 1.0)
+        users = self._finish_tags.setdefault(guild_id, {})
+        backlogged = 1 + sum(
+            1 for other, tag in users.items() if other != user and tag > self._virtual_time
+        )
+        start = max(self._virtual_time, users.get(user, 0.0))
+        tag = start + cost * backlogged / weight
+        users[user] = tag
+        return tag
+
+    async def _acquire(self, tag: float):
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        heapq.heappush(self._queue, (tag, self._sequence, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已获得槽位但调用者被取消，交给下一个请求
+                self._release()
+            raise
+
+    def _release(self):
+        self.active -= 1
+        self._dispatch()
+
+    # 按完成标签从小到大分配空闲槽位
+    def _dispatch(self):
+        while self._queue and self.active < self.max_concurrent:
+            tag, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self.active += 1
+            self._virtual_time = max(self._virtual_time, tag)
+            future.set_result(None)
+        if not self._queue and sum(map(len, self._finish_tags.values())) > 10000:
+            # 清理已经落后于虚拟时间的标签
+            self._finish_tags = {
+                guild_id: live
+                for guild_id, users in self._finish_tags.items()
+                if (live := {u: v for u, v in users.items() if v > self._virtual_time})
+            }
+
+
+completion_scheduler = CompletionScheduler(
+    max_concurrent=MAX_CONCURRENT_COMPLETIONS,
+    tokens_per_minute=MODEL_TOKENS_PER_MINUTE,
+    max_queue_seconds=MAX_COMPLETION_QUEUE_SECONDS,
+    guild_weights=GUILD_COMPLETION_WEIGHTS,
+)
+
+registry.gauge(
+    "gptbot_completion_queue_depth",
+    "Completions waiting for a scheduler slot",
+    lambda: completion_scheduler.queue_depth,
+)
+registry.gauge(
+    "gptbot_completion_active",
+    "Completions holding a scheduler slot",
+    lambda: completion_scheduler.active,
+)
+registry.counter_func(
+    "gptbot_completion_rejected_total",
+    "Completions rejected for exceeding the token budget",
+    lambda: completion_scheduler.rejected,
+)
+registry.counter_func(
+    "gptbot_completion_retries_total",
+    "Completion retries after transient errors",
+    lambda: retry_policy.retries,
+)
+registry.counter_func(
+    "gptbot_completion_fallbacks_total",
+    "Completions sent to a fallback model",
+    lambda: retry_policy.fallbacks,
+)
+registry.counter_func(
+    "gptbot_response_cache_lookups_total",
+    "Response cache lookups by result",
+    lambda: {("hit",): response_cache.hits, ("miss",): response_cache.misses},
+    ["result"],
+)
+
+# 最新的消息也无法放入上下文窗口时抛出
+class CompletionTooLong(Exception):
+    pass
+
+# 使用指定模型请求一次完成，返回回复和渲染后的提示
+# 系统提示和摘要占用的 token 数
+def _system_tokens(model: str, summary: Optional[Message]) -> int:
+    tokens = system_prompt_tokens(model, compile_system_prompt(MY_BOT_NAME, CONFIG_VERSION))
+    if summary is not None:
+        tokens += message_tokens(model, summary)
+    return tokens
+
+# 模型的上下文窗口能否容纳最新一条消息和回复；不能容纳的备用模型不会被选用
+def fits_context(
+    model: str,
+    messages: List[Message],
+    thread_config: ThreadConfig,
+    summary: Optional[Message],
+) -> bool:
+    return bool(
+        pack_messages(
+            model=model,
+            messages=messages[-1:],
+            system_tokens=_system_tokens(model, summary),
+            max_tokens=thread_config.max_tokens,
+        )
+    )
+
+async def request_completion(
+    model: str,
+    messages: List[Message],
+    user: str,
+    thread_config: ThreadConfig,
+    stream: Optional[StreamingReply],
+    guild_id: Optional[int],
+    summary: Optional[Message] = None,
+) -> Tuple[str, List[dict], Optional[str], Optional[CompletionData]]:
+    system_prompt = compile_system_prompt(MY_BOT_NAME, CONFIG_VERSION)
+    system_tokens = _system_tokens(model, summary)
+    # 在本地计算 token 数，只保留上下文窗口能容纳的最新消息
+    packed = pack_messages(
+        model=model,
+        messages=messages,
+        system_tokens=system_tokens,
+        max_tokens=thread_config.max_tokens,
+    )
+    if not packed:
+        raise CompletionTooLong("The latest message does not fit in the context window")
+    if len(packed) < len(messages):
+        logger.info(
+            f"Packed {len(packed)} of {len(messages)} messages into the context window"
+        )
+    prompt_tokens = system_tokens + sum(message_tokens(model, m) for m in packed)
+    estimated_tokens = prompt_tokens + thread_config.max_tokens
+    # 构建提示对象，每轮只渲染用户对话部分
+    prompt = Prompt(
+        header=Message("system", f"Instructions for {MY_BOT_NAME}: {BOT_INSTRUCTIONS}"),
+        examples=MY_BOT_EXAMPLE_CONVOS,
+        convo=Conversation(packed),
+        system_prompt=system_prompt,
+        summary=summary,
+    )
+    rendered = prompt.full_render(MY_BOT_NAME)
+    # 命中回复缓存时直接返回，无需请求 API
+    cache_key = response_cache_key(model, rendered, thread_config)
+    if cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(
+                f"Response cache hit ({response_cache.hit_rate:.0%} hit rate)"
+            )
+            return cached.reply_text, rendered, cache_key, cached
+    # 排队获取请求槽位后，使用 OpenAI 客户端生成完成
+    async with completion_scheduler.slot(
+        guild_id=guild_id,
+        user=str(user),
+        model=model,
+        estimated_tokens=estimated_tokens,
+    ):
+        inflight = current_inflight()
+        if inflight is not None:
+            inflight.mark_sent(prompt_tokens)
+        response = await shared_transport.completion_client.chat.completions.create(
+            model=model,
             messages=rendered,
             temperature=thread_config.temperature,
             top_p=1.0,
             max_tokens=thread_config.max_tokens,
             stop=[""],
+            stream=stream is not None,
+        )
+        if stream is None:
+            reply = response.choices[0].message.content.strip()
+            if response.usage:
+                used_tokens = response.usage.total_tokens
+                prompt_tokens = response.usage.prompt_tokens
+                reply_tokens = response.usage.completion_tokens
+            else:
+                reply_tokens = count_tokens(model, reply)
+                used_tokens = prompt_tokens + reply_tokens
+        else:
+            # 边接收 token 边更新 Discord 消息
+            parts = []
+            try:
+                async for chunk in response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        if inflight is not None:
+                            inflight.completion_tokens += 1
+                        if stream.due():
+                            partial = "".join(parts).strip()
+                            if partial:
+                                await stream.update(partial)
+            except Exception:
+                # 流中断时撤回部分回复，重试时从头开始
+                await stream.retract()
+                raise
+            finally:
+                # 被取消时立即关闭 HTTP 流，停止继续生成
+                await response.response.aclose()
+            reply = "".join(parts).strip()
+            reply_tokens = len(parts)
+            used_tokens = prompt_tokens + reply_tokens
+        completion_scheduler.record_usage(model, estimated_tokens, used_tokens)
+    COMPLETION_TOKENS.inc(prompt_tokens, guild=guild_id, model=model, kind="prompt")
+    COMPLETION_TOKENS.inc(reply_tokens, guild=guild_id, model=model, kind="completion")
+    return reply, rendered, cache_key, None
+
+# 生成完成响应的异步函数，按服务器、模型和结果记录耗时
+async def generate_completion_response(
+    messages: List[Message],
+    user: str,
+    thread_config: ThreadConfig,
+    stream: Optional[StreamingReply] = None,
+    guild_id: Optional[int] = None,
+    summary: Optional[Message] = None,
+) -> CompletionData:
+    started = time.perf_counter()
+    result = "cancelled"
+    try:
+        response_data = await _generate_completion_response(
+            messages=messages,
+            user=user,
+            thread_config=thread_config,
+            stream=stream,
+            guild_id=guild_id,
+            summary=summary,
+        )
+        result = response_data.status.name.lower()
+        return response_data
+    finally:
+        COMPLETION_SECONDS.observe(
+            time.perf_counter() - started,
+            guild=guild_id,
+            model=thread_config.model,
+            result=result,
+        )
+
+async def _generate_completion_response(
+    messages: List[Message],
+    user: str,
+    thread_config: ThreadConfig,
+    stream: Optional[StreamingReply],
+    guild_id: Optional[int],
+    summary: Optional[Message],
+) -> CompletionData:
+    import openai  # 启动时不导入，见 SharedTransport.preload
+
+    models = []  # 实际请求过的模型
+
+    def call(model: str):
+        models.append(model)
+        return request_completion(
+            model=model,
+            messages=messages,
+            user=user,
+            thread_config=thread_config,
+            stream=stream,
+            guild_id=guild_id,
+            summary=summary,
+        )
+
+    # 备用模型的上下文放不下时是暂时不可用，不能因此关闭线程
+    def too_long(e: Exception) -> CompletionData:
+        if models and models[-1] != thread_config.model:
+            logger.warning(f"Fallback {models[-1]} could not fit the request: {e}")
+            return CompletionData(
+                status=CompletionResult.OVER_BUDGET,
+                reply_text=None,
+                status_text=f"{thread_config.model} is temporarily unavailable, try again later",
+                stream=stream,
+            )
+        return CompletionData(
+            status=CompletionResult.TOO_LONG,
+            reply_text=None,
+            status_text=str(e),
+            stream=stream,
+        )
+
+    try:
+        # 暂时性错误会在截止时间内重试，主模型熔断时可能使用上下文足够大的备用模型
+        reply, rendered, cache_key, cached = await retry_policy.run(
+            thread_config.model,
+            call,
+            accepts=lambda model: fits_context(model, messages, thread_config, summary),
+        )
+        if cached is not None:
+            # 缓存的回复已经审查过，沿用当时的审查结果；被拦截的回复不发送
+            if stream is not None and reply and cached.status in (
+                CompletionResult.OK,
+                CompletionResult.MODERATION_FLAGGED,
+            ):
+                await stream.update(reply)
+            return replace(cached, stream=stream)
+        if stream is not None and reply:
+            await stream.update(reply)
+        result = CompletionData(
+            status=CompletionResult.OK,
+            reply_text=reply,
+            status_text=None,
         )
-        reply = response.choices[0].message.content.strip()
         if reply:
             # 进行内容的审查
-            flagged_str, blocked_str = moderate_message(
+            flagged_str, blocked_str = await moderate_message(
                 message=(rendered[-1]["content"] + reply)[-500:], user=user
             )
             if len(blocked_str) > 0:
-                return CompletionData(
+                result = CompletionData(
                     status=CompletionResult.MODERATION_BLOCKED,
                     reply_text=reply,
                     status_text=f"from_response:{blocked_str}",
                 )
-
-            if len(flagged_str) > 0:
-                return CompletionData(
+            elif len(flagged_str) > 0:
+                result = CompletionData(
                     status=CompletionResult.MODERATION_FLAGGED,
                     reply_text=reply,
                     status_text=f"from_response:{flagged_str}",
                 )
-
+            if cache_key is not None:
+                response_cache.set(cache_key, result)
+        return replace(result, stream=stream)
+    except asyncio.CancelledError:
+        # 被新消息取代时撤回已经流式发送的部分回复
+        if stream:
+            await stream.retract()
+        raise
+    except CompletionTooLong as e:
+        return too_long(e)
+    except (CompletionBudgetExceeded, CircuitOpenError) as e:
+        if isinstance(e, CircuitOpenError):
+            logger.warning(f"Completion not sent: {e}")
         return CompletionData(
-            status=CompletionResult.OK, reply_text=reply, status_text=None
+            status=CompletionResult.OVER_BUDGET,
+            reply_text=None,
+            status_text=str(e),
+            stream=stream,
         )
     except openai.BadRequestError as e:
         if "This model's maximum context length" in str(e):
-            return CompletionData(
-                status=CompletionResult.TOO_LONG, reply_text=None, status_text=str(e)
-            )
+            return too_long(e)
         else:
             logger.exception(e)
             return CompletionData(
                 status=CompletionResult.INVALID_REQUEST,
                 reply_text=None,
                 status_text=str(e),
+                stream=stream,
             )
     except Exception as e:
         logger.exception(e)
         return CompletionData(
-            status=CompletionResult.OTHER_ERROR, reply_text=None, status_text=str(e)
+            status=CompletionResult.OTHER_ERROR,
+            reply_text=None,
+            status_text=str(e),
+            stream=stream,
         )
 
-# 处理完成响应的异步函数
+# 处理完成响应的异步函数，按结果记录发送耗时
 async def process_response(
     user: str, thread: discord.Thread, response_data: CompletionData
+):
+    with DISCORD_SEND_SECONDS.time(result=response_data.status.name.lower()):
+        await _process_response(user=user, thread=thread, response_data=response_data)
+
+async def _process_response(
+    user: str, thread: discord.Thread, response_data: CompletionData
 ):
     status = response_data.status
     reply_text = response_data.reply_text
     status_text = response_data.status_text
+    stream = response_data.stream
     if status is CompletionResult.OK or status is CompletionResult.MODERATION_FLAGGED:
-        sent_message = None
-        if not reply_text:
-            # 发送无效响应的消息
-            sent_message = await thread.send(
-                embed=discord.Embed(
-                    description=f"**Invalid response** - empty response",
+        # 被标记的通知附在回复的最后一条消息上，不单独发送
+        notices = []
+        if status is CompletionResult.MODERATION_FLAGGED:
+            notices.append(
+                discord.Embed(
+                    description=f"⚠️ **This conversation has been flagged by moderation.**",
                     color=discord.Color.yellow(),
                 )
             )
+        sent_message = None
+        if stream and stream.messages:
+            # 流式模式下回复已经发送
+            for sent_message in stream.messages:
+                conversation_cache.add(sent_message)
+            if notices:
+                await sent_message.edit(embeds=notices)
+        elif not reply_text:
+            # 发送无效响应的消息
+            sent_message = await outbound.send(
+                thread,
+                embeds=[
+                    discord.Embed(
+                        description=f"**Invalid response** - empty response",
+                        color=discord.Color.yellow(),
+                    ),
+                    *notices,
+                ],
+            )
         else:
-            shorter_response = split_into_shorter_messages(reply_text)
-            # 将较长的响应分割成多条消息并发送
-            for r in shorter_response:
-                sent_message = await thread.send(r)
+            # 按 Markdown 边界拆分较长的响应，很长的响应作为附件发送
+            for sent_message in await outbound.send_reply(thread, reply_text, embeds=notices):
+                # 立即将回复写入对话缓存，无需等待网关事件
+                conversation_cache.add(sent_message)
         if status is CompletionResult.MODERATION_FLAGGED:
             # 发送审核标记消息
             await send_moderation_flagged_message(
@@ -135,14 +703,12 @@ async def process_response(
                 message=reply_text,
                 url=sent_message.jump_url if sent_message else "no url",
             )
-            # 发送被标记的通知
-            await thread.send(
-                embed=discord.Embed(
-                    description=f"⚠️ **This conversation has been flagged by moderation.**",
-                    color=discord.Color.yellow(),
-                )
-            )
-    elif status is CompletionResult.MODERATION_BLOCKED:
+        return
+
+    # 撤回流式模式下已发送的部分回复
+    if stream:
+        await stream.retract()
+    if status is CompletionResult.MODERATION_BLOCKED:
         # 发送审核拦截消息
         await send_moderation_blocked_message(
             guild=thread.guild,
@@ -151,28 +717,48 @@ async def process_response(
             message=reply_text,
         )
         # 发送被拦截的通知
-        await thread.send(
-            embed=discord.Embed(
-                description=f"❌ **The response has been blocked by moderation.**",
-                color=discord.Color.red(),
-            )
+        await outbound.send(
+            thread,
+            embeds=[
+                discord.Embed(
+                    description=f"❌ **The response has been blocked by moderation.**",
+                    color=discord.Color.red(),
+                )
+            ],
         )
     elif status is CompletionResult.TOO_LONG:
         # 关闭线程
         await close_thread(thread)
+    elif status is CompletionResult.OVER_BUDGET:
+        # 发送请求过多的消息
+        await outbound.send(
+            thread,
+            embeds=[
+                discord.Embed(
+                    description=f"**Busy** - {status_text}",
+                    color=discord.Color.yellow(),
+                )
+            ],
+        )
     elif status is CompletionResult.INVALID_REQUEST:
         # 发送无效请求的消息
-        await thread.send(
-            embed=discord.Embed(
-                description=f"**Invalid request** - {status_text}",
-                color=discord.Color.yellow(),
-            )
+        await outbound.send(
+            thread,
+            embeds=[
+                discord.Embed(
+                    description=f"**Invalid request** - {status_text}",
+                    color=discord.Color.yellow(),
+                )
+            ],
         )
     else:
         # 发送其他错误的消息
-        await thread.send(
-            embed=discord.Embed(
-                description=f"**Error** - {status_text}",
-                color=discord.Color.yellow(),
-            )
+        await outbound.send(
+            thread,
+            embeds=[
+                discord.Embed(
+                    description=f"**Error** - {status_text}",
+                    color=discord.Color.yellow(),
+                )
+            ],
         )
@@ -1,17 +1,22 @@
 from dotenv import load_dotenv
 import os
-import dacite
-import yaml
-from typing import Dict, List, Literal
+from typing import Dict, List, Literal, Optional
 
-from src.base import Config
+from src.base import Config, ThreadConfig
+from src.snapshot import load_config
 
 load_dotenv()
 
-# 加载 config.yaml
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
-CONFIG: Config = dacite.from_dict(
-    Config, yaml.safe_load(open(os.path.join(SCRIPT_DIR, "config.yaml"), "r"))
+# 启动缓存目录：已校验的配置快照和已同步的斜线命令哈希
+STARTUP_CACHE_DIR = os.environ.get("STARTUP_CACHE_DIR") or os.path.join(
+    os.path.dirname(SCRIPT_DIR), ".startup-cache"
+)
+
+# 加载 config.yaml，内容未变时使用缓存的快照
+CONFIG: Config = load_config(
+    os.path.join(SCRIPT_DIR, "config.yaml"),
+    os.path.join(STARTUP_CACHE_DIR, "config.json"),
 )
 
 BOT_NAME = CONFIG.name  # 机器人名称
@@ -22,6 +27,10 @@ DISCORD_BOT_TOKEN = os.environ["DISCORD_BOT_TOKEN"]
 DISCORD_CLIENT_ID = os.environ["DISCORD_CLIENT_ID"]
 OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
 DEFAULT_MODEL = os.environ["DEFAULT_MODEL"]
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None  # 为空时使用官方地址
+
+# 没有保存配置的线程使用的默认配置
+DEFAULT_THREAD_CONFIG = ThreadConfig(model=DEFAULT_MODEL, max_tokens=512, temperature=1.0)
 
 ALLOWED_SERVER_IDS: List[int] = []
 server_ids = os.environ["ALLOWED_SERVER_IDS"].split(",")
@@ -65,16 +74,173 @@ MODERATION_VALUES_FOR_FLAGGED = {
     "violence/graphic": 0.1,
 }
 
+MODERATION_MODEL = "text-moderation-latest"
+MODERATION_BATCH_WINDOW_SECONDS = (
+    0.02  # 收集并发审查请求的时间窗口，窗口内的输入合并为一次 API 调用
+)
+MODERATION_MAX_BATCH_SIZE = 32  # 单次审查 API 调用的最大输入数
+MODERATION_CACHE_MAX_ENTRIES = 10000  # 审查结果缓存的最大条目数
+MODERATION_CACHE_TTL_SECONDS = 24 * 60 * 60  # 审查结果缓存的有效期
+# 可选的审查缓存 SQLite 文件路径，设置后缓存在重启后依然有效
+MODERATION_CACHE_PATH = os.environ.get("MODERATION_CACHE_PATH") or None
+MODERATION_CACHE_FLUSH_SECONDS = 1.0  # 审查缓存批量写入磁盘的间隔
+MODERATION_CHANNEL_CACHE_SECONDS = 60 * 60  # 通过 REST 获取的审查频道缓存时间
+MODERATION_CHANNEL_MISSING_SECONDS = 10 * 60  # 找不到的审查频道多久后重新请求
+MODERATION_LOG_BATCH_SECONDS = 2.0  # 合并审查日志通知的时间窗口
+
+# 本地预审查：命中屏蔽列表的消息直接屏蔽，允许列表中的简短消息直接放行，都不调用审查 API
+MODERATION_BLOCKLIST_PATH = os.environ.get("MODERATION_BLOCKLIST_PATH") or None  # 每行一个屏蔽词或短语
+MODERATION_SAFE_MESSAGES_PATH = os.environ.get("MODERATION_SAFE_MESSAGES_PATH") or None  # 每行一条，追加到默认列表
+MODERATION_SAFE_MESSAGES = [
+    "ok", "okay", "k", "kk", "yes", "yeah", "yep", "no", "nope", "sure",
+    "thanks", "thank you", "thx", "ty", "tysm", "np", "lol", "lmao", "haha",
+    "nice", "cool", "great", "got it", "i see", "hi", "hello", "hey", "bye",
+    "ok thanks", "ok thank you", "continue", "go on", "more", "why", "how",
+]  # 经过规范化（小写、去掉结尾标点）后完全相同才放行
+MODERATION_SAFE_MESSAGE_MAX_CHARS = 20  # 超过这个长度的消息不走允许列表
+
 SECONDS_DELAY_RECEIVING_MSG = (
-    3  # 给机器人一个响应的延迟，以便它能够捕获多个消息
+    1.5  # 线程安静这么久后才回复，以便机器人能够捕获多条连续消息
+)
+MAX_SECONDS_DELAY_RECEIVING_MSG = (
+    6  # 用户持续发送消息时，从第一条消息起最多等待这么久就回复
 )
 MAX_THREAD_MESSAGES = 200
+# 可选的线程配置 SQLite 文件路径，设置后线程配置在重启后依然有效
+THREAD_STORE_PATH = os.environ.get("THREAD_STORE_PATH") or None
+THREAD_STORE_FLUSH_SECONDS = 1.0  # 线程配置批量写入磁盘的间隔
+THREAD_STORE_CACHE_SIZE = 50000  # 内存中缓存的线程配置数
+THREAD_STORE_ARCHIVED_TTL_SECONDS = 7 * 24 * 60 * 60  # 归档线程的配置保留时间
+
+# 滚动摘要：启用后较早的消息会在后台折叠进摘要，线程不再因消息数过多而关闭
+ENABLE_THREAD_SUMMARIES = os.environ.get("ENABLE_THREAD_SUMMARIES", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL") or None  # 为空时使用线程的模型
+SUMMARY_TRIGGER_TOKENS = 2000  # 摘要之后的消息超过此 token 数时触发摘要
+SUMMARY_KEEP_TOKENS = 800  # 摘要时保留不折叠的最新消息 token 数
+SUMMARY_MAX_TOKENS = 400  # 摘要本身的最大 token 数
+MAX_CACHED_THREADS = 1000  # 内存中最多缓存对话的线程数
+CONVERSATION_CACHE_IDLE_SECONDS = 60 * 60  # 线程对话空闲多久后从缓存中淘汰
 ACTIVATE_THREAD_PREFX = "💬✅"
 INACTIVATE_THREAD_PREFIX = "💬❌"
-MAX_CHARS_PER_REPLY_MSG = (
-    1500  # Discord 有 2k 限制，我们只分为 1.5k 消息
+DISCORD_MAX_MESSAGE_CHARS = 2000  # Discord 单条消息的长度上限
+DISCORD_MAX_EMBEDS_PER_MESSAGE = 10  # Discord 单条消息的嵌入数上限
+# Discord 每个频道的发消息速率限制：每个窗口内的发送次数和窗口长度（秒）
+DISCORD_CHANNEL_SENDS_PER_WINDOW = 5
+DISCORD_CHANNEL_SEND_WINDOW_SECONDS = 5.0
+# 回复超过这个长度时只发送开头部分，完整回复作为文件附件发送，0 表示不使用附件
+REPLY_ATTACHMENT_MIN_CHARS = int(
+    os.environ.get("REPLY_ATTACHMENT_MIN_CHARS", str(3 * DISCORD_MAX_MESSAGE_CHARS))
+)
+
+# 是否以流式方式生成回复，边生成边编辑 Discord 消息
+STREAM_COMPLETIONS = os.environ.get("STREAM_COMPLETIONS", "").lower() in (
+    "1",
+    "true",
+    "yes",
 )
+STREAM_EDIT_INTERVAL_SECONDS = 1.0  # 流式回复编辑消息的最小间隔，避免触发速率限制
+
+# 回复缓存：渲染后的提示和参数完全相同时复用已审查的回复（需手动开启）
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+RESPONSE_CACHE_MAX_TEMPERATURE = float(
+    os.environ.get("RESPONSE_CACHE_MAX_TEMPERATURE", "0")
+)  # 只缓存温度不高于此值的请求，默认只缓存确定性的回复
+RESPONSE_CACHE_MAX_ENTRIES = 5000
+RESPONSE_CACHE_TTL_SECONDS = 60 * 60
 
 AVAILABLE_MODELS = Literal[
     "gpt-3.5-turbo", "gpt-4", "gpt-4-1106-preview", "gpt-4-32k"
 ]  # 可用模型
+
+# 各模型的上下文窗口大小（token）
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+    "gpt-4-1106-preview": 128000,
+    "gpt-4-32k": 32768,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+TOKENIZER_RETRY_SECONDS = 60  # 分词器加载失败后多久重试
+
+# OpenAI 与 Discord 的 HTTP 连接池设置
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "50"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 20
+DISCORD_MAX_CONNECTIONS = int(os.environ.get("DISCORD_MAX_CONNECTIONS", "100"))
+HTTP_KEEPALIVE_SECONDS = 30  # 空闲连接保持时间
+HTTP_CONNECT_TIMEOUT_SECONDS = 5
+OPENAI_READ_TIMEOUT_SECONDS = 120  # gpt-4 长回复可能需要较长时间
+
+# 同时进行的完成请求上限
+MAX_CONCURRENT_COMPLETIONS = int(os.environ.get("MAX_CONCURRENT_COMPLETIONS", "8"))
+# 各模型每分钟 token 预算，应与 OpenAI 账户的速率限制一致
+MODEL_TOKENS_PER_MINUTE: Dict[str, int] = {
+    "gpt-3.5-turbo": 90000,
+    "gpt-4": 10000,
+    "gpt-4-1106-preview": 150000,
+    "gpt-4-32k": 80000,
+}
+MAX_COMPLETION_QUEUE_SECONDS = 30  # 预计排队超过这个时间的请求直接拒绝
+
+# 完成请求遇到暂时性错误（429、5xx、连接错误）时的重试设置
+COMPLETION_RETRY_DEADLINE_SECONDS = 60  # 包括重试在内的总时限
+COMPLETION_MAX_ATTEMPTS = 5
+COMPLETION_RETRY_BASE_SECONDS = 1.0  # 指数退避的基准时间
+COMPLETION_RETRY_MAX_SECONDS = 20.0  # 单次退避的最长时间
+CIRCUIT_BREAKER_FAILURES = 5  # 连续失败多少次后熔断该模型
+CIRCUIT_BREAKER_RESET_SECONDS = 30  # 熔断多久后允许试探请求
+
+# 主模型熔断时使用的更便宜的备用模型
+ENABLE_MODEL_FALLBACK = os.environ.get("ENABLE_MODEL_FALLBACK", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+FALLBACK_MODELS: Dict[str, str] = {
+    "gpt-4": "gpt-3.5-turbo",
+    "gpt-4-32k": "gpt-4",
+    "gpt-4-1106-preview": "gpt-3.5-turbo",
+}
+
+# 服务器在公平排队中的权重，格式为 "服务器ID:权重,..."，默认权重为 1
+GUILD_COMPLETION_WEIGHTS: Dict[int, float] = {}
+guild_weights = os.environ.get("GUILD_COMPLETION_WEIGHTS", "")
+for s in guild_weights.split(",") if guild_weights else []:
+    values = s.split(":")
+    GUILD_COMPLETION_WEIGHTS[int(values[0])] = float(values[1])
+
+# 指标端点：设置 METRICS_PORT 后在本地提供 GET /metrics
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0")) or None
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# 分片：SHARD_COUNT 为总分片数（"auto" 表示使用 Discord 推荐的分片数），
+# SHARD_IDS 为本进程负责的分片，格式为 "0,1,2" 或 "0-3"，为空时负责全部分片
+shard_count = os.environ.get("SHARD_COUNT", "").strip().lower()
+AUTO_SHARD = shard_count == "auto"
+SHARD_COUNT = int(shard_count) if shard_count.isdigit() else None
+SHARD_IDS: Optional[List[int]] = None
+shard_ids = os.environ.get("SHARD_IDS", "").strip()
+for s in shard_ids.split(",") if shard_ids else []:
+    first, _, last = s.partition("-")
+    SHARD_IDS = (SHARD_IDS or []) + list(range(int(first), int(last or first) + 1))
+SHARD_PROCESSES = int(os.environ.get("SHARD_PROCESSES", "1"))  # 启动器启动的进程数
+
+# 事件循环看门狗：超过阈值的卡顿会记录阻塞位置的栈，SIGUSR1 开启或关闭采样分析
+LOOP_LAG_THRESHOLD_SECONDS = float(os.environ.get("LOOP_LAG_THRESHOLD_SECONDS", "0.25"))
+LOOP_WATCHDOG_INTERVAL_SECONDS = 0.05  # 心跳间隔
+PROFILE_SAMPLE_INTERVAL_SECONDS = 0.005  # 采样分析的间隔
+PROFILE_OUTPUT_DIR = os.environ.get("PROFILE_OUTPUT_DIR", ".")
+
+# 精简运行模式：只订阅服务器、服务器消息和消息内容事件，限制消息缓存，
+# 不缓存成员、启动时不拉取成员列表，并在网关层丢弃不在 ALLOWED_SERVER_IDS 中的服务器的事件
+LEAN_RUNTIME = os.environ.get("LEAN_RUNTIME", "").lower() in ("1", "true", "yes")
+# 精简模式下消息缓存的条数，0 表示不缓存消息
+# （线程的第一条消息需要从缓存中找到 /chat 创建的消息才能取得初始提示）
+MESSAGE_CACHE_SIZE = int(os.environ.get("MESSAGE_CACHE_SIZE", "200"))
@@ -0,0 +1,38 @@
+import asyncio
+from typing import Awaitable, Callable, Dict
+
+from src.inflight import InflightRegistry
+from src.utils import logger
+
+# 按线程去抖：每条新消息重置该线程的计时器，线程安静下来后只触发一次生成。
+# 计时器最长不超过 max_delay（从这一轮第一条消息算起），
+# 新消息到达时取消该线程正在进行的生成
+class ThreadDebouncer:
+    def __init__(self, min_delay: float, max_delay: float, registry: InflightRegistry):
+        self.min_delay = min_delay  # 最后一条消息后需要安静的时间
+        self.max_delay = max_delay  # 从第一条消息起最长等待时间
+        self.registry = registry  # 正在进行的生成
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._first_seen: Dict[int, float] = {}
+
+    # 线程收到新消息
+    def schedule(self, thread_id: int, callback: Callable[[], Awaitable[None]]):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.registry.cancel(thread_id)
+        timer = self._timers.pop(thread_id, None)
+        if timer is not None:
+            timer.cancel()
+        first_seen = self._first_seen.setdefault(thread_id, now)
+        delay = max(0.0, min(self.min_delay, first_seen + self.max_delay - now))
+        self._timers[thread_id] = loop.call_later(delay, self._fire, thread_id, callback)
+
+    def _fire(self, thread_id: int, callback: Callable[[], Awaitable[None]]):
+        self._timers.pop(thread_id, None)
+        self._first_seen.pop(thread_id, None)
+        task = self.registry.start(thread_id, callback())
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Debounced callback failed: {task.exception()!r}", exc_info=task.exception())
@@ -0,0 +1,174 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import discord
+from discord import Message as DiscordMessage
+
+from src.base import Message
+from src.constants import (
+    MAX_THREAD_MESSAGES,
+    MAX_CACHED_THREADS,
+    CONVERSATION_CACHE_IDLE_SECONDS,
+)
+from src.utils import logger, discord_message_to_message
+from src.metrics import HISTORY_FETCH_SECONDS, registry
+
+# 单个线程的缓存对话：按消息 ID 排序的 (ID, 消息) 环形缓冲区，
+# 超过 MAX_THREAD_MESSAGES 时自动丢弃最早的消息
+@dataclass(slots=True)
+class CachedConversation:
+    messages: "deque[Tuple[int, Message]]" = field(
+        default_factory=lambda: deque(maxlen=MAX_THREAD_MESSAGES)
+    )
+    last_id: int = 0  # 已见过的最新消息 ID（包括无法转换的消息）
+    last_access: float = field(default_factory=time.monotonic)
+
+    # 消息在缓冲区中的位置，不存在时返回 None；只在编辑、删除和乱序时使用
+    def index(self, message_id: int) -> Optional[int]:
+        for index, (cached_id, _) in enumerate(self.messages):
+            if cached_id == message_id:
+                return index
+        return None
+
+
+# 按线程缓存对话：首次从 thread.history 加载，之后由网关事件增量更新，
+# 发现缺口时重新从历史记录构建
+class ConversationCache:
+    def __init__(self, max_threads: int, idle_seconds: float):
+        self.max_threads = max_threads  # 最多缓存的线程数
+        self.idle_seconds = idle_seconds  # 空闲多久后淘汰
+        self.rebuilds = 0  # 从历史记录构建的次数
+        self._threads: "OrderedDict[int, CachedConversation]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._threads)
+
+    # 获取线程的对话，按时间顺序返回
+    async def get_messages(self, thread: discord.Thread) -> List[Message]:
+        return [message for _, message in await self.get_history(thread)]
+
+    # 获取线程的对话及每条消息的 ID，按时间顺序返回
+    async def get_history(self, thread: discord.Thread) -> List[Tuple[int, Message]]:
+        entry = self._threads.get(thread.id)
+        if entry is None or self._has_gap(entry, thread):
+            with HISTORY_FETCH_SECONDS.time(source="rebuild"):
+                entry = await self._rebuild(thread)
+        else:
+            HISTORY_FETCH_SECONDS.observe(0.0, source="cache")
+        entry.last_access = time.monotonic()
+        self._threads.move_to_end(thread.id)
+        return list(entry.messages)
+
+    # 网关收到新消息（包括机器人自己发送的回复）
+    def add(self, message: DiscordMessage):
+        entry = self._threads.get(message.channel.id)
+        if entry is None:
+            return
+        out_of_order = message.id <= entry.last_id
+        if out_of_order and entry.index(message.id) is not None:
+            return
+        converted = discord_message_to_message(message)
+        if converted is None:
+            pass
+        elif out_of_order:
+            # 事件乱序到达，重新按 ID 排序，超出上限时丢弃最早的消息
+            entry.messages = deque(
+                sorted([*entry.messages, (message.id, converted)], key=lambda item: item[0]),
+                maxlen=MAX_THREAD_MESSAGES,
+            )
+        else:
+            entry.messages.append((message.id, converted))
+        entry.last_id = max(entry.last_id, message.id)
+
+    # 消息被编辑
+    def edit(self, channel_id: int, message_id: int, content: Optional[str]):
+        entry = self._threads.get(channel_id)
+        if entry is None or content is None:
+            return
+        index = entry.index(message_id)
+        if index is None:
+            # 无法确定编辑后的消息是否应加入对话，下次读取时重新构建
+            if message_id <= entry.last_id:
+                self.invalidate(channel_id)
+            return
+        if content:
+            existing = entry.messages[index][1]
+            entry.messages[index] = (message_id, Message(user=existing.user, text=content))
+        else:
+            del entry.messages[index]
+
+    # 消息被删除
+    def delete(self, channel_id: int, message_ids: Iterable[int]):
+        entry = self._threads.get(channel_id)
+        if entry is None:
+            return
+        for message_id in message_ids:
+            index = entry.index(message_id)
+            if index is not None:
+                del entry.messages[index]
+
+    # 使某个线程或全部线程的缓存失效
+    def invalidate(self, thread_id: Optional[int] = None):
+        if thread_id is None:
+            self._threads.clear()
+        else:
+            self._threads.pop(thread_id, None)
+
+    # 线程中有未收到事件的新消息时视为存在缺口
+    def _has_gap(self, entry: CachedConversation, thread: discord.Thread) -> bool:
+        last_message_id = thread.last_message_id
+        return last_message_id is not None and last_message_id > entry.last_id
+
+    async def _rebuild(self, thread: discord.Thread) -> CachedConversation:
+        task = self._loading.get(thread.id)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._load(thread))
+            self._loading[thread.id] = task
+            task.add_done_callback(lambda _: self._loading.pop(thread.id, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, thread: discord.Thread) -> CachedConversation:
+        self.rebuilds += 1
+        entry = CachedConversation()
+        history = [
+            message async for message in thread.history(limit=MAX_THREAD_MESSAGES)
+        ]
+        for message in reversed(history):
+            converted = discord_message_to_message(message)
+            if converted is not None:
+                entry.messages.append((message.id, converted))
+            entry.last_id = max(entry.last_id, message.id)
+        self._threads[thread.id] = entry
+        self._threads.move_to_end(thread.id)
+        self._evict()
+        logger.info(f"Loaded {len(entry.messages)} messages for thread {thread.id}")
+        return entry
+
+    # 淘汰空闲的线程，并将缓存的线程数限制在上限内
+    def _evict(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._threads:
+            thread_id, entry = next(iter(self._threads.items()))
+            if len(self._threads) <= self.max_threads and entry.last_access >= cutoff:
+                break
+            del self._threads[thread_id]
+
+
+conversation_cache = ConversationCache(
+    max_threads=MAX_CACHED_THREADS, idle_seconds=CONVERSATION_CACHE_IDLE_SECONDS
+)
+
+registry.gauge(
+    "gptbot_conversation_cache_threads",
+    "Threads held in the conversation cache",
+    lambda: len(conversation_cache),
+)
+registry.counter_func(
+    "gptbot_conversation_cache_rebuilds_total",
+    "Conversations rebuilt from thread history",
+    lambda: conversation_cache.rebuilds,
+)
@@ -0,0 +1,51 @@
+from typing import AsyncIterator
+
+import httpx
+
+
+# 响应体读完或关闭时释放连接计数
+class _TrackedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, transport: "PooledTransport"):
+        self._stream = stream
+        self._transport = transport
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._transport.in_flight -= 1
+        await self._stream.aclose()
+
+
+# 统计连接池使用情况的 HTTP 传输层
+class PooledTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, max_connections: int, **kwargs):
+        super().__init__(**kwargs)
+        self.max_connections = max_connections
+        self.in_flight = 0  # 正在占用连接的请求数
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.saturated_requests = 0  # 发出时连接池已满、需要等待连接的请求数
+
+    # 连接池使用率，1 表示已满
+    @property
+    def saturation(self) -> float:
+        return self.in_flight / self.max_connections
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.in_flight >= self.max_connections:
+            self.saturated_requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        response.stream = _TrackedStream(response.stream, self)
+        return response
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Coroutine, Dict, Optional
+
+from src.utils import logger
+from src.metrics import registry
+
+# 正在进行的回复生成
+@dataclass
+class InflightCompletion:
+    thread_id: int
+    started_at: float = field(default_factory=time.monotonic)
+    sent_at: Optional[float] = None  # 请求发送给 API 的时间，仍在排队或命中缓存时为 None
+    prompt_tokens: int = 0  # 已发送请求的提示 token 数
+    completion_tokens: int = 0  # 已收到的回复 token 数（流式模式）
+    task: Optional[asyncio.Task] = None
+
+    # 获得请求槽位、把请求发送给 API 时调用，此后取消才会浪费 token
+    def mark_sent(self, prompt_tokens: int):
+        if self.sent_at is None:
+            self.sent_at = time.monotonic()
+        self.prompt_tokens = prompt_tokens
+
+
+_current: ContextVar[Optional[InflightCompletion]] = ContextVar(
+    "inflight_completion", default=None
+)
+
+# 当前任务对应的生成记录，不在注册表中运行时返回 None
+def current_inflight() -> Optional[InflightCompletion]:
+    return _current.get()
+
+
+# 按线程登记正在进行的生成，新消息到达时取消被取代的生成，并统计节省的时间和 token
+class InflightRegistry:
+    def __init__(self):
+        self.cancelled = 0  # 取消的生成数
+        self.cancelled_unsent = 0  # 其中请求尚未发送（排队中或还在准备）的生成数
+        self.cancelled_seconds = 0.0  # 被取消的请求发送后已运行的总时间
+        self.cancelled_prompt_tokens = 0  # 被取消的生成的提示 token 数
+        self.cancelled_completion_tokens = 0  # 取消前已收到的回复 token 数
+        self._inflight: Dict[int, InflightCompletion] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    # 在线程上开始新的生成，取消该线程之前的生成
+    def start(self, thread_id: int, coro: Coroutine) -> asyncio.Task:
+        self.cancel(thread_id)
+        entry = InflightCompletion(thread_id=thread_id)
+        entry.task = asyncio.get_running_loop().create_task(self._run(entry, coro))
+        self._inflight[thread_id] = entry
+        entry.task.add_done_callback(lambda _: self._done(entry))
+        return entry.task
+
+    # 取消线程上正在进行的生成
+    def cancel(self, thread_id: int) -> bool:
+        entry = self._inflight.pop(thread_id, None)
+        if entry is None or entry.task.done():
+            return False
+        entry.task.cancel()
+        self.cancelled += 1
+        if entry.sent_at is None:
+            # 请求还没有发送，没有浪费 API 的时间和 token
+            self.cancelled_unsent += 1
+        else:
+            self.cancelled_seconds += time.monotonic() - entry.sent_at
+            self.cancelled_prompt_tokens += entry.prompt_tokens
+            self.cancelled_completion_tokens += entry.completion_tokens
+        logger.info(
+            f"Cancelled superseded completion in thread {thread_id} after "
+            f"{time.monotonic() - entry.started_at:.2f}s"
+        )
+        return True
+
+    async def _run(self, entry: InflightCompletion, coro: Coroutine):
+        _current.set(entry)
+        return await coro
+
+    def _done(self, entry: InflightCompletion):
+        if self._inflight.get(entry.thread_id) is entry:
+            del self._inflight[entry.thread_id]
+
+
+inflight_registry = InflightRegistry()
+
+registry.gauge(
+    "gptbot_inflight_completions",
+    "Completions currently generating",
+    lambda: len(inflight_registry),
+)
+registry.counter_func(
+    "gptbot_cancelled_completions_total",
+    "Completions cancelled because a newer message arrived",
+    lambda: inflight_registry.cancelled,
+)
+registry.counter_func(
+    "gptbot_cancelled_unsent_completions_total",
+    "Cancelled completions whose API request had not been sent yet",
+    lambda: inflight_registry.cancelled_unsent,
+)
+registry.counter_func(
+    "gptbot_cancelled_completion_seconds_total",
+    "Time cancelled completions had been waiting on the API before they were cancelled",
+    lambda: inflight_registry.cancelled_seconds,
+)
+registry.counter_func(
+    "gptbot_cancelled_completion_tokens_total",
+    "Tokens spent on cancelled completions",
+    lambda: {
+        ("prompt",): inflight_registry.cancelled_prompt_tokens,
+        ("completion",): inflight_registry.cancelled_completion_tokens,
+    },
+    ["kind"],
+)
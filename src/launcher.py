@@ -0,0 +1,84 @@
+# 多进程启动器：把 SHARD_COUNT 个分片平均分给 SHARD_PROCESSES 个进程，
+# 每个进程运行一个分片客户端，共享本地 SQLite 中的线程配置和审查缓存
+# 用法: SHARD_COUNT=8 SHARD_PROCESSES=4 python -m src.launcher
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from src.constants import (
+    SHARD_COUNT,
+    SHARD_PROCESSES,
+    THREAD_STORE_PATH,
+    MODERATION_CACHE_PATH,
+    METRICS_PORT,
+)
+from src.sharding import split_shards
+from src.utils import logger
+
+RESTART_DELAY_SECONDS = 5  # 进程异常退出后重启前的等待时间
+
+
+# 每个进程的环境变量：负责的分片、共享的存储，以及各自的指标端口
+def shard_env(index: int, shard_ids: List[int]) -> Dict[str, str]:
+    env = dict(os.environ)
+    env["SHARD_COUNT"] = str(SHARD_COUNT)
+    env["SHARD_IDS"] = ",".join(str(i) for i in shard_ids)
+    env["THREAD_STORE_PATH"] = THREAD_STORE_PATH or "threads.db"
+    env["MODERATION_CACHE_PATH"] = MODERATION_CACHE_PATH or "moderation_cache.db"
+    if METRICS_PORT:
+        env["METRICS_PORT"] = str(METRICS_PORT + index)
+    return env
+
+
+def main():
+    if SHARD_COUNT is None:
+        sys.exit("SHARD_COUNT must be set to a number of shards")
+    ranges = split_shards(SHARD_COUNT, SHARD_PROCESSES)
+    processes: Dict[int, subprocess.Popen] = {}
+    stopping = False
+
+    def start(index: int):
+        processes[index] = subprocess.Popen(
+            [sys.executable, "-m", "src.main"], env=shard_env(index, ranges[index])
+        )
+        logger.info(f"Started shards {ranges[index]} as pid {processes[index].pid}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for index in range(len(ranges)):
+        start(index)
+
+    # 异常退出的进程在等待后重启，收到停止信号后等待全部进程退出
+    restart_at: Dict[int, float] = {}
+    while processes:
+        time.sleep(1)
+        for index, process in list(processes.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            if stopping or code == 0:
+                del processes[index]
+            elif index not in restart_at:
+                logger.warning(f"Shards {ranges[index]} exited with {code}, restarting")
+                restart_at[index] = time.monotonic() + RESTART_DELAY_SECONDS
+            elif time.monotonic() >= restart_at[index]:
+                del restart_at[index]
+                start(index)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="[%(asctime)s] [%(filename)s:%(lineno)d] %(message)s", level=logging.INFO
+    )
+    main()
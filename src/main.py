@@ -1,5 +1,5 @@
-from collections import defaultdict
-from typing import Literal, Optional, Union
+import os
+from typing import Dict, Literal, Optional, Tuple, Union, get_args
 
 import discord
 from discord import Message as DiscordMessage, app_commands
@@ -12,21 +12,52 @@ from src.constants import (
     ACTIVATE_THREAD_PREFX,
     MAX_THREAD_MESSAGES,
     SECONDS_DELAY_RECEIVING_MSG,
+    MAX_SECONDS_DELAY_RECEIVING_MSG,
     AVAILABLE_MODELS,
     DEFAULT_MODEL,
+    DEFAULT_THREAD_CONFIG,
+    STREAM_COMPLETIONS,
+    ENABLE_THREAD_SUMMARIES,
+    METRICS_HOST,
+    METRICS_PORT,
+    LOOP_LAG_THRESHOLD_SECONDS,
+    LOOP_WATCHDOG_INTERVAL_SECONDS,
+    PROFILE_SAMPLE_INTERVAL_SECONDS,
+    PROFILE_OUTPUT_DIR,
+    LEAN_RUNTIME,
+    STARTUP_CACHE_DIR,
+    SUMMARY_TRIGGER_TOKENS,
+    SUMMARY_KEEP_TOKENS,
+    SUMMARY_MAX_TOKENS,
 )
 import asyncio
 from src.utils import (
     logger,
     should_block,
     close_thread,
-    is_last_message_stale,
-    discord_message_to_message,
 )
+from src.history import conversation_cache
+from src.thread_store import create_thread_store
+from src.summary import ThreadSummarizer
+from src.debounce import ThreadDebouncer
+from src.inflight import inflight_registry
+from src.transport import shared_transport
+from src.tokens import preload_encodings
+from src.outbound import outbound
+from src.metrics import MetricsServer, registry
+from src.sharding import SHARDED, client_shard_options
+from src.watchdog import LoopWatchdog
+from src.runtime import client_cache_options, client_intents, install_guild_filter
+from src.snapshot import commands_digest, commands_synced, mark_commands_synced
 from src import completion
-from src.completion import generate_completion_response, process_response
+from src.completion import (
+    StreamingReply,
+    generate_completion_response,
+    process_response,
+)
 from src.moderation import (
     moderate_message,
+    moderation_cache,
     send_moderation_blocked_message,
     send_moderation_flagged_message,
 )
@@ -36,31 +67,135 @@ logging.basicConfig(
     format="[%(asctime)s] [%(filename)s:%(lineno)d] %(message)s", level=logging.INFO
 )
 
-# 创建 Discord 客户端
-intents = discord.Intents.default()
-intents.message_content = True
-client = discord.Client(intents=intents)
+# Discord 客户端，随客户端生命周期启动和关闭共享连接池与线程配置存储；
+# 配置了分片时使用分片客户端，本进程只连接负责的分片
+class GPTBotClient(discord.AutoShardedClient if SHARDED else discord.Client):
+    async def login(self, token: str):
+        self.http.connector = shared_transport.discord_connector()
+        await super().login(token)
+
+    async def setup_hook(self):
+        # 在工作线程中导入 OpenAI 客户端库，与连接网关同时进行
+        self.loop.run_in_executor(None, shared_transport.preload)
+        # 分词器首次加载需要下载 BPE 文件，同样放在工作线程中
+        self.loop.run_in_executor(
+            None, preload_encodings, [DEFAULT_MODEL, *get_args(AVAILABLE_MODELS)]
+        )
+        loop_watchdog.start()
+        await thread_store.start()
+        await moderation_cache.start()
+        if metrics_server is not None:
+            await metrics_server.start()
+            logger.info(f"Serving metrics on {METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    async def close(self):
+        if metrics_server is not None:
+            await metrics_server.close()
+        await thread_store.close()
+        await moderation_cache.close()
+        await super().close()
+        await shared_transport.close()
+        await loop_watchdog.stop()
 
-# 命令树和线程数据初始化
+# 创建 Discord 客户端，精简模式下减少订阅的事件和缓存，并在网关层丢弃其他服务器的事件
+intents = client_intents()
+client = GPTBotClient(intents=intents, **client_cache_options(), **client_shard_options())
+if LEAN_RUNTIME:
+    install_guild_filter(client)
+
+# 命令树和线程配置存储初始化
 tree = discord.app_commands.CommandTree(client)
-thread_data = defaultdict()
+thread_store = create_thread_store()
+thread_debouncer = ThreadDebouncer(
+    min_delay=SECONDS_DELAY_RECEIVING_MSG,
+    max_delay=MAX_SECONDS_DELAY_RECEIVING_MSG,
+    registry=inflight_registry,
+)
+thread_summarizer = ThreadSummarizer(
+    store=thread_store,
+    enabled=ENABLE_THREAD_SUMMARIES,
+    trigger_tokens=SUMMARY_TRIGGER_TOKENS,
+    keep_tokens=SUMMARY_KEEP_TOKENS,
+    max_tokens=SUMMARY_MAX_TOKENS,
+)
+loop_watchdog = LoopWatchdog(
+    threshold=LOOP_LAG_THRESHOLD_SECONDS,
+    interval=LOOP_WATCHDOG_INTERVAL_SECONDS,
+    profile_interval=PROFILE_SAMPLE_INTERVAL_SECONDS,
+    profile_dir=PROFILE_OUTPUT_DIR,
+)
+metrics_server = (
+    MetricsServer(registry, host=METRICS_HOST, port=METRICS_PORT)
+    if METRICS_PORT
+    else None
+)
+registry.counter_func(
+    "gptbot_thread_summaries_total",
+    "Rolling thread summaries written",
+    lambda: thread_summarizer.summaries,
+)
+
+# 各分片的网关延迟和服务器数，每个进程只报告自己负责的分片
+def shard_latencies():
+    if SHARDED:
+        return {(str(shard_id),): latency for shard_id, latency in client.latencies}
+    return {("0",): client.latency}
+
+def shard_guilds():
+    counts = {}
+    for guild in client.guilds:
+        key = (str(guild.shard_id),)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+registry.gauge(
+    "gptbot_gateway_latency_seconds",
+    "Gateway heartbeat latency per shard",
+    shard_latencies,
+    ["shard"],
+)
+registry.gauge("gptbot_guilds", "Guilds per shard", shard_guilds, ["shard"])
+GATEWAY_MESSAGES = registry.counter(
+    "gptbot_gateway_messages_total", "Messages received per shard", ["shard"]
+)
+
+# 已同步的斜线命令定义的哈希
+COMMANDS_MARKER_PATH = os.path.join(STARTUP_CACHE_DIR, "commands.sha256")
+# 已应用的机器人名称，重连后名称不变时不重新构建示例对话
+bot_identity: Optional[str] = None
+
+# 斜线命令定义变化时才同步，重连和重启不会重复调用 tree.sync()
+async def sync_commands():
+    digest = commands_digest(
+        client.application_id, [command.to_dict() for command in tree.get_commands()]
+    )
+    if commands_synced(COMMANDS_MARKER_PATH, digest):
+        return
+    await tree.sync()
+    mark_commands_synced(COMMANDS_MARKER_PATH, digest)
+    logger.info("Synced application commands")
 
 # 客户端准备好后执行的事件
 @client.event
 async def on_ready():
+    global bot_identity
     # 日志信息显示登录状态和邀请链接
     logger.info(f"We have logged in as {client.user}. Invite URL: {BOT_INVITE_URL}")
-    completion.MY_BOT_NAME = client.user.name
-    completion.MY_BOT_EXAMPLE_CONVOS = []
-    for c in EXAMPLE_CONVOS:
-        messages = []
-        for m in c.messages:
-            if m.user == "Lenard":
-                messages.append(Message(user=client.user.name, text=m.text))
-            else:
-                messages.append(m)
-        completion.MY_BOT_EXAMPLE_CONVOS.append(Conversation(messages=messages))
-    await tree.sync()
+    # 新的网关会话可能错过了事件，清空对话缓存
+    conversation_cache.invalidate()
+    if client.user.name != bot_identity:
+        example_convos = []
+        for c in EXAMPLE_CONVOS:
+            messages = []
+            for m in c.messages:
+                if m.user == "Lenard":
+                    messages.append(Message(user=client.user.name, text=m.text))
+                else:
+                    messages.append(m)
+            example_convos.append(Conversation(messages=messages))
+        completion.set_bot_identity(name=client.user.name, example_convos=example_convos)
+        bot_identity = client.user.name
+    await sync_commands()
 
 # /chat message 命令
 @tree.command(name="chat", description="Create a new thread for conversation")
@@ -114,7 +249,9 @@ async def chat_command(
 
         try:
             # 进行消息的审查
-            flagged_str, blocked_str = moderate_message(message=message, user=user)
+            flagged_str, blocked_str = await moderate_message(
+                message=message, user=user
+            )
             await send_moderation_blocked_message(
                 guild=int.guild,
                 user=user,
@@ -167,15 +304,26 @@ async def chat_command(
             reason="gpt-bot",
             auto_archive_duration=60,
         )
-        thread_data[thread.id] = ThreadConfig(
+        thread_config = ThreadConfig(
             model=model, max_tokens=max_tokens, temperature=temperature
         )
+        thread_store.set(thread.id, thread_config)
         async with thread.typing():
-            # 获取完成的响应
+            # 获取完成的响应；用户在新线程中发送消息时本次生成会被取消
             messages = [Message(user=user.name, text=message)]
-            response_data = await generate_completion_response(
-                messages=messages, user=user, thread_config=thread_data[thread.id]
-            )
+            try:
+                response_data = await inflight_registry.start(
+                    thread.id,
+                    generate_completion_response(
+                        messages=messages,
+                        user=user,
+                        thread_config=thread_config,
+                        stream=StreamingReply(thread) if STREAM_COMPLETIONS else None,
+                        guild_id=int.guild.id,
+                    ),
+                )
+            except asyncio.CancelledError:
+                return
             # 发送结果
             await process_response(
                 user=user, thread=thread, response_data=response_data
@@ -186,10 +334,156 @@ async def chat_command(
             f"Failed to start chat {str(e)}", ephemeral=True
         )
 
+# 审查线程中收到的消息，返回消息是否被拦截
+async def moderate_incoming_message(
+    message: DiscordMessage, thread: discord.Thread
+) -> bool:
+    flagged_str, blocked_str = await moderate_message(
+        message=message.content, user=message.author
+    )
+    await send_moderation_blocked_message(
+        guild=message.guild,
+        user=message.author,
+        blocked_str=blocked_str,
+        message=message.content,
+    )
+    if len(blocked_str) > 0:
+        try:
+            await message.delete()
+            await outbound.send(
+                thread,
+                embeds=[
+                    discord.Embed(
+                        description=f"❌ **{message.author}'s message has been deleted by moderation.**",
+                        color=discord.Color.red(),
+                    )
+                ],
+            )
+        except Exception as e:
+            await outbound.send(
+                thread,
+                embeds=[
+                    discord.Embed(
+                        description=f"❌ **{message.author}'s message has been blocked by moderation but could not be deleted. Missing Manage Messages permission in this Channel.**",
+                        color=discord.Color.red(),
+                    )
+                ],
+            )
+        return True
+    await send_moderation_flagged_message(
+        guild=message.guild,
+        user=message.author,
+        flagged_str=flagged_str,
+        message=message.content,
+        url=message.jump_url,
+    )
+    if len(flagged_str) > 0:
+        await outbound.send(
+            thread,
+            embeds=[
+                discord.Embed(
+                    description=f"⚠️ **{message.author}'s message has been flagged by moderation.**",
+                    color=discord.Color.yellow(),
+                )
+            ],
+        )
+    return False
+
+# 每个线程中还没有得到回复的消息及其审查任务，按消息 ID 排序
+pending_messages: Dict[int, Dict[int, Tuple[DiscordMessage, asyncio.Task]]] = {}
+
+# 回复已经覆盖到 through_id 为止的消息，之后到达的消息留给下一次回复
+def clear_pending_messages(thread_id: int, through_id: int):
+    pending = pending_messages.get(thread_id)
+    if pending is None:
+        return
+    for message_id in [i for i in pending if i <= through_id]:
+        del pending[message_id]
+    if not pending:
+        del pending_messages[thread_id]
+
+# 线程安静下来后生成并发送回复。回复哪条消息在此时决定：
+# 等待尚未完成的审查（与读取历史并行），回复其中最新的未被拦截的消息
+async def respond_to_thread(thread: discord.Thread):
+    try:
+        pending = sorted(pending_messages.get(thread.id, {}).items())
+        if not pending:
+            return
+        # 审查任务不随本任务取消，下一次回复仍可使用其结果；审查失败的消息按被拦截处理
+        moderation = asyncio.shield(
+            asyncio.gather(*(task for _, (_, task) in pending), return_exceptions=True)
+        )
+        blocked, history, thread_config, summary = await asyncio.gather(
+            moderation,
+            conversation_cache.get_history(thread=thread),
+            thread_store.get(thread.id),
+            thread_summarizer.get(thread.id),
+        )
+        allowed = [message for (_, (message, _)), b in zip(pending, blocked) if not b]
+        if not allowed:
+            # 新消息都被拦截：之前的消息已经得到回复
+            clear_pending_messages(thread.id, pending[-1][0])
+            return
+        message = allowed[-1]
+        # 被拦截的消息可能还没有从缓存中删除
+        blocked_ids = {i for (i, _), b in zip(pending, blocked) if b}
+        history = [item for item in history if item[0] not in blocked_ids]
+
+        logger.info(
+            f"Thread message to process - {message.author}: {message.content[:50]} - {thread.name} {thread.jump_url}"
+        )
+
+        if thread_config is None:
+            # 没有保存的配置（例如存储启用前创建的线程），使用默认配置
+            thread_config = DEFAULT_THREAD_CONFIG
+            thread_store.set(thread.id, thread_config)
+        # 已折叠进摘要的消息不再重复发送
+        channel_messages = thread_summarizer.recent(history, summary)
+
+        # 生成响应；有新消息时本任务会被取消
+        async with thread.typing():
+            response_data = await generate_completion_response(
+                messages=channel_messages,
+                user=message.author,
+                thread_config=thread_config,
+                stream=StreamingReply(thread) if STREAM_COMPLETIONS else None,
+                guild_id=thread.guild.id,
+                summary=summary.to_message() if summary else None,
+            )
+
+        if any(i > pending[-1][0] for i in pending_messages.get(thread.id, {})):
+            # 生成期间又有新消息，下一次回复会覆盖它，因此忽略此响应
+            if response_data.stream:
+                await response_data.stream.retract()
+            return
+
+        # 发送响应，发送过程不会被新消息打断
+        await asyncio.shield(
+            process_response(
+                user=message.author, thread=thread, response_data=response_data
+            )
+        )
+        clear_pending_messages(thread.id, pending[-1][0])
+        # 回复发送后在后台折叠较早的消息
+        thread_summarizer.maybe_summarize(
+            thread_id=thread.id,
+            guild_id=thread.guild.id,
+            model=thread_config.model,
+            history=history,
+            summary=summary,
+        )
+    except Exception as e:
+        logger.exception(e)
+
 # 每个消息的调用
 @client.event
 async def on_message(message: DiscordMessage):
     try:
+        # 更新对话缓存（包括机器人自己发送的回复）
+        conversation_cache.add(message)
+        if message.guild is not None:
+            GATEWAY_MESSAGES.inc(shard=message.guild.shard_id)
+
         # 阻止不在允许列表中的服务器
         if should_block(guild=message.guild):
             return
@@ -217,98 +511,57 @@ async def on_message(message: DiscordMessage):
             # 忽略此线程
             return
 
-        if thread.message_count > MAX_THREAD_MESSAGES:
-            # 消息太多，不再回复
+        if not ENABLE_THREAD_SUMMARIES and thread.message_count > MAX_THREAD_MESSAGES:
+            # 消息太多，不再回复（启用滚动摘要时线程可以无限继续）
             await close_thread(thread=thread)
             return
 
-        # 进行消息的审查
-        flagged_str, blocked_str = moderate_message(
-            message=message.content, user=message.author
-        )
-        await send_moderation_blocked_message(
-            guild=message.guild,
-            user=message.author,
-            blocked_str=blocked_str,
-            message=message.content,
-        )
-        if len(blocked_str) > 0:
-            try:
-                await message.delete()
-                await thread.send(
-                    embed=discord.Embed(
-                        description=f"❌ **{message.author}'s message has been deleted by moderation.**",
-                        color=discord.Color.red(),
-                    )
-                )
-                return
-            except Exception as e:
-                await thread.send(
-                    embed=discord.Embed(
-                        description=f"❌ **{message.author}'s message has been blocked by moderation but could not be deleted. Missing Manage Messages permission in this Channel.**",
-                        color=discord.Color.red(),
-                    )
-                )
-                return
-        await send_moderation_flagged_message(
-            guild=message.guild,
-            user=message.author,
-            flagged_str=flagged_str,
-            message=message.content,
-            url=message.jump_url,
-        )
-        if len(flagged_str) > 0:
-            await thread.send(
-                embed=discord.Embed(
-                    description=f"⚠️ **{message.author}'s message has been flagged by moderation.**",
-                    color=discord.Color.yellow(),
-                )
-            )
-
-        # 等待一段时间以确保用户没有更多消息
-        if SECONDS_DELAY_RECEIVING_MSG > 0:
-            await asyncio.sleep(SECONDS_DELAY_RECEIVING_MSG)
-            if is_last_message_stale(
-                interaction_message=message,
-                last_message=thread.last_message,
-                bot_id=client.user.id,
-            ):
-                # 还有另一条消息，因此忽略此消息
-                return
-
-        logger.info(
-            f"Thread message to process - {message.author}: {message.content[:50]} - {thread.name} {thread.jump_url}"
+        # 审查与等待线程安静、读取历史并行进行，回复在发送前等待审查结果。
+        # 审查不在可被取消的回复任务中进行，连续发送消息无法跳过审查
+        moderation = asyncio.create_task(
+            moderate_incoming_message(message=message, thread=thread)
         )
+        pending_messages.setdefault(thread.id, {})[message.id] = (message, moderation)
+        # 线程安静下来后只生成一次回复，同时取消该线程正在进行的生成
+        thread_debouncer.schedule(thread.id, lambda: respond_to_thread(thread=thread))
+        await moderation
+    except Exception as e:
+        logger.exception(e)
 
-        channel_messages = [
-            discord_message_to_message(message)
-            async for message in thread.history(limit=MAX_THREAD_MESSAGES)
-        ]
-        channel_messages = [x for x in channel_messages if x is not None]
-        channel_messages.reverse()
+# 消息被编辑时更新对话缓存
+@client.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    conversation_cache.edit(
+        channel_id=payload.channel_id,
+        message_id=payload.message_id,
+        content=payload.data.get("content"),
+    )
 
-        # 生成响应
-        async with thread.typing():
-            response_data = await generate_completion_response(
-                messages=channel_messages,
-                user=message.author,
-                thread_config=thread_data[thread.id],
-            )
+# 消息被删除时更新对话缓存
+@client.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    conversation_cache.delete(
+        channel_id=payload.channel_id, message_ids=[payload.message_id]
+    )
 
-        if is_last_message_stale(
-            interaction_message=message,
-            last_message=thread.last_message,
-            bot_id=client.user.id,
-        ):
-            # 还有另一条消息且不是我们发送的，因此忽略此响应
-            return
+@client.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    conversation_cache.delete(
+        channel_id=payload.channel_id, message_ids=payload.message_ids
+    )
 
-        # 发送响应
-        await process_response(
-            user=message.author, thread=thread, response_data=response_data
-        )
-    except Exception as e:
-        logger.exception(e)
+# 线程被锁定时删除配置，归档时记录归档时间
+@client.event
+async def on_thread_update(before: discord.Thread, after: discord.Thread):
+    if after.owner_id != client.user.id:
+        return
+    if after.locked:
+        thread_store.expire(after.id)
+        conversation_cache.invalidate(after.id)
+        pending_messages.pop(after.id, None)
+    elif after.archived != before.archived:
+        thread_store.mark_archived(after.id, after.archived)
 
 # 运行客户端
-client.run(DISCORD_BOT_TOKEN)
+if __name__ == "__main__":
+    client.run(DISCORD_BOT_TOKEN)
@@ -0,0 +1,256 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+OVERFLOW_LABEL = "other"  # 标签组合超过上限后归入的标签值
+
+LabelValues = Tuple[str, ...]
+
+# 指标的公共部分：名称、说明、标签，以及标签组合数的上限
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (), max_series: int = 10000
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+
+    # 将标签转换为元组键，超过上限的新组合统一归入 "other"
+    def _key(self, series: Dict[LabelValues, object], labels: Dict[str, object]) -> LabelValues:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        if key not in series and len(series) >= self.max_series:
+            key = tuple(OVERFLOW_LABEL for _ in self.labelnames)
+        return key
+
+    def _labels(self, key: LabelValues, extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+    # 各个序列的样本行
+    @abstractmethod
+    def samples(self) -> List[str]:
+        ...
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self.samples()
+
+
+# 只增不减的计数器
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(self._values, labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self._labels(k)} {_number(v)}" for k, v in self._values.items()]
+
+
+# 分桶直方图，记录每个标签组合的分布、总和与次数
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List[float]] = {}  # 各桶计数 + [总和, 次数]
+
+    def observe(self, value: float, **labels):
+        key = self._key(self._series, labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    # 计时上下文，退出时记录耗时
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, series in self._series.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{self._labels(key, [('le', _number(bound))])} {_number(cumulative)}"
+                )
+            lines.append(
+                f"{self.name}_bucket{self._labels(key, [('le', '+Inf')])} {_number(series[-1])}"
+            )
+            lines.append(f"{self.name}_sum{self._labels(key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{self._labels(key)} {_number(series[-1])}")
+        return lines
+
+
+# 抓取时才读取数值的指标，用于导出其他模块已有的计数和状态
+class CallbackMetric(Metric):
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        callback: Callable[[], Union[float, Dict[LabelValues, float]]],
+        type: str = "gauge",
+        labelnames: Sequence[str] = (),
+    ):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self.callback = callback
+
+    def samples(self) -> List[str]:
+        value = self.callback()
+        if not isinstance(value, dict):
+            return [f"{self.name} {_number(value)}"]
+        return [f"{self.name}{self._labels(k)} {_number(v)}" for k, v in value.items()]
+
+
+# 指标注册表，按 Prometheus 文本格式导出
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets=buckets))
+
+    def gauge(self, name: str, help: str, callback: Callable, labelnames: Sequence[str] = ()):
+        return self.register(CallbackMetric(name, help, callback, "gauge", labelnames))
+
+    def counter_func(self, name: str, help: str, callback: Callable, labelnames: Sequence[str] = ()):
+        return self.register(CallbackMetric(name, help, callback, "counter", labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 本地 HTTP 指标端点，GET /metrics 返回全部指标
+class MetricsServer:
+    def __init__(self, registry: MetricsRegistry, host: str, port: int):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # 读完请求头
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1")
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+registry = MetricsRegistry()
+
+# 热路径上的计时和计数
+HISTORY_FETCH_SECONDS = registry.histogram(
+    "gptbot_history_fetch_seconds",
+    "Time to get a thread's conversation history",
+    ["source"],
+)
+MODERATION_SECONDS = registry.histogram(
+    "gptbot_moderation_seconds", "Time spent in moderate_message", ["source"]
+)
+COMPLETION_SECONDS = registry.histogram(
+    "gptbot_completion_seconds",
+    "Time spent in generate_completion_response",
+    ["guild", "model", "result"],
+)
+COMPLETION_QUEUE_SECONDS = registry.histogram(
+    "gptbot_completion_queue_seconds",
+    "Time completions waited for the token budget and a scheduler slot",
+    ["model"],
+)
+TIME_TO_FIRST_TOKEN_SECONDS = registry.histogram(
+    "gptbot_time_to_first_token_seconds",
+    "Time from request to the first streamed reply message",
+)
+DISCORD_SEND_SECONDS = registry.histogram(
+    "gptbot_discord_send_seconds", "Time spent in process_response", ["result"]
+)
+CLOSE_THREAD_SECONDS = registry.histogram(
+    "gptbot_close_thread_seconds", "Time spent closing a thread"
+)
+COMPLETION_TOKENS = registry.counter(
+    "gptbot_completion_tokens_total",
+    "Tokens used by completions",
+    ["guild", "model", "kind"],
+)
@@ -1,30 +1,256 @@
 # 导入所需模块和库
-from typing import Optional, Tuple
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple, Union
 import discord
-from openai import OpenAI
 from src.constants import (
     SERVER_TO_MODERATION_CHANNEL,
     MODERATION_VALUES_FOR_BLOCKED,
     MODERATION_VALUES_FOR_FLAGGED,
+    MODERATION_MODEL,
+    MODERATION_BATCH_WINDOW_SECONDS,
+    MODERATION_MAX_BATCH_SIZE,
+    MODERATION_CACHE_MAX_ENTRIES,
+    MODERATION_CACHE_TTL_SECONDS,
+    MODERATION_CACHE_PATH,
+    MODERATION_CACHE_FLUSH_SECONDS,
+    MODERATION_CHANNEL_CACHE_SECONDS,
+    MODERATION_CHANNEL_MISSING_SECONDS,
+    MODERATION_LOG_BATCH_SECONDS,
+    DISCORD_MAX_MESSAGE_CHARS,
 )
+from src.cache import TTLCache
+from src.transport import shared_transport
+from src.metrics import MODERATION_SECONDS, registry
 from src.utils import logger
-from openai._compat import model_dump
+from src.premoderation import pre_moderation
 
-# 创建OpenAI客户端
-client = OpenAI()
+# 审查批处理器：在很短的时间窗口内收集所有线程的待审查输入，
+# 合并为一次moderations.create调用，再把各自的分类分数分发给调用者
+class ModerationBatcher:
+    def __init__(self, window: float, max_batch_size: int):
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.api_calls = 0  # 实际发出的API调用数
+        self.inputs = 0  # 提交的输入总数
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
 
+    async def submit(self, text: str) -> Dict[str, float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.inputs += 1
+        if len(self._pending) >= self.max_batch_size:
+            # 批次已满，立即发送
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
 
-def moderate_message(
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    # 一次 API 调用审查多条文本，返回每条文本的分类分数
+    async def _create(self, inputs: List[str]) -> Dict[str, Dict[str, float]]:
+        from openai._compat import model_dump
+
+        self.api_calls += 1
+        moderation_client = shared_transport.moderation_client
+        moderation_response = await moderation_client.moderations.create(
+            input=inputs, model=MODERATION_MODEL
+        )
+        scores = {}
+        for text, result in zip(inputs, moderation_response.results):
+            # 转换分类分数为字典格式
+            category_scores = result.category_scores
+            scores[text] = model_dump(category_scores) if category_scores else {}
+        return scores
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        # 相同的文本在同一批次中只审查一次
+        inputs = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            scores: Dict[str, Union[Dict[str, float], BaseException]] = await self._create(inputs)
+        except Exception as e:
+            if len(inputs) == 1:
+                scores = {inputs[0]: e}
+            else:
+                # 整批失败时逐条重试，只有仍然失败的调用者收到异常
+                logger.warning(f"Moderation batch of {len(inputs)} failed, retrying one by one: {e!r}")
+                results = await asyncio.gather(
+                    *(self._create([text]) for text in inputs), return_exceptions=True
+                )
+                scores = {
+                    text: result if isinstance(result, BaseException) else result[text]
+                    for text, result in zip(inputs, results)
+                }
+        for text, future in batch:
+            if future.done():
+                continue
+            result = scores[text]
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+moderation_batcher = ModerationBatcher(
+    window=MODERATION_BATCH_WINDOW_SECONDS, max_batch_size=MODERATION_MAX_BATCH_SIZE
+)
+
+
+# 审查结果缓存：以规范化文本的哈希和审查模型名为键，保存原始分类分数。
+# 保存分数而不是结论，修改阈值后缓存条目依然按新阈值判断。
+# 设置了路径时，磁盘读取在工作线程中进行，写入先进入内存，由后台任务批量写入磁盘，
+# 多个进程共用一个文件时锁等待也不会阻塞事件循环
+class ModerationCache:
+    def __init__(
+        self, maxsize: int, ttl: float, path: Optional[str] = None, flush_interval: float = 1.0
+    ):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.hits = 0  # 命中次数（内存或磁盘）
+        self.misses = 0  # 未命中次数
+        self._memory: TTLCache[Dict[str, float]] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._pending: Dict[str, Tuple[str, float]] = {}  # 等待写入磁盘的条目
+        self._lock = threading.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS moderation_cache "
+                "(key TEXT PRIMARY KEY, scores TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    async def start(self):
+        if self._db is not None and self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._run_flusher())
+            await asyncio.to_thread(self._prune)
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    # 规范化文本后计算缓存键；保留大小写，因为大小写会影响审查分数
+    @staticmethod
+    def key(text: str) -> str:
+        normalized = " ".join(unicodedata.normalize("NFKC", text).split())
+        digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        return f"{MODERATION_MODEL}:{digest}"
+
+    async def get(self, text: str) -> Optional[Dict[str, float]]:
+        key = self.key(text)
+        scores = self._memory.get(key)
+        if scores is None and self._db is not None:
+            row = self._pending.get(key) or await asyncio.to_thread(self._load, key)
+            if row is not None:
+                remaining = row[1] + self.ttl - time.time()
+                if remaining > 0:
+                    scores = json.loads(row[0])
+                    self._memory.set(key, scores, ttl=remaining)
+        if scores is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return scores
+
+    # 保存分类分数，不等待写入磁盘
+    def set(self, text: str, scores: Dict[str, float]):
+        key = self.key(text)
+        self._memory.set(key, scores)
+        if self._db is not None:
+            self._pending[key] = (json.dumps(scores), time.time())
+
+    # 将积累的写入批量写入磁盘
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if pending:
+            await asyncio.to_thread(self._write, pending)
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(e)
+
+    def _load(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT scores, created_at FROM moderation_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+    def _write(self, pending: Dict[str, Tuple[str, float]]):
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO moderation_cache (key, scores, created_at) "
+                    "VALUES (?, ?, ?)",
+                    [(key, scores, created_at) for key, (scores, created_at) in pending.items()],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    # 删除磁盘上的过期条目
+    def _prune(self):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM moderation_cache WHERE created_at < ?",
+                (time.time() - self.ttl,),
+            )
+
+
+moderation_cache = ModerationCache(
+    maxsize=MODERATION_CACHE_MAX_ENTRIES,
+    ttl=MODERATION_CACHE_TTL_SECONDS,
+    path=MODERATION_CACHE_PATH,
+    flush_interval=MODERATION_CACHE_FLUSH_SECONDS,
+)
+
+
+async def moderate_message(
     message: str, user: str
 ) -> Tuple[str, str]:  # [flagged_str, blocked_str]
-    # 调用OpenAI的moderations.create方法进行内容审查
-    moderation_response = client.moderations.create(
-        input=message, model="text-moderation-latest"
-    )
-    # 提取审查结果中的分类分数
-    category_scores = moderation_response.results[0].category_scores or {}
-    # 转换分类分数为字典格式
-    category_score_items = model_dump(category_scores)
+    started = time.perf_counter()
+    # 本地预审查有把握时（屏蔽列表或安全的简短消息）不调用审查 API
+    premoderated = pre_moderation.check(message)
+    if premoderated is not None:
+        MODERATION_SECONDS.observe(time.perf_counter() - started, source="local")
+        if premoderated[1]:
+            logger.info(f"blocked {user} {premoderated[1]}")
+        return premoderated
+
+    # 优先使用缓存的分类分数，未命中时通过批处理器进行内容审查
+    category_score_items = await moderation_cache.get(message)
+    if category_score_items is None:
+        category_score_items = await moderation_batcher.submit(message)
+        moderation_cache.set(message, category_score_items)
+        MODERATION_SECONDS.observe(time.perf_counter() - started, source="api")
+    else:
+        MODERATION_SECONDS.observe(time.perf_counter() - started, source="cache")
 
     # 初始化违规内容和被屏蔽内容的字符串
     blocked_str = ""
@@ -48,6 +274,15 @@ def moderate_message(
     return (flagged_str, blocked_str)
 
 
+# 已解析的审查频道，以及找不到或无权访问的审查频道（在一段时间内不再请求）
+_resolved_channels: TTLCache[discord.abc.GuildChannel] = TTLCache(
+    maxsize=1000, ttl=MODERATION_CHANNEL_CACHE_SECONDS
+)
+_missing_channels: TTLCache[bool] = TTLCache(
+    maxsize=1000, ttl=MODERATION_CHANNEL_MISSING_SECONDS
+)
+
+
 async def fetch_moderation_channel(
     guild: Optional[discord.Guild],
 ) -> Optional[discord.abc.GuildChannel]:
@@ -56,11 +291,87 @@ async def fetch_moderation_channel(
         return None
     # 获取服务器对应的审查频道
     moderation_channel = SERVER_TO_MODERATION_CHANNEL.get(guild.id, None)
-    # 若存在审查频道，则获取该频道对象并返回
-    if moderation_channel:
-        channel = await guild.fetch_channel(moderation_channel)
+    if not moderation_channel:
+        return None
+    # 优先使用网关缓存中的频道，其次是之前请求到的频道
+    channel = guild.get_channel(moderation_channel) or _resolved_channels.get(
+        moderation_channel
+    )
+    if channel is not None:
         return channel
-    return None
+    if _missing_channels.get(moderation_channel):
+        return None
+    # 都没有时才通过 REST 请求获取
+    try:
+        channel = await guild.fetch_channel(moderation_channel)
+    except (discord.NotFound, discord.Forbidden) as e:
+        logger.info(f"Moderation channel {moderation_channel} unavailable: {e}")
+        _missing_channels.set(moderation_channel, True)
+        return None
+    _resolved_channels.set(moderation_channel, channel)
+    return channel
+
+
+# 审查日志队列：合并一段时间内同一服务器的标记和拦截通知，
+# 在后台批量发送到审查频道，不阻塞回复
+class ModerationLog:
+    def __init__(self, window: float):
+        self.window = window
+        self._pending: Dict[int, Tuple[discord.Guild, List[str]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def post(self, guild: discord.Guild, line: str):
+        pending = self._pending.get(guild.id)
+        if pending is not None:
+            pending[1].append(line)
+            return
+        self._pending[guild.id] = (guild, [line])
+        task = asyncio.get_running_loop().create_task(self._flush_later(guild.id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_later(self, guild_id: int):
+        await asyncio.sleep(self.window)
+        guild, lines = self._pending.pop(guild_id)
+        try:
+            moderation_channel = await fetch_moderation_channel(guild=guild)
+            if moderation_channel:
+                for content in _pack_lines(lines):
+                    await moderation_channel.send(content)
+        except Exception as e:
+            logger.exception(e)
+
+
+# 将多行通知合并为尽量少的、不超过 Discord 长度限制的消息
+def _pack_lines(lines: List[str]) -> List[str]:
+    packed: List[str] = []
+    for line in lines:
+        line = line[:DISCORD_MAX_MESSAGE_CHARS]
+        if packed and len(packed[-1]) + 1 + len(line) <= DISCORD_MAX_MESSAGE_CHARS:
+            packed[-1] += "\n" + line
+        else:
+            packed.append(line)
+    return packed
+
+
+moderation_log = ModerationLog(window=MODERATION_LOG_BATCH_SECONDS)
+
+registry.counter_func(
+    "gptbot_moderation_cache_lookups_total",
+    "Moderation cache lookups by result",
+    lambda: {("hit",): moderation_cache.hits, ("miss",): moderation_cache.misses},
+    ["result"],
+)
+registry.counter_func(
+    "gptbot_moderation_api_calls_total",
+    "Batched moderation API calls",
+    lambda: moderation_batcher.api_calls,
+)
+registry.counter_func(
+    "gptbot_moderation_inputs_total",
+    "Inputs submitted to the moderation batcher",
+    lambda: moderation_batcher.inputs,
+)
 
 
 async def send_moderation_flagged_message(
@@ -72,16 +383,10 @@ async def send_moderation_flagged_message(
 ):
     # 若提供了服务器、被标记内容和被标记消息
     if guild and flagged_str and len(flagged_str) > 0:
-        # 获取审查频道对象
-        moderation_channel = await fetch_moderation_channel(guild=guild)
-        # 若审查频道存在
-        if moderation_channel:
-            # 截取消息内容前100个字符（如果存在）
-            message = message[:100] if message else None
-            # 发送被标记消息到审查频道
-            await moderation_channel.send(
-                f"⚠️ {user} - {flagged_str} - {message} - {url}"
-            )
+        # 截取消息内容前100个字符（如果存在）
+        message = message[:100] if message else None
+        # 将被标记消息加入审查日志队列
+        moderation_log.post(guild, f"⚠️ {user} - {flagged_str} - {message} - {url}")
 
 
 async def send_moderation_blocked_message(
@@ -92,11 +397,7 @@ async def send_moderation_blocked_message(
 ):
     # 若提供了服务器、被屏蔽内容和被屏蔽消息
     if guild and blocked_str and len(blocked_str) > 0:
-        # 获取审查频道对象
-        moderation_channel = await fetch_moderation_channel(guild=guild)
-        # 若审查频道存在
-        if moderation_channel:
-            # 截取消息内容前500个字符（如果存在）
-            message = message[:500] if message else None
-            # 发送被屏蔽消息到审查频道
-            await moderation_channel.send(f"❌ {user} - {blocked_str} - {message}")
+        # 截取消息内容前500个字符（如果存在）
+        message = message[:500] if message else None
+        # 将被屏蔽消息加入审查日志队列
+        moderation_log.post(guild, f"❌ {user} - {blocked_str} - {message}")
@@ -0,0 +1,282 @@
+import asyncio
+import io
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+import discord
+
+from src.cache import TTLCache
+from src.constants import (
+    DISCORD_CHANNEL_SEND_WINDOW_SECONDS,
+    DISCORD_CHANNEL_SENDS_PER_WINDOW,
+    DISCORD_MAX_EMBEDS_PER_MESSAGE,
+    DISCORD_MAX_MESSAGE_CHARS,
+    REPLY_ATTACHMENT_MIN_CHARS,
+)
+from src.metrics import registry
+
+FENCE = "```"
+MAX_FENCE_LINE_CHARS = 32  # 续写代码块时重复的开始行（含语言名）的最大长度
+REPLY_ATTACHMENT_NAME = "reply.md"
+
+
+# 代码块开始行，拆分到下一条消息时原样重复，使语法高亮保持一致
+def _fence_line(line: str) -> str:
+    stripped = line.lstrip()
+    if not stripped.startswith(FENCE):
+        return FENCE
+    return stripped.split(None, 1)[0][:MAX_FENCE_LINE_CHARS]
+
+
+# 把超长的一行拆成不超过 width 的多段，尽量在空白处断开
+def _wrap(line: str, width: int) -> List[str]:
+    pieces = []
+    while len(line) > width:
+        cut = line.rfind(" ", width // 2, width + 1)
+        if cut == -1:
+            pieces.append(line[:width])
+            line = line[width:]
+        else:
+            pieces.append(line[:cut])
+            line = line[cut + 1 :]
+    pieces.append(line)
+    return pieces
+
+
+# 将回复拆分为不超过 limit 的消息。按行装满每条消息，优先在最后四分之一的空行或代码块结束处断开；
+# 必须在代码块中间断开时，在本条末尾关闭代码块并在下一条开头重新打开。
+# 结果只取决于文本前缀，流式回复变长时已经装满的消息不会再变化
+def split_message(text: str, limit: int = DISCORD_MAX_MESSAGE_CHARS) -> List[str]:
+    width = limit - 2 * (MAX_FENCE_LINE_CHARS + 1)
+    closing = len(FENCE) + 1
+    chunks: List[str] = []
+    lines: List[Tuple[str, Optional[str]]] = []  # 当前消息的行，以及该行之后仍未关闭的代码块
+    size = 0  # 当前消息的长度，每行多算一个换行符
+    fence: Optional[str] = None
+
+    # 在空行或代码块结束行之后断开，位置不在最后四分之一时装满整条消息
+    def break_point() -> int:
+        length = size
+        for i in range(len(lines) - 1, 0, -1):
+            length -= len(lines[i][0]) + 1
+            if length < limit * 3 // 4:
+                break
+            line, open_fence = lines[i - 1]
+            if open_fence is None and (not line.strip() or line.lstrip().startswith(FENCE)):
+                return i
+        return len(lines)
+
+    def cut(count: int):
+        nonlocal lines, size
+        head, lines = lines[:count], lines[count:]
+        body = "\n".join(line for line, _ in head).strip("\n")
+        open_fence = head[-1][1]
+        if open_fence is not None:
+            body += "\n" + FENCE
+            lines.insert(0, (open_fence, open_fence))
+        if body.strip():
+            chunks.append(body)
+        size = sum(len(line) + 1 for line, _ in lines)
+
+    for raw in text.split("\n"):
+        for line in _wrap(raw, width):
+            if line.count(FENCE) % 2 == 1:
+                fence = _fence_line(line) if fence is None else None
+            while lines and size + len(line) + (closing if fence else 0) > limit:
+                cut(break_point())
+            lines.append((line, fence))
+            size += len(line) + 1
+    if lines:
+        cut(len(lines))
+    return chunks
+
+
+# 每个频道的发送令牌桶，与 Discord 的频道速率限制一致
+class SendBucket:
+    def __init__(self, sends: int, window: float):
+        self.capacity = sends
+        self.rate = sends / window  # 每秒补充的发送次数
+        self.tokens = float(sends)
+        self._updated = time.monotonic()
+
+    # 占用一次发送，返回需要等待的时间
+    def acquire(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        wait = max(0.0, 1 - self.tokens) / self.rate
+        self.tokens -= 1
+        return wait
+
+
+# 排队等待发送的消息，合并后对应多个调用者
+@dataclass
+class Outgoing:
+    content: str
+    embeds: List[discord.Embed]
+    file: Optional[discord.File]
+    futures: List[asyncio.Future]
+    exclusive: bool = False  # 发送后会被调用者编辑或删除，不与其他消息合并
+
+    # 调用者是否都已取消
+    @property
+    def abandoned(self) -> bool:
+        return all(future.done() for future in self.futures)
+
+    # 能否与后一条合并为一条消息
+    def fits(self, other: "Outgoing") -> bool:
+        separator = 1 if self.content and other.content else 0
+        return (
+            not self.exclusive
+            and not other.exclusive
+            and len(self.content) + separator + len(other.content) <= DISCORD_MAX_MESSAGE_CHARS
+            and len(self.embeds) + len(other.embeds) <= DISCORD_MAX_EMBEDS_PER_MESSAGE
+            and (self.file is None or other.file is None)
+        )
+
+    def merge(self, other: "Outgoing"):
+        self.content = "\n".join(c for c in (self.content, other.content) if c)
+        self.embeds += other.embeds
+        self.file = self.file or other.file
+        self.futures += other.futures
+
+
+# 发往 Discord 的消息队列：每个频道一个后台任务按顺序发送，
+# 按频道的速率限制等待，等待期间排队的相邻消息（内容、通知嵌入、附件）合并为一次发送
+class Outbound:
+    def __init__(self, sends_per_window: int, window_seconds: float):
+        self.sends_per_window = sends_per_window
+        self.window_seconds = window_seconds
+        self.sends = 0  # 实际发送的消息数
+        self.coalesced = 0  # 合并进其他消息、省去的发送数
+        self.throttled = 0  # 因频道速率限制等待的发送数
+        self._queues: Dict[int, Deque[Outgoing]] = {}
+        # 空闲超过一个窗口的频道令牌桶已经补满，可以丢弃
+        self._buckets: TTLCache[SendBucket] = TTLCache(maxsize=10000, ttl=window_seconds)
+        self._tasks: Set[asyncio.Task] = set()
+
+    # 排队中的消息数
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _enqueue(
+        self,
+        channel: discord.abc.Messageable,
+        content: str,
+        embeds: Sequence[discord.Embed],
+        file: Optional[discord.File],
+        exclusive: bool = False,
+    ) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self._queues.get(channel.id)
+        if queue is None:
+            queue = self._queues[channel.id] = deque()
+            task = loop.create_task(self._drain(channel, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append(Outgoing(content, list(embeds), file, [future], exclusive))
+        return future
+
+    # 发送一条消息，返回包含它的 Discord 消息（可能与同一频道的其他消息合并）。
+    # 之后要编辑或删除返回的消息时设置 exclusive，避免改动合并进来的其他调用者的内容
+    async def send(
+        self,
+        channel: discord.abc.Messageable,
+        content: str = "",
+        embeds: Sequence[discord.Embed] = (),
+        file: Optional[discord.File] = None,
+        exclusive: bool = False,
+    ) -> discord.Message:
+        return await self._enqueue(channel, content, embeds, file, exclusive)
+
+    # 发送一条回复，按 Markdown 边界拆分，通知嵌入附在最后一条消息上；
+    # 很长的回复只发送开头部分，完整内容作为文件附件
+    async def send_reply(
+        self,
+        channel: discord.abc.Messageable,
+        text: str,
+        embeds: Sequence[discord.Embed] = (),
+    ) -> List[discord.Message]:
+        if REPLY_ATTACHMENT_MIN_CHARS and len(text) >= REPLY_ATTACHMENT_MIN_CHARS:
+            note = f"\n\n*Full reply ({len(text)} characters) attached.*"
+            preview = split_message(text, DISCORD_MAX_MESSAGE_CHARS - len(note))[0]
+            file = discord.File(io.BytesIO(text.encode("utf-8")), filename=REPLY_ATTACHMENT_NAME)
+            futures = [self._enqueue(channel, preview + note, embeds, file)]
+        else:
+            chunks = split_message(text) or [""]
+            futures = [self._enqueue(channel, chunk, (), None) for chunk in chunks[:-1]]
+            futures.append(self._enqueue(channel, chunks[-1], embeds, None))
+        sent = await asyncio.gather(*futures)
+        # 合并发送的部分对应同一条消息
+        return list({message.id: message for message in sent}.values())
+
+    async def _drain(self, channel: discord.abc.Messageable, queue: Deque[Outgoing]):
+        try:
+            while queue:
+                if queue[0].abandoned:
+                    queue.popleft()
+                    continue
+                bucket = self._buckets.get(channel.id)
+                if bucket is None:
+                    bucket = SendBucket(self.sends_per_window, self.window_seconds)
+                self._buckets.set(channel.id, bucket)
+                wait = bucket.acquire()
+                if wait > 0:
+                    self.throttled += 1
+                await asyncio.sleep(wait)
+                item = queue.popleft()
+                while queue and (queue[0].abandoned or item.fits(queue[0])):
+                    other = queue.popleft()
+                    if not other.abandoned:
+                        item.merge(other)
+                        self.coalesced += 1
+                if item.abandoned:
+                    continue
+                try:
+                    message = await channel.send(
+                        content=item.content or None,
+                        embeds=item.embeds or None,
+                        file=item.file,
+                    )
+                except Exception as e:
+                    for future in item.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.sends += 1
+                for future in item.futures:
+                    if not future.done():
+                        future.set_result(message)
+        finally:
+            del self._queues[channel.id]
+
+
+outbound = Outbound(
+    sends_per_window=DISCORD_CHANNEL_SENDS_PER_WINDOW,
+    window_seconds=DISCORD_CHANNEL_SEND_WINDOW_SECONDS,
+)
+
+registry.counter_func(
+    "gptbot_discord_sends_total",
+    "Messages sent to Discord by the outbound queue",
+    lambda: outbound.sends,
+)
+registry.counter_func(
+    "gptbot_discord_sends_coalesced_total",
+    "Queued sends merged into another message",
+    lambda: outbound.coalesced,
+)
+registry.counter_func(
+    "gptbot_discord_sends_throttled_total",
+    "Sends delayed by the per-channel rate limit",
+    lambda: outbound.throttled,
+)
+registry.gauge(
+    "gptbot_discord_send_queue_depth",
+    "Messages waiting in the outbound queue",
+    lambda: outbound.queue_depth,
+)
@@ -0,0 +1,164 @@
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.constants import (
+    MODERATION_BLOCKLIST_PATH,
+    MODERATION_SAFE_MESSAGES,
+    MODERATION_SAFE_MESSAGES_PATH,
+    MODERATION_SAFE_MESSAGE_MAX_CHARS,
+)
+from src.metrics import registry
+from src.utils import logger
+
+# 放行前从简短消息结尾去掉的字符
+TRAILING_PUNCTUATION = " .!?~,;:"
+
+
+# 规范化文本：兼容字符归一、忽略大小写、合并空白
+def normalize(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+# 英文单词字符；屏蔽词两端是单词字符时要求匹配位置是单词边界，
+# 避免 "ass" 命中 "class"，中日文等没有空格的文字不受影响
+def _is_word(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+# Aho-Corasick 多模式匹配器：构建时把所有模式编译成带失败指针的字典树，
+# 匹配时每个字符只前进一次，耗时与文本长度成线性，与模式数量无关
+class PatternMatcher:
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]  # 在该状态结束的模式（包括失败链上的）
+        for pattern in dict.fromkeys(normalize(p) for p in patterns):
+            if pattern:
+                self._add(pattern)
+        self._link()
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def _add(self, pattern: str):
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = next_state
+        self._out[state] += (len(self.patterns),)
+        self.patterns.append(pattern)
+
+    # 按广度优先计算失败指针，并把失败状态的输出合并进来
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] += self._out[self._fail[child]]
+
+    # 返回第一个在单词边界上匹配的模式，没有时返回 None；text 需要先规范化
+    def search(self, text: str) -> Optional[str]:
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for end, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for index in out[state]:
+                pattern = self.patterns[index]
+                start = end - len(pattern) + 1
+                if (
+                    start > 0
+                    and _is_word(pattern[0])
+                    and _is_word(text[start - 1])
+                ):
+                    continue
+                if (
+                    end + 1 < len(text)
+                    and _is_word(pattern[-1])
+                    and _is_word(text[end + 1])
+                ):
+                    continue
+                return pattern
+        return None
+
+
+# 读取每行一条的列表文件，忽略空行和 # 开头的注释
+def read_list(path: Optional[str]) -> List[str]:
+    if not path:
+        return []
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+# 本地预审查：在调用审查 API 之前处理有把握的情况。
+# 命中屏蔽列表时直接屏蔽，是允许列表中的简短消息时直接放行，其他情况返回 None 交给 API
+class PreModeration:
+    def __init__(
+        self,
+        blocklist: Iterable[str],
+        safe_messages: Iterable[str],
+        max_safe_chars: int,
+    ):
+        self.blocklist = PatternMatcher(blocklist)
+        self.safe_messages = frozenset(
+            normalize(m).rstrip(TRAILING_PUNCTUATION) for m in safe_messages
+        )
+        self.max_safe_chars = max_safe_chars
+        self.blocked = 0  # 本地屏蔽的消息数
+        self.allowed = 0  # 本地放行的消息数
+        self.passed = 0  # 交给审查 API 的消息数
+
+    # 返回与 moderate_message 相同的 (flagged_str, blocked_str)，没有把握时返回 None
+    def check(self, text: str) -> Optional[Tuple[str, str]]:
+        normalized = normalize(text)
+        if not normalized:
+            self.allowed += 1
+            return ("", "")
+        if len(self.blocklist) > 0:
+            pattern = self.blocklist.search(normalized)
+            if pattern is not None:
+                self.blocked += 1
+                return ("", f"(blocklist: {pattern})")
+        if (
+            len(normalized) <= self.max_safe_chars
+            and normalized.rstrip(TRAILING_PUNCTUATION) in self.safe_messages
+        ):
+            self.allowed += 1
+            return ("", "")
+        self.passed += 1
+        return None
+
+
+pre_moderation = PreModeration(
+    blocklist=read_list(MODERATION_BLOCKLIST_PATH),
+    safe_messages=MODERATION_SAFE_MESSAGES + read_list(MODERATION_SAFE_MESSAGES_PATH),
+    max_safe_chars=MODERATION_SAFE_MESSAGE_MAX_CHARS,
+)
+if len(pre_moderation.blocklist) > 0:
+    logger.info(f"Compiled {len(pre_moderation.blocklist)} moderation blocklist patterns")
+
+registry.counter_func(
+    "gptbot_premoderation_total",
+    "Messages decided by local pre-moderation, by result",
+    lambda: {
+        ("blocked",): pre_moderation.blocked,
+        ("allowed",): pre_moderation.allowed,
+        ("passed",): pre_moderation.passed,
+    },
+    ["result"],
+)
@@ -0,0 +1,194 @@
+import asyncio
+import email.utils
+import random
+import re
+import time
+from typing import Awaitable, Callable, Dict, Mapping, Optional, TypeVar
+
+from src.utils import logger
+
+T = TypeVar("T")
+
+# 可以重试的 HTTP 状态码
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# 某个模型的熔断器处于打开状态且没有可用的备用模型时抛出
+class CircuitOpenError(Exception):
+    pass
+
+# 解析 "6m0s"、"1.5s"、"20ms" 格式的时长
+def _parse_duration(value: str) -> Optional[float]:
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+# 从速率限制相关的响应头中读取需要等待的时间
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            parsed = email.utils.parsedate_to_datetime(retry_after)
+            if parsed is not None:
+                return max(0.0, parsed.timestamp() - time.time())
+    resets = [
+        _parse_duration(headers[name])
+        for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        if headers.get(name)
+    ]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+# 是否是暂时性错误；openai 和 httpx 在第一次请求时才导入
+def is_retryable(e: Exception) -> bool:
+    import httpx
+    import openai
+
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(e, (openai.APIConnectionError, httpx.TransportError))
+
+# 熔断器：连续失败达到阈值后打开，一段时间后允许一次试探请求
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0  # 连续失败次数
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    # 是否允许发送请求
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self._probing or time.monotonic() - self.opened_at < self.reset_seconds:
+            return False
+        self._probing = True
+        return True
+
+    # 试探请求没有得到结果（例如被取消），允许下一次试探
+    def cancel_probe(self):
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probing:
+                logger.info(f"Circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+
+# 重试策略：暂时性错误按响应头或带抖动的指数退避在截止时间内重试，
+# 每个模型一个熔断器，主模型熔断时可切换到更便宜的备用模型
+class RetryPolicy:
+    def __init__(
+        self,
+        deadline_seconds: float,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        failure_threshold: int,
+        reset_seconds: float,
+        fallback_models: Dict[str, str],
+    ):
+        self.deadline_seconds = deadline_seconds
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.fallback_models = fallback_models
+        self.retries = 0  # 重试次数
+        self.fallbacks = 0  # 使用备用模型的次数
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+            self._breakers[model] = breaker
+        return breaker
+
+    # 选择本次请求使用的模型；备用模型还要能处理这次请求（例如上下文窗口足够大）
+    def _select_model(self, model: str, accepts: Callable[[str], bool]) -> str:
+        if self.breaker(model).allow():
+            return model
+        fallback = self.fallback_models.get(model)
+        if fallback and not accepts(fallback):
+            logger.info(f"Circuit open for {model}, fallback {fallback} cannot take this request")
+        elif fallback and self.breaker(fallback).allow():
+            self.fallbacks += 1
+            logger.info(f"Circuit open for {model}, falling back to {fallback}")
+            return fallback
+        raise CircuitOpenError(f"{model} is temporarily unavailable, try again later")
+
+    # 下一次重试前的等待时间
+    def _delay(self, e: Exception, attempt: int) -> float:
+        import openai
+
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if isinstance(e, openai.APIStatusError):
+            retry_after = retry_after_seconds(e.response.headers)
+            if retry_after is not None:
+                return retry_after + random.uniform(0, self.base_delay)
+        return backoff
+
+    # 调用 call(model)，暂时性错误时重试；accepts 判断备用模型能否处理这次请求
+    async def run(
+        self,
+        model: str,
+        call: Callable[[str], Awaitable[T]],
+        accepts: Callable[[str], bool] = lambda model: True,
+    ) -> T:
+        deadline = time.monotonic() + self.deadline_seconds
+        attempt = 0
+        while True:
+            selected = self._select_model(model, accepts)
+            breaker = self.breaker(selected)
+            try:
+                result = await call(selected)
+            except asyncio.CancelledError:
+                breaker.cancel_probe()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    import openai
+
+                    if isinstance(e, openai.APIStatusError):
+                        # 服务端正常响应了请求
+                        breaker.record_success()
+                    else:
+                        breaker.cancel_probe()
+                    raise
+                breaker.record_failure()
+                attempt += 1
+                delay = self._delay(e, attempt)
+                if attempt >= self.max_attempts or time.monotonic() + delay > deadline:
+                    raise
+                self.retries += 1
+                logger.info(f"Retrying {selected} in {delay:.2f}s after {e!r}")
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            return result
@@ -0,0 +1,75 @@
+from typing import Any, Callable, Dict, Iterable
+
+import discord
+
+from src.constants import ALLOWED_SERVER_IDS, LEAN_RUNTIME, MESSAGE_CACHE_SIZE
+from src.metrics import registry
+
+GATEWAY_EVENTS_DROPPED = registry.counter(
+    "gptbot_gateway_events_dropped_total",
+    "Gateway events from guilds outside the allowlist dropped before parsing",
+    ["event"],
+)
+
+# 以服务器自身 ID（而不是 guild_id 字段）标识服务器的事件
+GUILD_ID_EVENTS = ("GUILD_CREATE", "GUILD_UPDATE", "GUILD_DELETE")
+
+# 网关订阅的事件：精简模式只需要服务器（频道和线程）、服务器消息和消息内容
+def client_intents(lean: bool = LEAN_RUNTIME) -> discord.Intents:
+    if lean:
+        intents = discord.Intents.none()
+        intents.guilds = True
+        intents.guild_messages = True
+    else:
+        intents = discord.Intents.default()
+    intents.message_content = True
+    return intents
+
+# 创建客户端时的缓存参数：精简模式限制消息缓存，不缓存成员，启动时不拉取成员列表
+def client_cache_options(lean: bool = LEAN_RUNTIME) -> dict:
+    if not lean:
+        return {}
+    return {
+        "max_messages": MESSAGE_CACHE_SIZE or None,
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+    }
+
+# 包装解析函数：guild_id 不在允许列表中的事件在构造 discord.py 对象之前丢弃
+def _filter_guild(
+    event: str, parse: Callable[[Any], None], allowed: frozenset, key: str
+) -> Callable[[Any], None]:
+    def parse_allowed(data: Any):
+        guild_id = data.get(key) if isinstance(data, dict) else None
+        if guild_id is not None and guild_id not in allowed:
+            GATEWAY_EVENTS_DROPPED.inc(event=event)
+            return
+        parse(data)
+
+    return parse_allowed
+
+# READY 中列出了全部服务器，只保留允许的服务器，其他服务器不会被创建和缓存
+def _filter_ready(parse: Callable[[Any], None], allowed: frozenset) -> Callable[[Any], None]:
+    def parse_allowed(data: Any):
+        guilds = data.get("guilds") or []
+        kept = [g for g in guilds if g.get("id") in allowed]
+        if len(kept) < len(guilds):
+            GATEWAY_EVENTS_DROPPED.inc(len(guilds) - len(kept), event="READY")
+            data["guilds"] = kept
+        parse(data)
+
+    return parse_allowed
+
+# 在网关事件层过滤服务器。网关直接查找 ConnectionState.parsers，
+# 因此原地替换其中的函数，对之后建立的所有分片连接都生效
+def install_guild_filter(client: discord.Client, guild_ids: Iterable[int] = ALLOWED_SERVER_IDS):
+    # 网关数据中的雪花 ID 是字符串，比较前不需要转换
+    allowed = frozenset(str(guild_id) for guild_id in guild_ids)
+    parsers: Dict[str, Callable[[Any], None]] = client._connection.parsers
+    for event, parse in list(parsers.items()):
+        if event == "READY":
+            parsers[event] = _filter_ready(parse, allowed)
+        elif event in GUILD_ID_EVENTS:
+            parsers[event] = _filter_guild(event, parse, allowed, "id")
+        elif event != "RESUMED":
+            parsers[event] = _filter_guild(event, parse, allowed, "guild_id")
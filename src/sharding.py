@@ -0,0 +1,35 @@
+from typing import List, Optional
+
+from src.constants import AUTO_SHARD, SHARD_COUNT, SHARD_IDS
+
+# 是否使用分片客户端
+SHARDED = AUTO_SHARD or SHARD_COUNT is not None
+
+# Discord 按服务器 ID 分配分片的规则
+def shard_for_guild(guild_id: int, shard_count: Optional[int] = None) -> int:
+    shard_count = shard_count or SHARD_COUNT or 1
+    return (guild_id >> 22) % shard_count
+
+# 本进程是否负责该服务器
+def owns_guild(guild_id: int) -> bool:
+    if SHARD_IDS is None:
+        return True
+    return shard_for_guild(guild_id) in SHARD_IDS
+
+# 将分片按连续区间平均分给多个进程
+def split_shards(shard_count: int, processes: int) -> List[List[int]]:
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+# 创建客户端时的分片参数
+def client_shard_options() -> dict:
+    if not SHARDED or AUTO_SHARD:
+        return {}
+    return {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS}
@@ -0,0 +1,79 @@
+import dataclasses
+import hashlib
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+from src.base import Config, Conversation, Message
+
+# 启动缓存：按输入的哈希保存处理结果，输入不变时重启跳过解析、校验和同步。
+# 缓存目录只由机器人自己写入，删除目录即可强制重新生成
+
+# 读取缓存文件，不存在或损坏时返回 None
+def _read(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+# 原子地写入缓存文件；目录不可写时放弃，下次启动重新生成
+def _write(path: str, data: bytes):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+# 从快照中的纯数据重建 Config，只构造已知的数据类，不执行快照中的任何代码
+def _config_from_dict(data: Dict[str, Any]) -> Config:
+    return Config(
+        name=data["name"],
+        instructions=data["instructions"],
+        example_conversations=[
+            Conversation(messages=[Message(**message) for message in conversation["messages"]])
+            for conversation in data["example_conversations"]
+        ],
+    )
+
+# 加载 config.yaml。快照是 JSON 格式的已校验配置，以 YAML 内容和配置类定义的哈希为键，
+# 命中时直接重建 Config，不需要导入和运行 PyYAML 与 dacite
+def load_config(config_path: str, snapshot_path: str) -> Config:
+    with open(config_path, "rb") as f:
+        raw = f.read()
+    schema = _read(sys.modules[Config.__module__].__file__) or b""
+    digest = hashlib.sha256(raw + b"\0" + schema).hexdigest()
+    cached = _read(snapshot_path)
+    if cached is not None:
+        try:
+            snapshot = json.loads(cached)
+            if snapshot["digest"] == digest:
+                return _config_from_dict(snapshot["config"])
+        except Exception:
+            pass
+
+    import dacite
+    import yaml
+
+    config = dacite.from_dict(Config, yaml.safe_load(raw))
+    snapshot = {"digest": digest, "config": dataclasses.asdict(config)}
+    _write(snapshot_path, json.dumps(snapshot, ensure_ascii=False).encode())
+    return config
+
+# 斜线命令定义的哈希，包含应用 ID，换一个应用时会重新同步
+def commands_digest(application_id: Optional[int], payload: List[Any]) -> str:
+    return hashlib.sha256(
+        json.dumps([application_id, payload], sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+# 上次同步的命令定义是否与当前相同
+def commands_synced(marker_path: str, digest: str) -> bool:
+    return _read(marker_path) == digest.encode()
+
+# 记录已同步的命令定义
+def mark_commands_synced(marker_path: str, digest: str):
+    _write(marker_path, digest.encode())
@@ -0,0 +1,149 @@
+import asyncio
+from bisect import bisect_right
+from itertools import islice
+from typing import Dict, List, Optional, Set, Tuple
+
+from src import completion
+from src.base import Conversation, Message, ThreadSummary
+from src.constants import SUMMARY_MODEL
+from src.metrics import COMPLETION_TOKENS
+from src.thread_store import ThreadStore
+from src.tokens import count_tokens, message_tokens, system_prompt_tokens
+from src.transport import shared_transport
+from src.utils import logger
+
+# 滚动摘要：摘要之后的消息超过阈值时，在后台把较早的消息折叠进线程的摘要，
+# 每轮提示只包含摘要和最近的消息
+class ThreadSummarizer:
+    def __init__(
+        self,
+        store: ThreadStore,
+        enabled: bool,
+        trigger_tokens: int,
+        keep_tokens: int,
+        max_tokens: int,
+    ):
+        self.store = store
+        self.enabled = enabled
+        self.trigger_tokens = trigger_tokens  # 触发摘要的 token 数
+        self.keep_tokens = keep_tokens  # 保留不折叠的最新消息 token 数
+        self.max_tokens = max_tokens  # 摘要的最大 token 数
+        self.summaries = 0  # 完成的摘要数
+        self.folded_messages = 0  # 折叠进摘要的消息数
+        self._running: Dict[int, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    # 读取线程的摘要，未启用时返回 None
+    async def get(self, thread_id: int) -> Optional[ThreadSummary]:
+        if not self.enabled:
+            return None
+        return await self.store.get_summary(thread_id)
+
+    # 摘要之后的消息；历史按 ID 排序，二分查找起点，不遍历已折叠的消息
+    def recent(
+        self, history: List[Tuple[int, Message]], summary: Optional[ThreadSummary]
+    ) -> List[Message]:
+        start = bisect_right(history, summary.through_id, key=lambda item: item[0]) if summary else 0
+        return [message for _, message in islice(history, start, None)]
+
+    # 摘要之后的消息超过阈值时，在后台开始摘要，不等待完成
+    def maybe_summarize(
+        self,
+        thread_id: int,
+        guild_id: Optional[int],
+        model: str,
+        history: List[Tuple[int, Message]],
+        summary: Optional[ThreadSummary],
+    ):
+        if not self.enabled or thread_id in self._running:
+            return
+        through_id = summary.through_id if summary else 0
+        pending = [(i, m) for i, m in history if i > through_id]
+        if sum(message_tokens(model, m) for _, m in pending) <= self.trigger_tokens:
+            return
+        # 保留最新的消息，其余的折叠进摘要
+        keep = 0
+        split = len(pending)
+        while split > 0:
+            cost = message_tokens(model, pending[split - 1][1])
+            if keep + cost > self.keep_tokens:
+                break
+            keep += cost
+            split -= 1
+        fold = pending[:split]
+        if not fold:
+            return
+        task = asyncio.get_running_loop().create_task(
+            self._summarize(thread_id, guild_id, model, summary, fold)
+        )
+        self._running[thread_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda _: self._running.pop(thread_id, None))
+
+    async def _summarize(
+        self,
+        thread_id: int,
+        guild_id: Optional[int],
+        model: str,
+        summary: Optional[ThreadSummary],
+        fold: List[Tuple[int, Message]],
+    ):
+        model = SUMMARY_MODEL or model
+        bot_name = completion.MY_BOT_NAME
+        instructions = (
+            f"Summarize the conversation between the users and {bot_name} below. "
+            f"Keep names, facts, decisions and open questions needed to continue "
+            f"the conversation. Merge in the previous summary if there is one. "
+            f"Reply with the summary only."
+        )
+        transcript = Conversation([m for _, m in fold]).render()
+        if summary is not None:
+            transcript = f"Previous summary: {summary.text}\n\n{transcript}"
+        estimated_tokens = (
+            system_prompt_tokens(model, instructions)
+            + system_prompt_tokens(model, transcript)
+            + self.max_tokens
+        )
+        try:
+            # 与回复共用排队和令牌预算
+            async with completion.completion_scheduler.slot(
+                guild_id=guild_id,
+                user=f"summary:{thread_id}",
+                model=model,
+                estimated_tokens=estimated_tokens,
+            ):
+                response = await shared_transport.completion_client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": instructions},
+                        {"role": "user", "content": transcript},
+                    ],
+                    temperature=0,
+                    max_tokens=self.max_tokens,
+                )
+                text = (response.choices[0].message.content or "").strip()
+                if response.usage:
+                    prompt_tokens = response.usage.prompt_tokens
+                    reply_tokens = response.usage.completion_tokens
+                else:
+                    prompt_tokens = estimated_tokens - self.max_tokens
+                    reply_tokens = count_tokens(model, text)
+                # 摘要的用量同样计入令牌预算和用量指标
+                completion.completion_scheduler.record_usage(
+                    model, estimated_tokens, prompt_tokens + reply_tokens
+                )
+            COMPLETION_TOKENS.inc(prompt_tokens, guild=guild_id, model=model, kind="prompt")
+            COMPLETION_TOKENS.inc(reply_tokens, guild=guild_id, model=model, kind="completion")
+        except Exception as e:
+            # 摘要失败不影响回复，下一轮会重试
+            logger.warning(f"Failed to summarize thread {thread_id}: {e}")
+            return
+        if not text:
+            return
+        self.store.set_summary(
+            thread_id, ThreadSummary(text=text, through_id=fold[-1][0])
+        )
+        self.summaries += 1
+        self.folded_messages += len(fold)
+        logger.info(f"Folded {len(fold)} messages into the summary of thread {thread_id}")
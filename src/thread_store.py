@@ -0,0 +1,289 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from src.base import ThreadConfig, ThreadSummary
+from src.cache import TTLCache
+from src.constants import (
+    THREAD_STORE_PATH,
+    THREAD_STORE_FLUSH_SECONDS,
+    THREAD_STORE_CACHE_SIZE,
+    THREAD_STORE_ARCHIVED_TTL_SECONDS,
+)
+from src.utils import logger
+
+# 线程配置存储的接口
+class ThreadStore(ABC):
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # 读取线程配置，不存在时返回 None
+    @abstractmethod
+    async def get(self, thread_id: int) -> Optional[ThreadConfig]:
+        ...
+
+    # 保存线程配置，不等待写入完成
+    @abstractmethod
+    def set(self, thread_id: int, config: ThreadConfig):
+        ...
+
+    # 线程被锁定时立即删除配置
+    @abstractmethod
+    def expire(self, thread_id: int):
+        ...
+
+    # 记录线程的归档状态，归档超过一定时间的配置会被清理
+    @abstractmethod
+    def mark_archived(self, thread_id: int, archived: bool):
+        ...
+
+    # 读取线程的滚动摘要，不存在时返回 None
+    @abstractmethod
+    async def get_summary(self, thread_id: int) -> Optional[ThreadSummary]:
+        ...
+
+    # 保存线程的滚动摘要，不等待写入完成
+    @abstractmethod
+    def set_summary(self, thread_id: int, summary: ThreadSummary):
+        ...
+
+
+# 仅保存在内存中的线程配置，重启后丢失；归档超过一定时间的线程同样会被清理
+class MemoryThreadStore(ThreadStore):
+    def __init__(self, archived_ttl: float):
+        self.archived_ttl = archived_ttl
+        self._configs: Dict[int, ThreadConfig] = {}
+        self._summaries: Dict[int, ThreadSummary] = {}
+        self._archived: "OrderedDict[int, float]" = OrderedDict()  # 按归档时间排序
+
+    async def get(self, thread_id: int) -> Optional[ThreadConfig]:
+        return self._configs.get(thread_id)
+
+    def set(self, thread_id: int, config: ThreadConfig):
+        self._configs[thread_id] = config
+        self._archived.pop(thread_id, None)
+        self._prune()
+
+    def expire(self, thread_id: int):
+        self._configs.pop(thread_id, None)
+        self._summaries.pop(thread_id, None)
+        self._archived.pop(thread_id, None)
+
+    def mark_archived(self, thread_id: int, archived: bool):
+        self._archived.pop(thread_id, None)
+        if archived:
+            self._archived[thread_id] = time.time()
+        self._prune()
+
+    async def get_summary(self, thread_id: int) -> Optional[ThreadSummary]:
+        return self._summaries.get(thread_id)
+
+    def set_summary(self, thread_id: int, summary: ThreadSummary):
+        self._summaries[thread_id] = summary
+
+    # 删除归档时间过长的线程配置和摘要，只需检查最早归档的线程
+    def _prune(self):
+        cutoff = time.time() - self.archived_ttl
+        while self._archived:
+            thread_id, archived_at = next(iter(self._archived.items()))
+            if archived_at >= cutoff:
+                break
+            self.expire(thread_id)
+
+
+# 基于本地 SQLite 的线程配置：首次访问时按需加载，写入先进入内存，
+# 由后台任务批量写入磁盘，创建线程时不需要等待磁盘
+class SQLiteThreadStore(ThreadStore):
+    def __init__(self, path: str, flush_interval: float, cache_size: int, archived_ttl: float):
+        self.flush_interval = flush_interval
+        self.archived_ttl = archived_ttl
+        self._cache: TTLCache[ThreadConfig] = TTLCache(maxsize=cache_size, ttl=float("inf"))
+        self._pending_configs: Dict[int, Optional[ThreadConfig]] = {}  # None 表示删除
+        self._pending_archived: Dict[int, Optional[float]] = {}
+        self._summaries: TTLCache[ThreadSummary] = TTLCache(maxsize=cache_size, ttl=float("inf"))
+        self._pending_summaries: Dict[int, Optional[ThreadSummary]] = {}  # None 表示删除
+        self._lock = threading.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS thread_configs ("
+            "thread_id INTEGER PRIMARY KEY, model TEXT NOT NULL, "
+            "max_tokens INTEGER NOT NULL, temperature REAL NOT NULL, "
+            "updated_at REAL NOT NULL, archived_at REAL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS thread_configs_archived_at "
+            "ON thread_configs (archived_at)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS thread_summaries ("
+            "thread_id INTEGER PRIMARY KEY, text TEXT NOT NULL, "
+            "through_id INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    async def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._run_flusher())
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    async def get(self, thread_id: int) -> Optional[ThreadConfig]:
+        if thread_id in self._pending_configs:
+            return self._pending_configs[thread_id]
+        config = self._cache.get(thread_id)
+        if config is None:
+            config = await asyncio.to_thread(self._load, thread_id)
+            if config is not None:
+                self._cache.set(thread_id, config)
+        return config
+
+    def set(self, thread_id: int, config: ThreadConfig):
+        self._cache.set(thread_id, config)
+        self._pending_configs[thread_id] = config
+        self._pending_archived[thread_id] = None
+
+    def expire(self, thread_id: int):
+        self._cache.pop(thread_id)
+        self._pending_configs[thread_id] = None
+        self._pending_archived.pop(thread_id, None)
+        self._summaries.pop(thread_id)
+        self._pending_summaries[thread_id] = None
+
+    def mark_archived(self, thread_id: int, archived: bool):
+        self._pending_archived[thread_id] = time.time() if archived else None
+
+    async def get_summary(self, thread_id: int) -> Optional[ThreadSummary]:
+        if thread_id in self._pending_summaries:
+            return self._pending_summaries[thread_id]
+        summary = self._summaries.get(thread_id)
+        if summary is None:
+            summary = await asyncio.to_thread(self._load_summary, thread_id)
+            if summary is not None:
+                self._summaries.set(thread_id, summary)
+        return summary
+
+    def set_summary(self, thread_id: int, summary: ThreadSummary):
+        self._summaries.set(thread_id, summary)
+        self._pending_summaries[thread_id] = summary
+
+    # 将积累的写入批量写入磁盘
+    async def flush(self):
+        configs, self._pending_configs = self._pending_configs, {}
+        archived, self._pending_archived = self._pending_archived, {}
+        summaries, self._pending_summaries = self._pending_summaries, {}
+        if configs or archived or summaries:
+            await asyncio.to_thread(self._write, configs, archived, summaries)
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                await asyncio.to_thread(self._prune)
+            except Exception as e:
+                logger.exception(e)
+
+    def _load(self, thread_id: int) -> Optional[ThreadConfig]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT model, max_tokens, temperature FROM thread_configs "
+                "WHERE thread_id = ?",
+                (thread_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return ThreadConfig(model=row[0], max_tokens=row[1], temperature=row[2])
+
+    def _load_summary(self, thread_id: int) -> Optional[ThreadSummary]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT text, through_id FROM thread_summaries WHERE thread_id = ?",
+                (thread_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return ThreadSummary(text=row[0], through_id=row[1])
+
+    def _write(
+        self,
+        configs: Dict[int, Optional[ThreadConfig]],
+        archived: Dict[int, Optional[float]],
+        summaries: Dict[int, Optional[ThreadSummary]],
+    ):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO thread_configs "
+                    "(thread_id, model, max_tokens, temperature, updated_at, archived_at) "
+                    "VALUES (?, ?, ?, ?, ?, NULL)",
+                    [
+                        (thread_id, c.model, c.max_tokens, c.temperature, now)
+                        for thread_id, c in configs.items()
+                        if c is not None
+                    ],
+                )
+                self._db.executemany(
+                    "DELETE FROM thread_configs WHERE thread_id = ?",
+                    [(thread_id,) for thread_id, c in configs.items() if c is None],
+                )
+                self._db.executemany(
+                    "UPDATE thread_configs SET archived_at = ? WHERE thread_id = ?",
+                    [(archived_at, thread_id) for thread_id, archived_at in archived.items()],
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO thread_summaries "
+                    "(thread_id, text, through_id, updated_at) VALUES (?, ?, ?, ?)",
+                    [
+                        (thread_id, summary.text, summary.through_id, now)
+                        for thread_id, summary in summaries.items()
+                        if summary is not None
+                    ],
+                )
+                self._db.executemany(
+                    "DELETE FROM thread_summaries WHERE thread_id = ?",
+                    [(thread_id,) for thread_id, summary in summaries.items() if summary is None],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    # 删除归档时间过长的线程配置和摘要
+    def _prune(self):
+        cutoff = time.time() - self.archived_ttl
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM thread_summaries WHERE thread_id IN "
+                "(SELECT thread_id FROM thread_configs WHERE archived_at < ?)",
+                (cutoff,),
+            )
+            self._db.execute(
+                "DELETE FROM thread_configs WHERE archived_at < ?", (cutoff,)
+            )
+
+
+# 根据配置创建线程配置存储
+def create_thread_store() -> ThreadStore:
+    if THREAD_STORE_PATH:
+        return SQLiteThreadStore(
+            path=THREAD_STORE_PATH,
+            flush_interval=THREAD_STORE_FLUSH_SECONDS,
+            cache_size=THREAD_STORE_CACHE_SIZE,
+            archived_ttl=THREAD_STORE_ARCHIVED_TTL_SECONDS,
+        )
+    return MemoryThreadStore(archived_ttl=THREAD_STORE_ARCHIVED_TTL_SECONDS)
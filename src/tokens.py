@@ -0,0 +1,111 @@
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+import tiktoken
+
+from src.base import Message
+from src.constants import MODEL_CONTEXT_WINDOWS, DEFAULT_CONTEXT_WINDOW, TOKENIZER_RETRY_SECONDS
+from src.utils import logger
+
+# OpenAI 对话格式的固定开销
+TOKENS_PER_MESSAGE = 3  # 每条消息的角色和分隔符
+TOKENS_PER_NAME = 1  # 带 name 字段的消息
+REPLY_PRIMING_TOKENS = 3  # 回复开头的引导标记
+
+_encodings: Dict[str, "tiktoken.Encoding"] = {}  # 已加载的分词器
+_retry_at: Dict[str, float] = {}  # 加载失败的分词器下次重试的时间
+_loading: Set[str] = set()  # 正在后台加载的分词器
+
+# 加载模型的分词器，首次使用时需要下载 BPE 文件，不能在事件循环中调用。
+# 失败时（例如离线环境）不缓存结果，记录警告并在一段时间后重试
+def load_encoding(model: str) -> Optional["tiktoken.Encoding"]:
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        _retry_at[model] = time.monotonic() + TOKENIZER_RETRY_SECONDS
+        logger.warning(
+            f"Tokenizer for {model} unavailable, estimating tokens "
+            f"(retrying in {TOKENIZER_RETRY_SECONDS}s): {e}"
+        )
+        return None
+    _encodings[model] = encoding
+    return encoding
+
+# 预加载分词器，启动时在工作线程中调用
+def preload_encodings(models: Iterable[str]):
+    for model in dict.fromkeys(models):
+        if model not in _encodings:
+            load_encoding(model)
+
+def _load_in_background(model: str):
+    try:
+        load_encoding(model)
+    finally:
+        _loading.discard(model)
+
+# 获取已加载的分词器；还没有加载时在后台线程中加载，加载完成前返回 None，改用估算
+def _encoding(model: str) -> Optional["tiktoken.Encoding"]:
+    encoding = _encodings.get(model)
+    if (
+        encoding is None
+        and model not in _loading
+        and time.monotonic() >= _retry_at.get(model, 0.0)
+    ):
+        _loading.add(model)
+        threading.Thread(target=_load_in_background, args=(model,), daemon=True).start()
+    return encoding
+
+# 用分词器计算的 token 数，只缓存精确结果
+@lru_cache(maxsize=65536)
+def _exact_tokens(model: str, text: str) -> int:
+    return len(_encodings[model].encode(text, disallowed_special=()))
+
+# 计算文本的 token 数
+def count_tokens(model: str, text: str) -> int:
+    if _encoding(model) is None:
+        # 保守估算：约每 3 个 UTF-8 字节一个 token
+        return len(text.encode("utf-8")) // 3 + 1
+    return _exact_tokens(model, text)
+
+# 按消息缓存 token 数，每轮只需对新消息分词；分词器加载前后的结果分开缓存
+@lru_cache(maxsize=65536)
+def _message_tokens(model: str, message: Message, exact: bool) -> int:
+    return (
+        TOKENS_PER_MESSAGE
+        + TOKENS_PER_NAME
+        + count_tokens(model, message.user)
+        + count_tokens(model, message.text or "")
+    )
+
+# 计算单条消息的 token 数
+def message_tokens(model: str, message: Message) -> int:
+    return _message_tokens(model, message, model in _encodings)
+
+# 系统提示的 token 数
+def system_prompt_tokens(model: str, system_prompt: str) -> int:
+    return TOKENS_PER_MESSAGE + count_tokens(model, system_prompt)
+
+# 将对话装入模型的上下文窗口：为回复预留 max_tokens，保留能放下的最新消息
+def pack_messages(
+    model: str, messages: Sequence[Message], system_tokens: int, max_tokens: int
+) -> List[Message]:
+    budget = (
+        MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+        - max_tokens
+        - REPLY_PRIMING_TOKENS
+        - system_tokens
+    )
+    packed = []
+    for message in reversed(messages):
+        cost = message_tokens(model, message)
+        if cost > budget:
+            break
+        budget -= cost
+        packed.append(message)
+    packed.reverse()
+    return packed
@@ -0,0 +1,149 @@
+import importlib.util
+from typing import TYPE_CHECKING, Optional
+
+import aiohttp
+
+from src.metrics import registry
+from src.constants import (
+    OPENAI_BASE_URL,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_SECONDS,
+    HTTP_CONNECT_TIMEOUT_SECONDS,
+    OPENAI_READ_TIMEOUT_SECONDS,
+    DISCORD_MAX_CONNECTIONS,
+)
+
+# openai 和 httpx 导入较慢，只在第一次请求（或 preload）时导入
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI
+
+    from src.http_pool import PooledTransport
+
+# 安装了 h2 时启用 HTTP/2
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+# 完成和审查共用的 HTTP 连接池，随 Discord 客户端创建和关闭
+class SharedTransport:
+    def __init__(self, base_url: Optional[str] = None):
+        self.base_url = base_url
+        self.transport: Optional["PooledTransport"] = None
+        self._http_client: Optional["httpx.AsyncClient"] = None
+        self._completion_client: Optional["AsyncOpenAI"] = None
+        self._moderation_client: Optional["AsyncOpenAI"] = None
+        self._discord_connector: Optional[aiohttp.TCPConnector] = None
+
+    # 导入 openai 和 httpx；可以在工作线程中提前调用，避免第一次请求时阻塞事件循环
+    def preload(self):
+        import httpx  # noqa: F401
+        import openai  # noqa: F401
+
+        from src import http_pool  # noqa: F401
+
+    def _http(self) -> "httpx.AsyncClient":
+        import httpx
+
+        from src.http_pool import PooledTransport
+
+        if self._http_client is None:
+            self.transport = PooledTransport(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+                ),
+            )
+            self._http_client = httpx.AsyncClient(
+                transport=self.transport,
+                timeout=self.timeout,
+                http2=HTTP2_AVAILABLE,
+            )
+        return self._http_client
+
+    @property
+    def timeout(self) -> "httpx.Timeout":
+        import httpx
+
+        return httpx.Timeout(
+            OPENAI_READ_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS
+        )
+
+    # 完成请求的客户端，重试由 retry_policy 负责
+    @property
+    def completion_client(self) -> "AsyncOpenAI":
+        if self._completion_client is None:
+            from openai import AsyncOpenAI
+
+            self._completion_client = AsyncOpenAI(
+                base_url=self.base_url,
+                http_client=self._http(),
+                timeout=self.timeout,
+                max_retries=0,
+            )
+        return self._completion_client
+
+    # 审查请求的客户端，使用 OpenAI 客户端自带的重试
+    @property
+    def moderation_client(self) -> "AsyncOpenAI":
+        if self._moderation_client is None:
+            from openai import AsyncOpenAI
+
+            self._moderation_client = AsyncOpenAI(
+                base_url=self.base_url,
+                http_client=self._http(),
+                timeout=self.timeout,
+            )
+        return self._moderation_client
+
+    # Discord 客户端使用的连接池，需要在事件循环中创建
+    def discord_connector(self) -> aiohttp.TCPConnector:
+        if self._discord_connector is None or self._discord_connector.closed:
+            self._discord_connector = aiohttp.TCPConnector(
+                limit=DISCORD_MAX_CONNECTIONS,
+                keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+                ttl_dns_cache=300,
+            )
+        return self._discord_connector
+
+    async def close(self):
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self._http_client = None
+        self._completion_client = None
+        self._moderation_client = None
+        self.transport = None
+
+
+shared_transport = SharedTransport(base_url=OPENAI_BASE_URL)
+
+registry.gauge(
+    "gptbot_openai_pool_in_flight",
+    "OpenAI requests currently holding a pooled connection",
+    lambda: shared_transport.transport.in_flight if shared_transport.transport else 0,
+)
+registry.gauge(
+    "gptbot_openai_pool_peak_in_flight",
+    "Most OpenAI requests holding pooled connections at once since startup",
+    lambda: shared_transport.transport.peak_in_flight if shared_transport.transport else 0,
+)
+registry.gauge(
+    "gptbot_openai_pool_saturation",
+    "Fraction of the OpenAI connection pool in use",
+    lambda: shared_transport.transport.saturation if shared_transport.transport else 0,
+)
+registry.counter_func(
+    "gptbot_openai_requests_total",
+    "Requests sent through the shared OpenAI connection pool",
+    lambda: shared_transport.transport.requests if shared_transport.transport else 0,
+)
+registry.counter_func(
+    "gptbot_openai_saturated_requests_total",
+    "OpenAI requests sent while the connection pool was full",
+    lambda: shared_transport.transport.saturated_requests
+    if shared_transport.transport
+    else 0,
+)
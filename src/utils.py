@@ -2,16 +2,20 @@ from src.constants import (
     ALLOWED_SERVER_IDS,
 )
 import logging
+import sys
 from src.base import Message
 from discord import Message as DiscordMessage
-from typing import Optional, List
+from typing import Optional
 import discord
-from src.constants import MAX_CHARS_PER_REPLY_MSG, INACTIVATE_THREAD_PREFIX
+from src.constants import INACTIVATE_THREAD_PREFIX
+from src.metrics import CLOSE_THREAD_SECONDS
+from src.outbound import outbound
 
 # 获取logger对象
 logger = logging.getLogger(__name__)
 
-# 将 Discord 中的消息对象转换为自定义的消息对象
+# 将 Discord 中的消息对象转换为自定义的消息对象；
+# 用户名经过驻留，同一用户的所有消息共享同一个字符串
 def discord_message_to_message(message: DiscordMessage) -> Optional[Message]:
     if (
         message.type == discord.MessageType.thread_starter_message
@@ -22,41 +26,27 @@ def discord_message_to_message(message: DiscordMessage) -> Optional[Message]:
         # 如果是线程的初始消息，且有引用的消息，且该消息有嵌入内容且至少有一个字段
         field = message.reference.cached_message.embeds[0].fields[0]
         if field.value:
-            return Message(user=field.name, text=field.value)
+            return Message(user=sys.intern(field.name), text=field.value)
     else:
         # 如果不是线程的初始消息，或者没有引用的消息
         if message.content:
-            return Message(user=message.author.name, text=message.content)
+            return Message(user=sys.intern(message.author.name), text=message.content)
     return None
 
-# 将长消息拆分为多条不超过限制长度的消息
-def split_into_shorter_messages(message: str) -> List[str]:
-    return [
-        message[i : i + MAX_CHARS_PER_REPLY_MSG]
-        for i in range(0, len(message), MAX_CHARS_PER_REPLY_MSG)
-    ]
-
-# 检查上一条消息是否已经过时
-def is_last_message_stale(
-    interaction_message: DiscordMessage, last_message: DiscordMessage, bot_id: str
-) -> bool:
-    return (
-        last_message
-        and last_message.id != interaction_message.id
-        and last_message.author
-        and last_message.author.id != bot_id
-    )
-
 # 关闭线程
 async def close_thread(thread: discord.Thread):
-    await thread.edit(name=INACTIVATE_THREAD_PREFIX)
-    await thread.send(
-        embed=discord.Embed(
-            description="**Thread closed** - Context limit reached, closing...",
-            color=discord.Color.blue(),
+    with CLOSE_THREAD_SECONDS.time():
+        await thread.edit(name=INACTIVATE_THREAD_PREFIX)
+        await outbound.send(
+            thread,
+            embeds=[
+                discord.Embed(
+                    description="**Thread closed** - Context limit reached, closing...",
+                    color=discord.Color.blue(),
+                )
+            ],
         )
-    )
-    await thread.edit(archived=True, locked=True)
+        await thread.edit(archived=True, locked=True)
 
 # 检查是否应该阻塞操作
 def should_block(guild: Optional[discord.Guild]) -> bool:
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from types import FrameType
+from typing import Optional
+
+from src.metrics import registry
+from src.utils import logger
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LOOP_LAG_SECONDS = registry.histogram(
+    "gptbot_event_loop_lag_seconds",
+    "Delay between when the watchdog heartbeat was due and when it ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+LOOP_STALLS = registry.counter(
+    "gptbot_event_loop_stalls_total",
+    "Event loop stalls longer than the threshold, by blocking function",
+    ["function"],
+)
+
+# 栈中最内层属于 src/ 的帧，即最可能造成阻塞的本项目函数
+def _blame(frame: Optional[FrameType]) -> str:
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.startswith(SRC_DIR):
+            return f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+# 折叠栈格式（最外层在前，以分号分隔），可直接生成火焰图
+def _collapse(frame: Optional[FrameType]) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+# 事件循环看门狗：循环内的心跳任务记录卡顿时间，
+# 独立线程发现心跳超过阈值未更新时采集事件循环线程的栈，指出阻塞的函数。
+# 也可以在运行时开启采样分析，定期采集事件循环线程的栈
+class LoopWatchdog:
+    def __init__(
+        self,
+        threshold: float,
+        interval: float,
+        profile_interval: float,
+        profile_dir: str,
+    ):
+        self.threshold = threshold  # 超过这个时间未更新心跳视为卡顿（秒）
+        self.interval = interval  # 心跳间隔（秒）
+        self.profile_interval = profile_interval  # 采样分析的间隔（秒）
+        self.profile_dir = profile_dir  # 采样结果的输出目录
+        self.stalls = 0  # 发现的卡顿次数
+        self.max_lag = 0.0
+        self.profiling = False
+        self._samples: Counter = Counter()
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        registry.gauge(
+            "gptbot_event_loop_profiling",
+            "Whether sampling profiling of the event loop is on",
+            lambda: int(self.profiling),
+        )
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat = loop.create_task(self._run_heartbeat())
+        self._thread = threading.Thread(target=self._run_monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, self.toggle_profiling)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
+
+    async def stop(self):
+        if self.profiling:
+            self.toggle_profiling()
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    # 开启或关闭采样分析（SIGUSR1），关闭时把结果写入文件
+    def toggle_profiling(self):
+        if not self.profiling:
+            self._samples = Counter()
+            self.profiling = True
+            logger.info("Event loop profiling started")
+            return
+        self.profiling = False
+        samples, self._samples = self._samples, Counter()
+        path = os.path.join(self.profile_dir, f"loop-profile-{int(time.time())}.txt")
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        top = Counter()
+        for stack, count in samples.items():
+            top[stack.rsplit(";", 1)[-1]] += count
+        total = sum(samples.values()) or 1
+        summary = ", ".join(f"{name} {count / total:.0%}" for name, count in top.most_common(5))
+        logger.info(f"Event loop profile written to {path}: {summary}")
+
+    async def _run_heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._beat = now
+            LOOP_LAG_SECONDS.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _run_monitor(self):
+        reported_beat = None
+        while not self._stopped.wait(self.profile_interval if self.profiling else self.interval / 2):
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if self.profiling and frame is not None:
+                self._samples[_collapse(frame)] += 1
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or beat == reported_beat:
+                continue
+            # 每次卡顿只报告一次
+            reported_beat = beat
+            self.stalls += 1
+            function = _blame(frame)
+            LOOP_STALLS.inc(function=function)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            logger.warning(
+                f"Event loop blocked for {stalled:.2f}s in {function}\n{stack}"
+            )